@@ -0,0 +1,490 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2011 by science+computing ag
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+#
+
+"""
+Benchmarks for Quickimport.
+
+This script generates a synthetic ``sys.path`` layout (many directories
+with modules, nested packages, zipped and unzipped eggs and directories
+without any modules) and imports modules from it in a fresh interpreter
+for each scenario. A :class:`FilesystemShim` counts the file system
+calls and optionally delays each call to simulate a file server with
+a high latency.
+
+Usage::
+
+    python benchQuickimport.py [--dirs N] [--modules M] [--latency SECONDS] ...
+
+The exit code is 1, if a Quickimport scenario needs more file system
+calls (or, if a latency is given, more time) than the stock import
+machinery multiplied by the respective threshold.
+
+With ``--threads N`` the modules get imported by N concurrent threads.
+Together with a latency this shows the contention between importing 
+threads.
+
+With ``--memory`` the script measures the memory of the directory 
+cache for all directories of the layout instead: the frozenset per 
+directory used by earlier versions of Quickimport compared to 
+:class:`quickimport.CachedDir`. The exit code is 1, if the 
+:class:`~quickimport.CachedDir` entries need more memory.
+
+On Python 2 the import machinery is implemented in C. Therefore
+the shim only sees the calls issued by Quickimport itself and
+by Python code and the thresholds are not checked.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+import sys
+import os
+import json
+import time
+import shutil
+import tempfile
+import zipfile
+import subprocess
+
+PY3 = sys.version_info[0] >= 3
+
+timer = getattr(time, "perf_counter", time.time)
+
+#: The benchmark scenarios: the name and the flags for
+#: :func:`quickimport.install` or ``None`` for the stock import machinery.
+SCENARIOS = [("stock", None),
+             ("install", ""),
+             ("filterDirs", "filterDirs"),
+             ]
+
+
+class FilesystemShim(object):
+    """
+    A context manager, that wraps the file system functions used by the
+    import machinery. Each wrapper counts its calls and sleeps
+    *latency* seconds.
+
+    The counters are grouped by the name of the wrapped function.
+    """
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.counts = {}
+        self.patches = []
+
+    def targets(self):
+        """
+        Get the ``(object, attribute, name)`` triples to wrap.
+        """
+        import quickimport
+        osModule = sys.modules[os.name]
+        result = []
+        for name in ("stat", "lstat", "listdir", "scandir"):
+            for obj in (os, osModule):
+                if hasattr(obj, name):
+                    result.append((obj, name, name))
+        if quickimport.scandir is not None:
+            result.append((quickimport, "scandir", "scandir"))
+        if PY3:
+            import _io
+            import builtins
+            if hasattr(_io, "open_code"):
+                result.append((_io, "open_code", "open"))
+            else:
+                result.append((_io, "FileIO", "open"))
+            result.append((builtins, "open", "open"))
+        else:
+            import __builtin__
+            result.append((__builtin__, "open", "open"))
+        return result
+
+    def wrap(self, func, name):
+        counts = self.counts
+        latency = self.latency
+        sleep = time.sleep
+        def wrapper(*args, **kwargs):
+            counts[name] = counts.get(name, 0) + 1
+            if latency:
+                sleep(latency)
+            return func(*args, **kwargs)
+        return wrapper
+
+    def __enter__(self):
+        # wrap each function only once, even if several modules refer to it
+        wrappers = {}
+        for obj, attr, name in self.targets():
+            func = getattr(obj, attr)
+            key = (id(func), name)
+            if key not in wrappers:
+                wrappers[key] = self.wrap(func, name)
+            self.patches.append((obj, attr, func))
+            setattr(obj, attr, wrappers[key])
+        return self
+
+    def __exit__(self, *args):
+        for obj, attr, func in reversed(self.patches):
+            setattr(obj, attr, func)
+        del self.patches[:]
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+
+def writeModule(*path):
+    with open(os.path.join(*path), "w") as f:
+        f.write("VALUE = %r\n" % (path[-1],))
+
+
+def makeEgg(filename, package):
+    eggZip = zipfile.ZipFile(filename, "w")
+    try:
+        eggZip.writestr(package + "/__init__.py", "")
+        eggZip.writestr(package + "/mod.py", "VALUE = 1\n")
+        eggZip.writestr("EGG-INFO/PKG-INFO", "Metadata-Version: 1.0\nName: %s\n" % (package,))
+    finally:
+        eggZip.close()
+
+
+def makeLayout(root, dirs=50, modules=20, packages=2, depth=3, eggs=2,
+               emptyDirs=10, missing=10):
+    """
+    Create a synthetic ``sys.path`` layout below *root*.
+
+    :param dirs: the number of directories with modules
+    :param modules: the number of modules per directory
+    :param packages: the number of nested packages per directory
+    :param depth: the nesting depth of the packages
+    :param eggs: the number of zipped and of unzipped eggs each
+    :param emptyDirs: the number of directories without modules
+    :param missing: the number of imports, that fail
+    :returns: a dict with the keys ``path`` (the list of directories),
+        ``imports`` (the modules to import) and ``missing`` (the
+        names of modules, that do not exist).
+    """
+    path = []
+    imports = []
+    for i in range(dirs):
+        d = os.path.join(root, "dir%03d" % (i,))
+        os.mkdir(d)
+        path.append(d)
+        for j in range(modules):
+            writeModule(d, "bq%03dm%03d.py" % (i, j))
+        imports.append("bq%03dm%03d" % (i, modules - 1))
+        for p in range(packages):
+            pkgPath = d
+            pkgName = []
+            for level in range(depth):
+                name = "bq%03dp%d" % (i, p) if level == 0 else "s%d" % (level,)
+                pkgPath = os.path.join(pkgPath, name)
+                pkgName.append(name)
+                os.mkdir(pkgPath)
+                writeModule(pkgPath, "__init__.py")
+                for j in range(3):
+                    writeModule(pkgPath, "m%d.py" % (j,))
+            imports.append(".".join(pkgName + ["m2"]))
+        # data files, that are no modules
+        with open(os.path.join(d, "README.txt"), "w") as f:
+            f.write("data\n")
+    for i in range(emptyDirs):
+        d = os.path.join(root, "empty%03d" % (i,))
+        os.mkdir(d)
+        with open(os.path.join(d, "data.txt"), "w") as f:
+            f.write("data\n")
+        # interleave the empty directories with the others
+        path.insert(len(path) * (i + 1) // (emptyDirs + 1), d)
+    for i in range(eggs):
+        package = "bqegg%d" % (i,)
+        filename = os.path.join(root, "%s-1.0-py%d.%d.egg" % ((package,) + sys.version_info[:2]))
+        makeEgg(filename, package)
+        path.append(filename)
+        imports.append(package + ".mod")
+        package = "bqdiregg%d" % (i,)
+        eggDir = os.path.join(root, "%s-1.0-py%d.%d.egg" % ((package,) + sys.version_info[:2]))
+        os.mkdir(eggDir)
+        os.mkdir(os.path.join(eggDir, package))
+        writeModule(eggDir, package, "__init__.py")
+        writeModule(eggDir, package, "mod.py")
+        path.append(eggDir)
+        imports.append(package + ".mod")
+    import compileall
+    compileall.compile_dir(root, quiet=1)
+    return dict(path=path, imports=imports,
+                missing=["bqmissing%d" % (i,) for i in range(missing)])
+
+
+def importModules(imports, missing):
+    for name in imports:
+        __import__(name)
+    for name in missing:
+        try:
+            __import__(name)
+        except ImportError:
+            pass
+        else:
+            raise AssertionError("module %r exists" % (name,))
+
+
+def runScenario(layout, flags, latency=0.0, threads=1):
+    """
+    Import the modules of *layout* and measure the file system calls
+    and the wall time. Call this function in a fresh interpreter.
+
+    :param flags: the flags for :func:`quickimport.install` or
+        ``None`` to measure the stock import machinery.
+    :param threads: the number of threads, that import the modules
+        concurrently. Each thread imports a share of the modules.
+    :returns: a dict with the keys ``calls``, ``counts`` and ``time``
+    """
+    import quickimport
+    import threading
+    sys.path[0:0] = layout["path"]
+    shim = FilesystemShim(latency)
+    errors = []
+    def run(imports, missing):
+        try:
+            importModules(imports, missing)
+        except Exception as e:
+            errors.append(e)
+    t0 = timer()
+    with shim:
+        if flags is not None:
+            quickimport.install(flags)
+        if threads > 1:
+            workers = [threading.Thread(target=run, args=(layout["imports"][i::threads],
+                                                          layout["missing"][i::threads]))
+                       for i in range(threads)]
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+        else:
+            run(layout["imports"], layout["missing"])
+    wallTime = timer() - t0
+    if errors:
+        raise errors[0]
+    return dict(calls=shim.total, counts=shim.counts, time=wallTime)
+
+
+def runScenarioInSubprocess(layoutFile, flags, latency=0.0, threads=1):
+    cmd = [sys.executable, "-B", "-S", os.path.abspath(__file__),
+           "--run-scenario", layoutFile, "--latency", repr(latency),
+           "--threads", str(threads)]
+    if flags is not None:
+        cmd.extend(["--flags", flags])
+    output = subprocess.check_output(cmd)
+    return json.loads(output.decode("utf-8").splitlines()[-1])
+
+
+def runBenchmark(root, scenarios=None, latency=0.0, repeat=1, threads=1, **layoutArgs):
+    """
+    Create a layout in the empty directory *root* (see :func:`makeLayout`)
+    and run each scenario *repeat* times in a fresh interpreter.
+
+    :returns: a list of ``(name, result)`` tuples. The result is the
+        result of :func:`runScenario` with the smallest wall time.
+    """
+    if scenarios is None:
+        scenarios = SCENARIOS
+    layout = makeLayout(root, **layoutArgs)
+    layoutFile = os.path.join(root, "layout.json")
+    with open(layoutFile, "w") as f:
+        json.dump(layout, f)
+    results = []
+    for name, flags in scenarios:
+        runs = [runScenarioInSubprocess(layoutFile, flags, latency, threads) for _ in range(repeat)]
+        results.append((name, min(runs, key=lambda r: r["time"])))
+    return results
+
+
+def checkResults(results, syscallThreshold=1.0, timeThreshold=None):
+    """
+    Compare the results of the Quickimport scenarios with the result
+    of the first scenario (the stock import machinery).
+
+    :returns: a list of messages describing the regressions
+    """
+    regressions = []
+    baseName, base = results[0]
+    for name, result in results[1:]:
+        if result["calls"] > base["calls"] * syscallThreshold:
+            regressions.append("%s: %d file system calls, %s: %d" %
+                               (name, result["calls"], baseName, base["calls"]))
+        if timeThreshold is not None and result["time"] > base["time"] * timeThreshold:
+            regressions.append("%s: %.3fs, %s: %.3fs" %
+                               (name, result["time"], baseName, base["time"]))
+    return regressions
+
+
+def measureCacheMemory(dirs):
+    """
+    Read the directories *dirs* and measure the memory of the directory 
+    cache in the current interpreter using :mod:`tracemalloc`. Requires 
+    Python 3. The names of the entries are read again for each 
+    measurement and are included in the result.
+
+    :returns: a list of ``(name, bytes)`` tuples for the frozenset 
+        based entries of earlier versions and for the 
+        :class:`quickimport.CachedDir` entries.
+    """
+    import tracemalloc
+    import quickimport
+    normcase = os.path.normcase
+
+    class FrozensetDir(frozenset):
+        # the cache entry of earlier versions
+        __slots__ = ("subdirs", "mtime")
+
+    def buildFrozensets():
+        cache = {}
+        for d in dirs:
+            files, subdirs = quickimport.listDir(d)
+            entry = cache[d] = FrozensetDir(map(normcase, files))
+            entry.subdirs = None if subdirs is None else frozenset(map(normcase, subdirs))
+            entry.mtime = None
+        return cache
+
+    def buildCachedDirs():
+        cache = {}
+        for d in dirs:
+            files, subdirs = quickimport.listDir(d)
+            quickimport.updateCache(cache, d, files, subdirs)
+        return cache
+
+    results = []
+    for name, build in (("frozenset", buildFrozensets), ("CachedDir", buildCachedDirs)):
+        # a warm-up run: the one-time growth of interpreter tables like 
+        # the dict of the interned strings must not count
+        build()
+        tracemalloc.start()
+        try:
+            cache = build()
+            size = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        del cache
+        results.append((name, size))
+    return results
+
+
+def printMemoryResults(results, dirs, file=None):
+    if file is None:
+        file = sys.stdout
+    print("%-12s %10s %10s" % ("entries", "bytes", "bytes/dir"), file=file)
+    for name, size in results:
+        print("%-12s %10d %10.1f" % (name, size, float(size) / max(dirs, 1)), file=file)
+
+
+def printResults(results, file=None):
+    if file is None:
+        file = sys.stdout
+    columns = ("stat", "lstat", "listdir", "scandir", "open")
+    print("%-12s %8s" % ("scenario", "calls") +
+          "".join(" %8s" % (c,) for c in columns) + " %9s" % ("time[s]",), file=file)
+    for name, result in results:
+        print("%-12s %8d" % (name, result["calls"]) +
+              "".join(" %8d" % (result["counts"].get(c, 0),) for c in columns) +
+              " %9.4f" % (result["time"],), file=file)
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark Quickimport")
+    parser.add_argument("--dirs", type=int, default=50,
+                        help="the number of directories with modules")
+    parser.add_argument("--modules", type=int, default=20,
+                        help="the number of modules per directory")
+    parser.add_argument("--packages", type=int, default=2,
+                        help="the number of nested packages per directory")
+    parser.add_argument("--depth", type=int, default=3,
+                        help="the nesting depth of the packages")
+    parser.add_argument("--eggs", type=int, default=2,
+                        help="the number of zipped and of unzipped eggs")
+    parser.add_argument("--empty-dirs", type=int, default=10,
+                        help="the number of directories without modules")
+    parser.add_argument("--missing", type=int, default=10,
+                        help="the number of failing imports")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="the delay of each file system call in seconds")
+    parser.add_argument("--threads", type=int, default=1,
+                        help="import the modules using N concurrent threads")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="run each scenario N times and take the fastest run")
+    parser.add_argument("--syscall-threshold", type=float, default=1.0,
+                        help="the maximum ratio of file system calls compared to the stock import")
+    parser.add_argument("--time-threshold", type=float, default=None,
+                        help="the maximum ratio of wall time compared to the stock import. "
+                        "Defaults to 1.0, if a latency is given")
+    parser.add_argument("--memory", action="store_true",
+                        help="measure the memory of the directory cache instead of the imports")
+    parser.add_argument("--keep", metavar="DIR",
+                        help="create the layout in the empty directory DIR and keep it")
+    parser.add_argument("--run-scenario", metavar="LAYOUT", help=argparse.SUPPRESS)
+    parser.add_argument("--flags", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_scenario:
+        with open(args.run_scenario) as f:
+            layout = json.load(f)
+        print(json.dumps(runScenario(layout, args.flags, args.latency, args.threads)))
+        return 0
+
+    layoutArgs = dict(dirs=args.dirs, modules=args.modules,
+                      packages=args.packages, depth=args.depth,
+                      eggs=args.eggs, emptyDirs=args.empty_dirs,
+                      missing=args.missing)
+    if args.memory:
+        if not PY3:
+            print("Python 2: tracemalloc is not available")
+            return 0
+        root = args.keep or tempfile.mkdtemp(prefix="benchQuickimport")
+        try:
+            makeLayout(root, **layoutArgs)
+            dirs = [d for d, subdirs, files in os.walk(root)]
+            results = measureCacheMemory(dirs)
+        finally:
+            if not args.keep:
+                shutil.rmtree(root)
+        printMemoryResults(results, len(dirs))
+        if results[1][1] > results[0][1]:
+            print("REGRESSION: %s: %d bytes, %s: %d bytes" % (results[1] + results[0]))
+            return 1
+        return 0
+
+    root = args.keep or tempfile.mkdtemp(prefix="benchQuickimport")
+    try:
+        results = runBenchmark(root, latency=args.latency, repeat=args.repeat,
+                               threads=args.threads, **layoutArgs)
+    finally:
+        if not args.keep:
+            shutil.rmtree(root)
+    printResults(results)
+    if not PY3:
+        print("Python 2: the calls of the C import machinery are not counted")
+        return 0
+    timeThreshold = args.time_threshold
+    if timeThreshold is None and args.latency:
+        timeThreshold = 1.0
+    regressions = checkResults(results, args.syscall_threshold, timeThreshold)
+    for message in regressions:
+        print("REGRESSION: " + message)
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
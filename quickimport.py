@@ -49,12 +49,25 @@ This function installs a PEP-302 importer and optionally
 eliminates directories without any Python modules or packages from 
 ``sys.path``.
 
+Reading the directories still costs one :c:func:`listdir()` per 
+directory and process. If you pass an index file to :func:`install`,
+Quickimport saves the directory cache to this file and reuses 
+it on the next start. A saved directory listing is reused, if 
+the modification time of the directory is unchanged or, for file 
+systems with unreliable modification times, if the index was
+created for the same *generation* (for instance the release 
+identifier of a read-only installation). Use :func:`rebuildIndex`
+and :func:`verifyIndex` or the command line (see :func:`main`) to
+maintain the index.
+
 Another option to speed up lame imports is to store many modules into 
 a zip-archive. The time required to extract modules from a zip-archive 
 is usually much lower than the time to locate the modules on the 
 file system and to read them. Therefore ``sys.path`` already contains
 an entry for a zip-archive ``pythonXY.zip``. The function 
-:func:`buildZip` creates such a zip-archive for you.
+:func:`buildZip` creates such a zip-archive for you. In the ``archives``
+mode of :func:`install`, Quickimport caches the member names of 
+zip-archives and eggs in ``sys.path`` like directory listings.
 
 .. warning::
    Although the author is using the module quickimport in production, it is 
@@ -64,10 +77,58 @@ an entry for a zip-archive ``pythonXY.zip``. The function
 .. autofunction:: uninstall
 .. autofunction:: isDirRelevant
 .. autofunction:: prepareCache
+.. autofunction:: indexPackageTrees
+.. autofunction:: refreshCache
+.. autofunction:: watchCache
+.. autofunction:: addCacheListener
+.. autofunction:: startTrace
+.. autofunction:: stopTrace
+.. autofunction:: loadTrace
+.. autofunction:: startPrefetch
+.. autofunction:: startProfile
+.. autofunction:: stopProfile
+.. autofunction:: enableLazy
+.. autofunction:: disableLazy
+.. autofunction:: enableStats
+.. autofunction:: stats
+.. autofunction:: dumpStats
+.. autofunction:: parallelMap
+.. autofunction:: rebuildIndex
+.. autofunction:: verifyIndex
+.. autofunction:: getSharedIndexFilename
 .. autofunction:: buildZip
+.. autofunction:: traceApp
+.. autofunction:: optimizePath
+.. autofunction:: buildSnapshot
+.. autofunction:: registerPkgResourcesFinder
+.. autofunction:: findCachedDistributions
+.. autofunction:: main
 .. autofunction:: newQuickimportFinder
 .. autoclass:: NullFinder
 .. autoclass:: QuickimportFinder
+   :members: iter_modules
+.. autoclass:: InvalidationHook
+.. autoclass:: ModuleIndexFinder
+.. autoclass:: NegativeCacheFinder
+.. autoclass:: CachedDir
+   :members: hasCandidate, isFile, isDir
+.. autoclass:: InotifyWatcher
+   :members: watch, start, stop
+.. autoclass:: DirectoryIndex
+   :members: load, lookup, record, lookupArchive, recordArchive, save
+.. autoclass:: SharedIndex
+.. autoclass:: TraceRecorder
+   :members: record, save
+.. autoclass:: Prefetcher
+   :members: take, stop
+.. autoclass:: ResourceCache
+   :members: read
+.. autoclass:: ImportProfiler
+   :members: asDict, writeJson, writeFolded, save
+.. autoclass:: Snapshot
+   :members: load, lookup, isValid, getCode
+.. autoclass:: SnapshotFinder
+.. autoclass:: ArchiveFinder
 
 """
 
@@ -77,16 +138,97 @@ from __future__ import absolute_import
 from __future__ import print_function
 
 import sys
-from imp import acquire_lock, release_lock, find_module, get_suffixes, NullImporter
 import pkgutil
-from pkgutil import ImpLoader
 import os.path
 import re
+import marshal
+import struct
+import errno
+import time
+from stat import S_ISDIR, S_ISREG
+from bisect import bisect_left
+
+PY3 = sys.version_info[0] >= 3
+
+if PY3:
+    from _imp import acquire_lock, release_lock, _fix_co_filename
+    from _thread import allocate_lock, get_ident
+    from importlib import machinery
+    from importlib.util import spec_from_file_location, spec_from_loader, cache_from_source
+    NullImporter = None
+    FinderBase = machinery.FileFinder
+    # the loaders of the default FileFinder path hook in search order 
+    loaderDetails = [(machinery.ExtensionFileLoader, machinery.EXTENSION_SUFFIXES),
+                     (machinery.SourceFileLoader, machinery.SOURCE_SUFFIXES),
+                     (machinery.SourcelessFileLoader, machinery.BYTECODE_SUFFIXES)]
+    suffixes = [ os.path.normcase(s) for s in machinery.all_suffixes() ]
+    sourceSuffixes = tuple(os.path.normcase(s) for s in machinery.SOURCE_SUFFIXES)
+else:
+    from imp import acquire_lock, release_lock, find_module, get_suffixes, NullImporter
+    from imp import PKG_DIRECTORY, PY_SOURCE, PY_COMPILED, is_builtin, is_frozen
+    from imp import get_magic, new_module, C_EXTENSION
+    try:
+        from thread import allocate_lock, get_ident
+    except ImportError:
+        from dummy_thread import allocate_lock, get_ident
+    from pkgutil import ImpLoader
+    FinderBase = pkgutil.ImpImporter
+    suffixes = [ os.path.normcase(s[0]) for s in get_suffixes() ]
+    sourceSuffixes = tuple(os.path.normcase(s[0]) for s in get_suffixes() if s[2] == PY_SOURCE)
+    # the package init files recognised by imp.find_module()
+    packageInitSuffixes = [ s for s in get_suffixes() if s[2] in (PY_SOURCE, PY_COMPILED) ]
+suffixesTuple = tuple(suffixes)
+suffixSet = frozenset(suffixes)
+# the suffixes, that don't start with "." ("module.so" on Python 2)
+plainSuffixes = tuple(s for s in suffixes if not s.startswith("."))
+# like inspect.getmodulename(): prefer the longest suffix
+suffixesByLength = tuple(sorted(suffixes, key=len, reverse=True))
+stringTypes = (str,) if PY3 else (str, unicode)
 
-suffixes = [ os.path.normcase(s[0]) for s in get_suffixes() ]
+try:
+    internName = sys.intern
+except AttributeError:
+    def internName(name):
+        # Python 2: intern() accepts byte strings only
+        return intern(name) if type(name) is str else name
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        # the backport for Python 2
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 initfiles = [ os.path.normcase('__init__' + s) for s in suffixes ]
 IDENTIFIER_RE = re.compile(os.path.normcase(r'^[a-zA-Z_][a-zA-Z0-9_]*$'))
 AUTOCHACHE_KEY = object()
+INDEX_KEY = object()
+MODULE_INDEX_KEY = object()
+LISTENERS_KEY = object()
+WATCHER_KEY = object()
+NEGATIVE_CACHE_KEY = object()
+ARCHIVE_KEY = object()
+
+INDEX_MAGIC = "quickimport-index"
+INDEX_VERSION = 5
+TRACE_MAGIC = "quickimport-trace"
+TRACE_VERSION = 1
+SNAPSHOT_MAGIC = b"QISNAP01"
+SNAPSHOT_VERSION = 1
+SHARED_INDEX_MAGIC = b"QISHRD01"
+# A directory, that was modified less than RACY_INTERVAL seconds before
+# it was read, might change again within the resolution of its mtime.
+# Such a listing is never reused on the basis of its mtime.
+RACY_INTERVAL = 2.0
+# The default number of threads for the "parallel" flag of install()
+DEFAULT_WORKERS = 16
+# The default number of threads for the "prefetch" flag of install()
+DEFAULT_PREFETCH_WORKERS = 4
+# The default size of the "resourceCache" of install() in bytes
+DEFAULT_RESOURCE_CACHE_SIZE = 1 << 20
+# Larger data files are not kept by the ResourceCache
+MAX_CACHED_RESOURCE_SIZE = 64 << 10
 
 
 __all__ = []
@@ -98,15 +240,350 @@ def dbg(*args, **kwargs):
         kwargs.setdefault('file', sys.stderr)
         print(*args, **kwargs)
 
-def buildZip(zipname=None):
+# The per directory statistics, see enableStats()
+STATS = None
+# The active TraceRecorder and Prefetcher, see install()
+TRACE = None
+PREFETCHER = None
+# The allow and deny lists of the lazy mode, see enableLazy()
+LAZY = None
+# The trustBytecode mode, see install()
+TRUST_BYTECODE = False
+# The modification times and sizes of the source files captured while 
+# reading the directories in the trustBytecode mode, see getListedStat()
+SOURCE_STATS = None
+# The ResourceCache of the loaders, see install()
+RESOURCES = None
+# The active ImportProfiler, see startProfile()
+PROFILER = None
+# The DirectoryIndex of the last install(), saved at exit
+EXIT_INDEX = None
+# The arguments of dumpStats() at exit, see install()
+EXIT_STATS = None
+# The functions registered by registerAtExit()
+atExitFunctions = set()
+timer = getattr(time, "perf_counter", time.time)
+# The estimated number of file system probes of the regular 
+# import machinery for a module, that is not in the directory
+if PY3:
+    # FileFinder stats the directory on each lookup
+    STOCK_PROBES_PER_MISS = 1
+else:
+    # imp.find_module probes for a package and each suffix
+    STOCK_PROBES_PER_MISS = len(suffixes) + 1
+
+
+class DirStats(object):
+    """
+    The statistics of a directory. See :func:`stats`.
+    """
+    __slots__ = ("calls", "hits", "misses", "probes", "avoided", "reads", "readTime")
+    
+    def __init__(self):
+        self.calls = self.hits = self.misses = self.probes = self.avoided = self.reads = 0
+        self.readTime = 0.0
+    
+    def countProbes(self, func):
+        """
+        Wrap the file system probe *func*, to count its calls.
+        """
+        def probe(*args):
+            self.probes += 1
+            return func(*args)
+        return probe
+    
+    def asDict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+
+def getDirStats(dir):
+    try:
+        return STATS[dir]
+    except KeyError:
+        return STATS.setdefault(dir, DirStats())
+
+
+def enableStats():
+    """
+    Start to collect statistics. See :func:`stats`.
+    """
+    global STATS
+    if STATS is None:
+        STATS = {}
+
+
+def stats():
+    """
+    Get the statistics collected since :func:`enableStats`.
+    
+    The result maps each directory to a dict with the following 
+    counters:
+    
+    ``calls``
+        the number of module lookups of the finder for the directory
+    ``hits``
+        the number of lookups, that found a candidate in the cached 
+        directory content
+    ``misses``
+        the number of lookups, that did not find a candidate
+    ``probes``
+        the number of file system probes (i.e. :func:`imp.find_module` 
+        calls on Python 2 and :c:func:`stat()` calls on Python 3), the
+        finder actually issued
+    ``avoided``
+        the estimated number of file system probes the regular import 
+        machinery would have issued in addition
+    ``reads``
+        the number of times the directory was read
+    ``readTime``
+        the total time in seconds spent reading the directory
+        
+    :returns: the statistics or ``None``, if disabled
+    :rtype: dict
+    """
+    if STATS is None:
+        return None
+    return dict((dir, dirStats.asDict()) for dir, dirStats in list(STATS.items()))
+
+
+def dumpStats(file=None):
+    """
+    Print the statistics as a table, busiest directories first.
+    
+    :param file: a file object or the name of a file. Defaults 
+        to ``sys.stderr``.
+    """
+    if isinstance(file, stringTypes):
+        with open(file, "w") as f:
+            return dumpStats(f)
+    if file is None:
+        file = sys.stderr
+    data = stats() or {}
+    names = DirStats.__slots__
+    totals = dict((name, sum(d[name] for d in data.values())) for name in names)
+    print("%8s %8s %8s %8s %8s %6s %9s  %s" % (names + ("dir",)), file=file)
+    rows = sorted(data.items(), key=lambda item: (-item[1]["calls"], item[0]))
+    for dir, d in rows + [("TOTAL", totals)]:
+        print("%8d %8d %8d %8d %8d %6d %9.4f  %s" % 
+              (tuple(d[name] for name in names) + (dir,)), file=file)
+
+
+class ProfileNode(object):
+    """
+    The times of a module import recorded by the :class:`ImportProfiler`.
+    """
+    __slots__ = ("name", "order", "find", "findCache", "load", "total", "start", "children")
+    
+    def __init__(self, name, order):
+        self.name = name
+        self.order = order
+        self.find = self.findCache = self.load = self.total = self.start = 0.0
+        self.children = {}
+
+
+class ImportProfiler(object):
+    """
+    Record the time spent importing modules through the 
+    :class:`QuickimportFinder`, nested by importer. See :func:`startProfile`. 
+    
+    For each module the profiler records
+    
+    ``find``
+        the time spent by the :class:`QuickimportFinder` objects 
+        locating the module. ``findCache`` is the part spent probing the 
+        directory cache, ``findFs`` the part spent searching the candidate 
+        directories (i.e. :func:`imp.find_module` or :c:func:`stat()` calls)
+    ``load``
+        the time spent reading and compiling (or unmarshalling) the code
+    ``exec``
+        the time spent executing the module body, excluding the imports 
+        of other modules
+    ``total``
+        the time spent loading and executing the module including the 
+        imports of other modules
+    
+    On Python 2 the execution time of packages and of modules without
+    valid byte code includes reading and compiling.
+    """
+    def __init__(self, filename=None, foldedFilename=None):
+        self.filename = filename
+        self.foldedFilename = foldedFilename
+        self.root = ProfileNode("", 0)
+        self.nodes = 0
+        # thread id -> list of the modules being loaded
+        self.stacks = {}
+    
+    def getStack(self):
+        ident = get_ident()
+        stack = self.stacks.get(ident)
+        if stack is None:
+            stack = self.stacks[ident] = [self.root]
+        return stack
+    
+    def getNode(self, fullname):
+        """
+        Get the node of the module *fullname* imported by the module,
+        that is currently loaded.
+        """
+        children = self.getStack()[-1].children
+        node = children.get(fullname)
+        if node is None:
+            self.nodes += 1
+            node = children[fullname] = ProfileNode(fullname, self.nodes)
+        return node
+    
+    def addFindTime(self, fullname, cacheTime, searchTime):
+        """
+        Record a lookup of the module *fullname*.
+        """
+        node = self.getNode(fullname)
+        node.findCache += cacheTime
+        node.find += cacheTime + searchTime
+    
+    def enter(self, fullname):
+        """
+        Record the start of loading the module *fullname*.
+        
+        :returns: the node of the module for :meth:`exit`
+        """
+        node = self.getNode(fullname)
+        self.getStack().append(node)
+        node.start = timer()
+        return node
+    
+    def loaded(self):
+        """
+        Record, that the current module has been read and compiled.
+        """
+        node = self.getStack()[-1]
+        node.load += timer() - node.start
+    
+    def exit(self, node):
+        """
+        Record the end of loading the module of *node*.
+        """
+        node.total += timer() - node.start
+        stack = self.getStack()
+        while len(stack) > 1:
+            if stack.pop() is node:
+                break
+    
+    def asDict(self, node=None):
+        """
+        Get the recorded times as a tree of dicts. Each dict contains the
+        keys ``name``, ``find``, ``findCache``, ``findFs``, ``load``, 
+        ``exec``, ``total`` and ``children``, the list of the modules 
+        imported by the module. 
+        """
+        if node is None:
+            node = self.root
+        children = sorted(node.children.values(), key=lambda child: child.order)
+        if node is self.root:
+            total = sum(child.find + child.total for child in children)
+        else:
+            total = node.total
+        return {"name": node.name,
+                "find": node.find,
+                "findCache": node.findCache,
+                "findFs": node.find - node.findCache,
+                "load": node.load,
+                "exec": max(0.0, total - node.load - 
+                            sum(child.find + child.total for child in children)),
+                "total": total,
+                "children": [self.asDict(child) for child in children]}
+    
+    def writeJson(self, file):
+        """
+        Write the tree of :meth:`asDict` as JSON to the file object *file*.
+        """
+        import json
+        json.dump(self.asDict(), file, indent=1, sort_keys=True)
+    
+    def writeFolded(self, file):
+        """
+        Write the recorded times in microseconds in the folded stack 
+        format of ``flamegraph.pl`` to the file object *file*. The time 
+        of a module is split into the frames ``[find cache]``, 
+        ``[find fs]``, ``[load]`` and the module itself (the execution).
+        """
+        def write(data, stack):
+            for key, frame in (("findCache", "[find cache]"), ("findFs", "[find fs]"), 
+                               ("load", "[load]"), ("exec", None)):
+                value = int(data[key] * 1e6)
+                if value > 0 and stack:
+                    file.write("%s %d\n" % (";".join(stack + ([frame] if frame else [])), value))
+            for child in data["children"]:
+                write(child, stack + [child["name"]])
+        write(self.asDict(), [])
+    
+    def save(self, quiet=False):
+        """
+        Write the profile to the files given to the constructor.
+        
+        :param quiet: if `True`, ignore errors.
+        :type quiet: bool
+        """
+        for filename, write in ((self.filename, self.writeJson), 
+                                (self.foldedFilename, self.writeFolded)):
+            if filename is None:
+                continue
+            try:
+                with open(filename, "w") as f:
+                    write(f)
+            except (IOError, OSError) as e:
+                if not quiet:
+                    raise
+                dbg("quickimport: can't write profile %r: %s" % (filename, e))
+
+
+def startProfile(filename=None, foldedFilename=None):
     """
-    Build a zip-archive containing all suitable top-level modules.
+    Profile the imports through the :class:`QuickimportFinder`. 
+    The profile gets written at exit or by :func:`stopProfile`.
+    
+    :param filename: the name of the JSON file, see :meth:`ImportProfiler.writeJson`
+    :param foldedFilename: the name of the flame graph file, see 
+        :meth:`ImportProfiler.writeFolded`
+    :returns: the :class:`ImportProfiler`
+    """
+    global PROFILER
+    stopProfile()
+    # imported at exit
+    import json
+    PROFILER = ImportProfiler(filename, foldedFilename)
+    registerAtExit(stopProfile)
+    return PROFILER
+
+
+def stopProfile():
+    """
+    Stop profiling and write the profile.
+    
+    :returns: the :class:`ImportProfiler` or ``None``, if not profiling
+    """
+    global PROFILER
+    profiler = PROFILER
+    if profiler is not None:
+        PROFILER = None
+        profiler.save(True)
+    return profiler
+
+def buildZip(zipname=None, workers=None, incremental=True, path=None, trace=None):
+    """
+    Build a zip-archive containing all suitable top-level modules and
+    packages.
     
     This function creates the zip-archive `zipname` and adds
-    a compiled version of every suitable top-level module to the
-    archive. A module is suitable, if the module's Python source 
+    a compiled version of every suitable top-level module and package 
+    to the archive. A module is suitable, if the module's Python source 
     code is available and does not reference the __path__ or 
-    __file__ members.
+    __file__ members. A package is suitable, if all its modules 
+    and sub-packages are suitable modules.
+    
+    The modules get compiled by a pool of processes. If the archive 
+    already exists, this function only compiles the modules, whose
+    source changed since the archive was built, and replaces the 
+    archive atomically.  
     
     This function uses the python :mod:`logging` system to report
     its progress. Set the log level to ``INFO`` or ``DEBUG`` to get
@@ -119,11 +596,29 @@ def buildZip(zipname=None):
     :param zipname: the name of the archive. If not given, the function 
         uses the name of the ``pythonXY.zip``-item of ``sys.path``. 
     :type zipname: str or unicode
+    :param workers: the number of processes to compile the modules. 
+        Defaults to the number of CPUs. Use 0 to compile the modules 
+        in the calling process.
+    :type workers: int
+    :param incremental: if `False`, compile all modules again.
+    :type incremental: bool
+    :param path: the directories to scan. Defaults to ``sys.path``.
+    :type path: sequence of strings
+    :param trace: the ``(fullname, filename)`` entries recorded by a 
+        :class:`TraceRecorder`. If given, the archive contains the
+        traced modules and packages instead of the modules from *path*.
+        The compiled modules are laid out in the order of the trace, 
+        followed by the modules of the traced packages, that were 
+        not imported. See :func:`traceApp`.
+    :type trace: sequence of tuples
+    :returns: the names of the modules and packages in the archive
+    :rtype: list
     """
     import logging
     LOGGER = logging.getLogger(__name__)
     import collections
     import zipfile
+    import tempfile
     
     uninstall()
                 
@@ -139,8 +634,16 @@ def buildZip(zipname=None):
 
     LOGGER.info("Creating zip archive %r ...", zipname)
 
+    # name -> list of (arcname, source filename) or None
     files = collections.OrderedDict()
-    for dir in sys.path:
+    # the source filenames in the order of the trace
+    order = {}
+    if trace is not None:
+        path = ()
+        files, order = getTracedFiles(trace, LOGGER)
+    elif path is None:
+        path = sys.path
+    for dir in path:
         if os.path.normcase(os.path.realpath(dir)) == os.path.normcase(os.path.realpath(zipname)):
             continue
         LOGGER.info("Scanning dir %r", dir)
@@ -152,83 +655,510 @@ def buildZip(zipname=None):
                 
                 files[name] = None
                 
-                if ispkg:
-                    LOGGER.info("Omitting package %r", name)
-                    continue
-                
-                module_loader = module_loader.find_module(name)
+                if hasattr(module_loader, "find_spec"):
+                    module_loader = module_loader.find_spec(name).loader
+                else:
+                    # zipimporter has no find_spec before Python 3.10
+                    module_loader = module_loader.find_module(name)
                 
                 filename = module_loader.get_filename(name)
-                source = module_loader.get_source(name)
-                if source is None:
+                if not filename.endswith(".py"):
                     LOGGER.info("Omitting module %r: no source", name)
                     continue
-                if "__file__" in source or "__path__" in source:
-                    LOGGER.info("Omitting module %r: __file__ or __path__ in source", name)
+                if not os.path.isfile(filename):
+                    # a member of an egg or a zip archive
+                    LOGGER.info("Omitting module %r: not a file", name)
                     continue
+                if ispkg:
+                    members, reason = listPackageFiles(os.path.dirname(filename), name)
+                    if members is None:
+                        LOGGER.info("Omitting package %r: %s", name, reason)
+                        continue
+                else:
+                    members = [(name + ".pyc", filename)]
 
                 LOGGER.debug("Selecting module %r: %r", name, filename)
-                files[name] = filename
+                files[name] = members
                 
-        except OSError, e:
-            LOGGER.warn("Exeception in dir %r: %s", dir, e)
+        except OSError as e:
+            LOGGER.warning("Exeception in dir %r: %s", dir, e)
     
+    oldZip = None
+    oldHeaders = {}
     if os.path.exists(zipname):
         if not os.path.isfile(zipname) or os.path.islink(zipname):
             raise ValueError("Must be a regular file: %r" % (zipname,))
-        LOGGER.warn("Zipfile already exists, going to remove it: %r", zipname)
-        os.unlink(zipname)
-    f = zipfile.PyZipFile(zipname, "w", zipfile.ZIP_DEFLATED, True)
-    
-    for filename in files.itervalues():
-        if filename is not None:
-            try:       
-                f.writepy(filename)
-            except RuntimeError, e:
-                LOGGER.debug("Exclude %r, because of RuntimeError: %s", filename, e)
-                continue
-            except IOError, e:
-                LOGGER.debug("Exclude %r, because of IOError: %s", filename, e)
-                continue
-    f.close()
+        if incremental:
+            try:
+                oldZip = zipfile.ZipFile(zipname)
+                for info in oldZip.infolist():
+                    f = oldZip.open(info)
+                    try:
+                        oldHeaders[info.filename] = parsePycHeader(f.read(16))
+                    finally:
+                        f.close()
+            except (zipfile.BadZipfile, IOError, OSError) as e:
+                LOGGER.warning("Can't read zip archive %r, going to replace it: %s", zipname, e)
+                oldHeaders = {}
+    
+    # select the members, that need to be compiled
+    tasks = []
+    for name, members in files.items():
+        filenames = []
+        for arcname, filename in members or ():
+            st = os.stat(filename)
+            header = oldHeaders.get(arcname)
+            if (header is None or header[0] != int(st.st_mtime) & 0xFFFFFFFF or
+                header[1] not in (None, st.st_size & 0xFFFFFFFF)):
+                filenames.append(filename)
+        if filenames:
+            tasks.append((name, filenames))
+    LOGGER.info("Checking %d of %d modules", sum(len(filenames) for name, filenames in tasks), 
+                sum(len(members) for members in files.values() if members))
+    if workers is None:
+        import multiprocessing
+        workers = multiprocessing.cpu_count()
+    if workers > 1 and len(tasks) > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(workers)
+        try:
+            results = pool.map(compileModuleFiles, [filenames for name, filenames in tasks], 4)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [compileModuleFiles(filenames) for name, filenames in tasks]
+    compiled = {}
+    for (name, filenames), (data, reason) in zip(tasks, results):
+        if data is None:
+            LOGGER.info("Omitting module %r: %s", name, reason)
+            files[name] = None
+        else:
+            compiled.update(zip(filenames, data))
+
+    fd, tmpname = tempfile.mkstemp(prefix=".quickimport", 
+                                   dir=os.path.dirname(os.path.abspath(zipname)))
+    try:
+        with os.fdopen(fd, "wb") as tmpfile:
+            f = zipfile.ZipFile(tmpfile, "w", zipfile.ZIP_DEFLATED, True)
+            names = [name for name, members in files.items() if members is not None]
+            members = [member for name in names for member in files[name]]
+            # traced modules first, the others keep their relative order
+            members.sort(key=lambda member: order.get(member[1], len(order)))
+            for arcname, filename in members:
+                data = compiled.get(filename)
+                if data is None:
+                    data = oldZip.read(arcname)
+                info = zipfile.ZipInfo(arcname, 
+                                       time.localtime(max(os.stat(filename).st_mtime, 315619200))[:6])
+                info.compress_type = zipfile.ZIP_DEFLATED
+                f.writestr(info, data)
+            f.close()
+        if oldZip is not None:
+            oldZip.close()
+        try:
+            mode = os.stat(zipname).st_mode & 0o777
+        except OSError:
+            mode = 0o644
+        os.chmod(tmpname, mode)
+        getattr(os, "replace", os.rename)(tmpname, zipname)
+    except Exception:
+        os.unlink(tmpname)
+        raise
     LOGGER.info("Created zip archive %r", zipname)
+    return names
+
+
+def getSourceFilename(filename):
+    """
+    Get the name of the source file of the module file *filename* 
+    or ``None``, if there is no source.
+    """
+    if filename.endswith(".py"):
+        return filename
+    if PY3:
+        from importlib.util import source_from_cache
+        try:
+            source = source_from_cache(filename)
+        except (ValueError, NotImplementedError):
+            return None
+    elif filename.endswith((".pyc", ".pyo")):
+        source = filename[:-1]
+    else:
+        return None
+    return source if os.path.isfile(source) else None
+
+
+def getTracedFiles(trace, LOGGER):
+    """
+    Get the modules and packages of the *trace* for :func:`buildZip`.
+    
+    :returns: the tuple ``(files, order)``. *files* maps the names of 
+        the top-level modules and packages to lists of ``(arcname, 
+        source filename)`` tuples or ``None``. *order* maps the source 
+        filenames to their position in the trace.
+    """
+    import collections
+    order = {}
+    sources = {}
+    for fullname, filename in trace:
+        source = getSourceFilename(filename)
+        if source is not None:
+            order.setdefault(source, len(order))
+            sources.setdefault(fullname, source)
+    files = collections.OrderedDict()
+    for fullname, filename in trace:
+        name = fullname.partition(".")[0]
+        if name in files:
+            continue
+        files[name] = None
+        source = sources.get(name)
+        if source is None:
+            # e.g. a package loaded by imp.load_module()
+            source = getSourceFilename(getattr(sys.modules.get(name), "__file__", None) or "")
+        if source is None:
+            LOGGER.info("Omitting module %r: no source", name)
+            continue
+        if os.path.splitext(os.path.basename(source))[0] == "__init__":
+            members, reason = listPackageFiles(os.path.dirname(source), name)
+            if members is None:
+                LOGGER.info("Omitting package %r: %s", name, reason)
+                continue
+        else:
+            members = [(name + ".pyc", source)]
+        LOGGER.debug("Selecting module %r: %r", name, source)
+        files[name] = members
+    return files, order
+
+
+def traceApp(name, argv=()):
+    """
+    Run the module *name* like ``python -m name argv...`` in a new 
+    interpreter with the current ``sys.path`` and record the modules 
+    loaded by the :class:`QuickimportFinder` (see the flag ``trace`` 
+    of :func:`install`).
+    
+    :returns: the list of ``(fullname, filename)`` tuples in the order 
+        of the first use of the files
+    """
+    import subprocess
+    import tempfile
+    import logging
+    fd, traceFile = tempfile.mkstemp(prefix=".quickimport")
+    os.close(fd)
+    code = ("import sys, runpy\n"
+            "sys.path.insert(0, %r)\n"
+            "import quickimport\n"
+            "sys.path[:] = %r\n"
+            "quickimport.install(['trace=' + %r])\n"
+            "runpy.run_module(%r, run_name='__main__', alter_sys=True)\n" % 
+            (os.path.dirname(os.path.abspath(__file__)), sys.path, traceFile, name))
+    try:
+        returncode = subprocess.call([sys.executable, "-c", code] + list(argv))
+        if returncode:
+            logging.getLogger(__name__).warning("Module %r exited with %r", name, returncode)
+        return loadTrace(traceFile)
+    finally:
+        os.unlink(traceFile)
+
+
+def getTracedPathEntries(trace):
+    """
+    Get the directories, that provided the top-level modules and
+    packages of the *trace*.
+
+    :returns: a dict, that maps the names of the top-level modules and
+        packages to the absolute names of their directories
+    """
+    entries = {}
+    for fullname, filename in trace:
+        if "." in fullname or fullname in entries:
+            continue
+        dir, base = os.path.split(os.path.abspath(filename))
+        if os.path.basename(dir) == "__pycache__":
+            dir = os.path.dirname(dir)
+        if base.partition(".")[0] == "__init__":
+            # the directory of the package
+            dir = os.path.dirname(dir)
+        entries[fullname] = dir
+    return entries
+
+
+def getPathEntryNames(entry, cache):
+    """
+    Get the names of the top-level modules and packages, the ``sys.path``
+    item *entry* could provide according to the directory *cache*.
+
+    :returns: a set of normcased names or ``None``, if *entry* is
+        not handled by Quickimport.
+    """
+    finder = getPathEntryFinder(os.getcwd() if PY3 and entry == '' else entry)
+    if finderIsQuickimportFinder(finder):
+        files = cache.get(finder.dir)
+    elif isinstance(finder, ArchiveFinder):
+        files = finder.files
+    elif (finderIsNullFinder(finder) or (PY3 and finder is None) or
+          (NullImporter is not None and isinstance(finder, NullImporter))):
+        return set()
+    else:
+        files = None
+    if files is None:
+        return None
+    names = set()
+    for f in files:
+        if f.endswith(suffixesTuple):
+            for s in suffixes:
+                if f.endswith(s):
+                    names.add(f[:-len(s)])
+        elif (f != "__pycache__" and IDENTIFIER_RE.match(f) and
+              files.isDir(f) is not False):
+            # a package or a portion of a namespace package
+            names.add(f)
+    return names
+
+
+def optimizePath(trace, path=None):
+    """
+    Reorder the items of *path* for the imports recorded in *trace*.
+
+    The items, that provided the most top-level modules and packages
+    of the *trace*, move to the front. Items, that could provide the
+    same name, keep their relative order. Therefore each import still
+    resolves to the same file. Items not handled by Quickimport and
+    relative items (like ``''``) keep their position. Call this function
+    after :func:`install`.
+
+    :param trace: a trace, see :func:`loadTrace`
+    :param path: the search path. Defaults to ``sys.path``, which is
+        not modified.
+    :returns: the tuple ``(newPath, probesBefore, probesAfter)``.
+        *newPath* is the reordered copy of *path*. *probesBefore* and
+        *probesAfter* are the numbers of items visited to locate the
+        traced top-level modules and packages with *path* and *newPath*.
+    """
+    import heapq
+    if path is None:
+        path = sys.path
+    cache = getattr(sys, "quickimport_cache", {})
+    positions = {}
+    for i, entry in enumerate(path):
+        if isinstance(entry, stringTypes):
+            positions.setdefault(os.path.abspath(entry or os.curdir), i)
+    usage = [0] * len(path)
+    traced = []
+    for fullname, dir in getTracedPathEntries(trace).items():
+        i = positions.get(dir)
+        if i is not None:
+            usage[i] += 1
+            traced.append(i)
+
+    newOrder = []
+    segment = []
+    for i, entry in enumerate(path + [None]):
+        names = None
+        if isinstance(entry, stringTypes) and os.path.isabs(entry):
+            names = getPathEntryNames(entry, cache)
+        if names is not None:
+            segment.append((i, names))
+            continue
+        # entry is a barrier. Sort the items preceding it.
+        successors = dict((j, []) for j, n in segment)
+        predecessors = dict.fromkeys(successors, 0)
+        last = {}
+        for j, segmentNames in segment:
+            for name in segmentNames:
+                k = last.get(name)
+                if k is not None:
+                    successors[k].append(j)
+                    predecessors[j] += 1
+                last[name] = j
+        heap = [(-usage[j], j) for j, n in predecessors.items() if not n]
+        heapq.heapify(heap)
+        while heap:
+            j = heapq.heappop(heap)[1]
+            newOrder.append(j)
+            for k in successors[j]:
+                predecessors[k] -= 1
+                if not predecessors[k]:
+                    heapq.heappush(heap, (-usage[k], k))
+        segment = []
+        if entry is not None:
+            newOrder.append(i)
+
+    newPositions = dict((j, pos) for pos, j in enumerate(newOrder))
+    probesBefore = sum(i + 1 for i in traced)
+    probesAfter = sum(newPositions[i] + 1 for i in traced)
+    return [path[j] for j in newOrder], probesBefore, probesAfter
+
+
+def listPackageFiles(pkgDir, name):
+    """
+    Get the modules of the package *name* in the directory *pkgDir* for
+    :func:`buildZip`. 
+    
+    :returns: the tuple ``(members, reason)``. *members* is the list of 
+        ``(arcname, source filename)`` tuples or ``None``, if the package 
+        can't be loaded from a zip archive. *reason* explains, why.
+    """
+    if PY3:
+        extensionSuffixes = tuple(machinery.EXTENSION_SUFFIXES)
+    else:
+        extensionSuffixes = tuple(s for s, mode, type in get_suffixes() if type == C_EXTENSION)
+    members = []
+    for root, dirs, names in os.walk(pkgDir):
+        if root != pkgDir and "__init__.py" not in names:
+            # not a sub-package
+            del dirs[:]
+            continue
+        dirs.sort()
+        relpath = os.path.relpath(root, pkgDir)
+        if relpath == os.curdir:
+            prefix = name + "/"
+        else:
+            prefix = name + "/" + relpath.replace(os.sep, "/") + "/"
+        for filename in sorted(names):
+            base, ext = os.path.splitext(filename)
+            if filename.endswith(extensionSuffixes):
+                return None, "extension module %r" % (os.path.join(root, filename),)
+            if ext in (".pyc", ".pyo") and base + ".py" not in names:
+                return None, "no source for %r" % (os.path.join(root, filename),)
+            if ext == ".py":
+                members.append((prefix + base + ".pyc", os.path.join(root, filename)))
+    return members, None
+
+
+def pycHeader(mtime, size):
+    """
+    Get the header of a compiled module file for a source 
+    with the modification time *mtime* and the size *size*.
+    """
+    mtime = int(mtime) & 0xFFFFFFFF
+    size &= 0xFFFFFFFF
+    if not PY3:
+        return get_magic() + struct.pack("<I", mtime)
+    from importlib.util import MAGIC_NUMBER
+    if sys.version_info >= (3, 7):
+        return MAGIC_NUMBER + struct.pack("<III", 0, mtime, size)
+    return MAGIC_NUMBER + struct.pack("<II", mtime, size)
+
+
+def parsePycHeader(data):
+    """
+    Parse the header of a compiled module file created by :func:`pycHeader`.
+    
+    :returns: the tuple ``(mtime, size)`` or ``None``, if *data* is not a 
+        valid header. The size is ``None`` on Python 2.
+    """
+    if not PY3:
+        if len(data) < 8 or data[:4] != get_magic():
+            return None
+        return struct.unpack("<I", data[4:8])[0], None
+    from importlib.util import MAGIC_NUMBER
+    if data[:4] != MAGIC_NUMBER:
+        return None
+    if sys.version_info >= (3, 7):
+        if len(data) < 16:
+            return None
+        flags, mtime, size = struct.unpack("<III", data[4:16])
+        if flags != 0:
+            return None
+        return mtime, size
+    if len(data) < 12:
+        return None
+    return struct.unpack("<II", data[4:12])
+
+
+def compileModuleFiles(filenames):
+    """
+    Compile the module sources *filenames* of a module or package 
+    for :func:`buildZip`. Called by the processes of the pool.
+    
+    :returns: the tuple ``(data, reason)``. *data* is the list of the 
+        contents of the compiled files or ``None``, if any module is 
+        not suitable. *reason* explains, why.
+    """
+    sources = []
+    for filename in filenames:
+        try:
+            with open(filename, "rb") as f:
+                st = os.fstat(f.fileno())
+                source = f.read()
+        except (IOError, OSError) as e:
+            return None, "%r: can't read: %s" % (filename, e)
+        if b"__file__" in source or b"__path__" in source:
+            return None, "%r: __file__ or __path__ in source" % (filename,)
+        sources.append((filename, st, source))
+    data = []
+    for filename, st, source in sources:
+        try:
+            code = compile(source, filename, "exec", 0, True)
+        except (SyntaxError, ValueError, TypeError) as e:
+            return None, "%r: can't compile: %s" % (filename, e)
+        data.append(pycHeader(st.st_mtime, st.st_size) + marshal.dumps(code))
+    return data, None
  
  
             
+# These functions avoid the import statement, because they
+# get called from the threads of parallelMap() while the main thread 
+# holds the import lock.
 def finderIsNullFinder(finder):
-    import quickimport as q
+    q = sys.modules.get("quickimport", sys.modules[__name__])
     return isinstance(finder, (NullFinder, q.NullFinder))
 
 def finderIsQuickimportFinder(finder):
-    import quickimport as q
+    q = sys.modules.get("quickimport", sys.modules[__name__])
     return isinstance(finder, (QuickimportFinder, q.QuickimportFinder ))
 
 
-def isDirRelevant(dir):
+def isDirRelevant(dir, index=None):
     """
     Test is a given directory contains any entries that
     could be modules or packages.
     
+    The verdict is recorded in the :class:`DirectoryIndex` *index*. 
+    A valid index entry answers the question without reading the 
+    directory. Only positive verdicts of the analysis of the 
+    subdirectories are recorded, because adding an ``__init__`` module 
+    to a subdirectory does not change the modification time of *dir*.
+    
     :param dir: the directory to inspect
     :type dir: str or unicode
+    :param index: the index. Defaults to the index of the directory cache.
+    :type index: :class:`DirectoryIndex`
     :returns: `True` if the directory might contain Python modules or packages.
               `False` otherwise.
     :rtype: bool
     
     """
     finder = sys.path_importer_cache.get(dir)
-    if finderIsNullFinder(finder) or isinstance(finder, NullImporter):
+    if finderIsNullFinder(finder) or (NullImporter is not None and 
+                                      isinstance(finder, NullImporter)):
         # We will never import from this directory
         return False
 
     if finderIsQuickimportFinder(finder):
         return True
 
-    if getattr(sys, "quickimport_cache", {}).get(dir):
+    cache = getattr(sys, "quickimport_cache", {})
+    if cache.get(dir):
         # It's in the cache. Therefore it is relevant
         return True
     
-    relevant, files = readAndAnalyseDir(dir, True)
+    if index is None:
+        index = cache.get(INDEX_KEY)
+    if index is not None:
+        entry = index.lookup(dir)
+        if entry is not None:
+            if not entry[1]:
+                # not even a name of a module
+                return False
+            if entry[4]:
+                return True
+    
+    relevant, files, mtime, subdirs = readAndAnalyseDirStamped(dir, True)
+    if index is not None and files is not None:
+        index.record(dir, mtime, hasModuleNames(files), files, subdirs, relevant)
     return relevant or files is None
 
 
@@ -242,154 +1172,3225 @@ def readAndAnalyseDir(dir, doStat=None):
     :param dir: the directory to inspect
     :type dir: str or unicode
     :param doStat: If ``True``, analyze the directory content more
-         thoroughly using stat-based calls.
+         thoroughly: a name, that is not a module, must be the name of a
+         package directory.
     :returns: A tuple, containing a boolean that indicates, 
         if the directory might contain Python modules or packages, and
         an list of the directory content.
     :rtype: bool, list
     
     """
+    return readAndAnalyseDirStamped(dir, doStat)[:2]
+
+
+def readAndAnalyseDirStamped(dir, doStat=None):
+    """
+    Like :func:`readAndAnalyseDir`, but additionally return the
+    modification time of the directory and the list of subdirectories 
+    (see :func:`listDir`) as the third and fourth item of the
+    result tuple. The modification time is ``None``, if the
+    directory content is ``None``.
+    """
+    if STATS is None:
+        return doReadAndAnalyseDir(dir, doStat)
+    t0 = timer()
+    try:
+        return doReadAndAnalyseDir(dir, doStat)
+    finally:
+        dirStats = getDirStats(dir)
+        dirStats.reads += 1
+        dirStats.readTime += timer() - t0
+
+
+def doReadAndAnalyseDir(dir, doStat):
     if not os.path.isabs(dir):
         # probably not a regular path
-        return True, None
+        return True, None, None, None
 
-    isdir = os.path.isdir
-    if not isdir(dir):
+    try:
+        st = os.stat(dir)
+    except OSError:
+        # Not existent
+        return False, None, None, None
+    if not S_ISDIR(st.st_mode):
         # Not a directory at all
-        return False, None
+        return False, None, None, None
+    mtime = st.st_mtime
 
-    listdir = os.listdir
     try:
-        files = listdir(dir)
+        files, subdirs = listDir(dir)
     except Exception:
         # Dir is unreadable, assume it contains modules
-        return True, None
+        return True, None, None, None
+    sourceStats = SOURCE_STATS
+    if sourceStats is not None:
+        sourceStats[dir] = statSourceFiles(dir, files)
 
-    normcase = os.path.normcase
-    # First pass: look for matching module names
-    for f in files:
-        nf = normcase(f)
-        for s in suffixes:
-            if nf.endswith(s):
-                return True, files
-        if not doStat and IDENTIFIER_RE.match(nf):
-            return True, files
-
-    # second pass: look for packages
     if doStat:
-        join = os.path.join
-        isfile = os.path.isfile
-        for f in files:
-            d = join(dir,f)
-            if not isdir(d):
-                continue
-            try:
-                dfiles = listdir(d)
-            except Exception:
-                # Dir is unreadable, assume it contains modules
-                return True
-            for ff in dfiles:
-                if normcase(ff) in initfiles and isfile(ff):
-                    return True, files
-
-    # Nothing suitable found
-    return False, files
+        relevant = (hasModuleNames(files, False) or 
+                    hasPackageDirs(dir, files, subdirs))
+    else:
+        relevant = hasModuleNames(files)
+    return relevant, files, mtime, subdirs
 
 
-def updateCache(cache, dir, files):
+def statSourceFiles(dir, files):
     """
-    Update a dir in the cache
-    """ 
-    cache[dir] = frozenset(map(os.path.normcase, files))
+    Get the modification times and the sizes of the source files among 
+    the entries *files* of *dir*. 
+    
+    :returns: a dict, that maps the normcased name of each source file 
+        to the tuple ``(mtime, size)``
+    :rtype: dict
+    """
+    normcase = os.path.normcase
+    join = os.path.join
+    stats = {}
+    for name in files:
+        nf = normcase(name)
+        if nf.endswith(sourceSuffixes):
+            try:
+                st = os.stat(join(dir, name))
+            except OSError:
+                continue
+            stats[nf] = (st.st_mtime, st.st_size)
+    return stats
 
 
-def prepareCache(path=None, cache=None):
+def getSourceStats(dir):
     """
-    Create or update the directory cache for :class:`QuickimportFinder`.
+    Get the result of :func:`statSourceFiles` captured, when *dir* 
+    has been read in the ``trustBytecode`` mode of :func:`install`.
     
-    :param path: a list of path entries to process
-    :type path: :class:`list`
-    :param cache: the cache dictionary. If not given, a new dictionary is used
-    :type cache: dict
-    :returns: the cache dictionary
-    :rtype: :class:`dict`
+    :returns: the dict or ``None``, if unknown.
     """
-    if path is None:
-        path = sys.path
-    if cache is None:
-        cache = {}
-        
-    for dir in path:
-        relevant, files = readAndAnalyseDir(dir, False)
-        if relevant and files:
-            updateCache(cache, dir, files)
-    return cache
+    sourceStats = SOURCE_STATS
+    return None if sourceStats is None else sourceStats.get(dir)
 
-class NullFinder(object):
+
+def getListedStat(filename):
     """
-    A PEP-302 finder class for the ``sys.path_hooks`` hook.
+    Get the modification time and the size of the source file *filename*
+    captured, when its directory has been read. See :func:`getSourceStats`.
     
-    This class never finds anything.
+    :returns: the tuple ``(mtime, size)`` or ``None``, if unknown.
     """
-    __slots__ = ()
-    def find_module(self, fullname, path=None):
-        return None
-nullFinder = NullFinder()
-    
-# QuickimportFinder should not have to derive from
-# pkgutil.ImpImporter.  But pkg_resources in setuptools assumes
-# (without justification!) that any path-like importer will be
-# derived from pkgutil.ImpImporter.  If QuickimportFinder derives from
-# object, any attempt to use pkg_resources will fail, e.g.,
-#   python -c "__requires__='setuptools'; import pkg_resources"
-class QuickimportFinder(pkgutil.ImpImporter):
+    dir, name = os.path.split(filename)
+    stats = getSourceStats(dir)
+    return None if stats is None else stats.get(os.path.normcase(name))
+
+
+def hasModuleNames(files, identifiers=True):
     """
-    A PEP-302 finder class for the ``sys.path_hooks`` hook.
+    Test if one of the names *files* could be the name of a module.
     
-    This class uses the directory cache ``sys.quickimport_cache``
-    to store the content of directories from ``sys.path`` or 
-    from package specific search path lists.
+    :param identifiers: if `True`, any valid identifier might be the name
+        of a package. Otherwise only names with a module suffix match.
+    :type identifiers: bool
+    :rtype: bool
     """
-    __slots__ = ("dir")
+    normcase = os.path.normcase
+    for f in files:
+        nf = normcase(f)
+        if nf.endswith(suffixesTuple):
+            return True
+        if identifiers and IDENTIFIER_RE.match(nf):
+            return True
+    return False
 
-    def __init__(self, dir):
-        pkgutil.ImpImporter.__init__(self, dir)
-        self.dir = dir
-            
-    def find_module(self, fullname, path=None):
-        dbg("find_module (%s): %r" % (self.dir, fullname), end='')
-        acquire_lock()
+
+def hasPackageDirs(dir, files, subdirs):
+    """
+    Test if *dir* contains a package directory. 
+    
+    *files* and *subdirs* are the result of :func:`listDir` for *dir*. 
+    If the subdirectories are known, this function does not need any 
+    :c:func:`stat()` call for the entries of *dir*.  
+    
+    :rtype: bool
+    """
+    join = os.path.join
+    normcase = os.path.normcase
+    if subdirs is None:
+        isdir = os.path.isdir
+        subdirs = [f for f in files 
+                   if IDENTIFIER_RE.match(normcase(f)) and isdir(join(dir, f))]
+    for d in subdirs:
+        if not IDENTIFIER_RE.match(normcase(d)):
+            continue
         try:
-            dir = self.dir
-            try:
-                files = sys.quickimport_cache[dir]
-            except Exception, e:
-                raise ImportError("Can't import %r: No quickimport dir cache for dir %r: %s" % (fullname, dir, e) )
+            if hasInitFile(join(dir, d)):
+                return True
+        except OSError:
+            # Dir is unreadable, assume it contains modules
+            return True
+    return False
+
+
+def hasInitFile(dir):
+    """
+    Test if the directory *dir* contains an ``__init__`` module.
+    
+    :raises OSError: if the directory can't be read.
+    """
+    normcase = os.path.normcase
+    if scandir is None:
+        isfile = os.path.isfile
+        for f in os.listdir(dir):
+            if normcase(f) in initfiles and isfile(os.path.join(dir, f)):
+                return True
+        return False
+    entries = scandir(dir)
+    try:
+        for entry in entries:
+            if normcase(entry.name) in initfiles and entry.is_file():
+                return True
+    finally:
+        close = getattr(entries, "close", None)
+        if close is not None:
+            close()
+    return False
+
+
+def listDir(dir):
+    """
+    Read the directory *dir*.
+    
+    If :func:`os.scandir` (or the ``scandir`` module on Python 2) is 
+    available, this function also determines the subdirectories of *dir*
+    from the entry type, that most file systems return together with 
+    the name of the entry. Only entries, that could be a module or a
+    package, are considered. 
+    
+    :returns: a tuple of the list of all names and the list of the names
+        of the subdirectories. The latter is ``None``, if it is unknown.
+    :raises OSError: if the directory can't be read.
+    """
+    if scandir is None:
+        return os.listdir(dir), None
+    normcase = os.path.normcase
+    files = []
+    subdirs = []
+    for entry in scandir(dir):
+        name = entry.name
+        files.append(name)
+        if subdirs is None:
+            continue
+        nf = normcase(name)
+        if IDENTIFIER_RE.match(nf) or nf.endswith(suffixesTuple):
+            try:
+                if entry.is_dir():
+                    subdirs.append(name)
+            except OSError:
+                subdirs = None
+    return files, subdirs
+
+
+def sortedContains(names, name):
+    """
+    Test, if the sorted sequence *names* contains *name*.
+    """
+    i = bisect_left(names, name)
+    return i != len(names) and names[i] == name
+
+
+class CachedDir(object):
+    """
+    The content of a directory in the directory cache: the normcased 
+    names of all entries. 
+    
+    The names are stored in a sorted tuple of interned strings. Equal 
+    names in different directories share a single string object and 
+    a membership test is a binary search. This representation needs 
+    much less memory than a set per directory (see the ``--memory`` 
+    option of ``benchQuickimport.py``). 
+    
+    The attribute ``subdirs`` is the sorted tuple of the normcased names 
+    of the subdirectories (see :func:`listDir`) or ``None``, if it is 
+    unknown. The attribute ``mtime`` is the modification time of the 
+    directory at the time of reading or ``None``, if it is unknown.
+    """
+    __slots__ = ("names", "subdirs", "mtime")
+    
+    def __init__(self, names=(), subdirs=None, mtime=None):
+        self.names = tuple(sorted(set(map(internName, names))))
+        if subdirs is not None:
+            subdirs = tuple(sorted(set(map(internName, subdirs))))
+        self.subdirs = subdirs
+        self.mtime = mtime
+    
+    def __contains__(self, name):
+        return sortedContains(self.names, name)
+    
+    def __iter__(self):
+        return iter(self.names)
+    
+    def __len__(self):
+        return len(self.names)
+    
+    def __repr__(self):
+        return "%s(%r, %r, %r)" % (type(self).__name__, self.names, self.subdirs, self.mtime)
+    
+    def hasCandidate(self, basename):
+        """
+        Test, if the directory contains an entry *basename* or *basename*
+        followed by a module suffix. 
+        
+        The candidates with a suffix starting with ``"."`` sort between
+        *basename* ``+ "."`` and *basename* ``+ "/"``. Therefore this 
+        method needs two binary searches and only examines the names 
+        in this range, not all names starting with *basename*.
+        """
+        names = self.names
+        i = bisect_left(names, basename)
+        if i == len(names):
+            return False
+        if names[i] == basename:
+            return True
+        n = len(basename)
+        i = bisect_left(names, basename + ".", i)
+        end = bisect_left(names, basename + "/", i)
+        while i < end:
+            if names[i][n:] in suffixSet:
+                return True
+            i += 1
+        for suffix in plainSuffixes:
+            if sortedContains(names, basename + suffix):
+                return True
+        return False
+    
+    def isFile(self, name):
+        """
+        Test, if the entry *name* exists and is not a directory.
+        
+        :returns: ``True`` or ``False`` or ``None``, if the 
+            type of the entry is unknown.
+        """
+        if not sortedContains(self.names, name):
+            return False
+        subdirs = self.subdirs
+        if subdirs is None:
+            return None
+        return not sortedContains(subdirs, name)
+    
+    def isDir(self, name):
+        """
+        Test, if the entry *name* exists and is a directory.
+        
+        :returns: ``True`` or ``False`` or ``None``, if the 
+            type of the entry is unknown.
+        """
+        subdirs = self.subdirs
+        if subdirs is None:
+            return None if sortedContains(self.names, name) else False
+        return sortedContains(subdirs, name)
+
+
+# dir -> lock, see getDirLock()
+dirLocks = {}
+
+def getDirLock(dir):
+    """
+    Get the lock, that serialises the updates of the cache entry 
+    of *dir*. Readers of the cache need no lock, because the entries
+    are immutable and get replaced atomically.
+    """
+    lock = dirLocks.get(dir)
+    if lock is None:
+        lock = dirLocks.setdefault(dir, allocate_lock())
+    return lock
+
+
+def updateCache(cache, dir, files, subdirs=None, mtime=None):
+    """
+    Update a dir in the cache and notify the listeners 
+    registered by :func:`addCacheListener`.
+    
+    The caller should hold the lock of *dir* (see :func:`getDirLock`),
+    if it computed *files* from the old cache entry.
+    """ 
+    normcase = os.path.normcase
+    if subdirs is not None:
+        subdirs = map(normcase, subdirs)
+    cache[dir] = CachedDir(map(normcase, files), subdirs, mtime)
+    for listener in cache.get(LISTENERS_KEY, ()):
+        listener(dir)
+
+
+def addCacheListener(cache, listener):
+    """
+    Register the callable *listener*. :func:`updateCache` calls 
+    ``listener(dir)`` after it updated the cache entry for *dir*. 
+    """
+    cache.setdefault(LISTENERS_KEY, []).append(listener)
+
+
+def removeCacheListener(cache, listener):
+    """
+    Unregister a listener registered by :func:`addCacheListener`. 
+    """
+    try:
+        cache.get(LISTENERS_KEY, []).remove(listener)
+    except ValueError:
+        pass
+
+
+def prepareCache(path=None, cache=None, workers=0, timeout=None):
+    """
+    Create or update the directory cache for :class:`QuickimportFinder`.
+    
+    :param path: a list of path entries to process
+    :type path: :class:`list`
+    :param cache: the cache dictionary. If not given, a new dictionary is used
+    :type cache: dict
+    :param workers: if greater than 1, read the directories concurrently 
+        using up to *workers* threads. See :func:`parallelMap`.
+    :type workers: int
+    :param timeout: the maximum time in seconds to wait for the 
+        threads. Directories, that have not been read in time, 
+        are not cached.
+    :type timeout: float
+    :returns: the cache dictionary
+    :rtype: :class:`dict`
+    """
+    if path is None:
+        path = sys.path
+    if cache is None:
+        cache = {}
+    
+    if workers > 1:
+        results = parallelMap(lambda dir: lookupOrReadDir(dir, cache), 
+                              path, workers, timeout, (True, None, None, None))
+    else:
+        results = [lookupOrReadDir(dir, cache) for dir in path]
+    for dir, (relevant, files, subdirs, mtime) in zip(path, results):
+        if relevant and files:
+            updateCache(cache, dir, files, subdirs, mtime)
+    return cache
+
+
+def indexPackageTrees(path=None, cache=None, workers=0, timeout=None):
+    """
+    Add the directories of all packages and sub-packages below the 
+    directories *path* to the directory cache. 
+    
+    The finders for the ``__path__`` of these packages do not need to
+    read any directory. A directory is a package directory, if its name 
+    is a valid identifier and it contains an ``__init__`` module.
+    
+    :param path: the parent directories of the top-level packages.
+        Defaults to the cached directories.
+    :type path: :class:`list`
+    :param cache: the cache dictionary. Defaults to ``sys.quickimport_cache``.
+    :type cache: dict
+    :param workers: if greater than 1, read the directories of each level 
+        of nesting concurrently. See :func:`parallelMap`.
+    :type workers: int
+    :param timeout: the maximum time in seconds to wait for the 
+        threads of each level. 
+    :type timeout: float
+    :returns: the list of the package directories
+    :rtype: :class:`list`
+    """
+    if cache is None:
+        cache = sys.quickimport_cache
+    if path is None:
+        path = [dir for dir in list(cache) if isinstance(dir, stringTypes)]
+    join = os.path.join
+    isIdentifier = IDENTIFIER_RE.match
+    
+    def getSubdirs(dir):
+        entry = cache.get(dir)
+        if entry is None:
+            return []
+        names = entry.subdirs
+        if names is None:
+            # unknown entry types: try all names without suffix
+            names = [name for name in entry if '.' not in name]
+        return [join(dir, name) for name in names if isIdentifier(name)]
+    
+    def readPackageDir(dir):
+        entry = cache.get(dir)
+        if entry is not None:
+            return True, entry, entry.subdirs, entry.mtime
+        return lookupOrReadDir(dir, cache)
+    
+    packages = []
+    level = [subdir for dir in path for subdir in getSubdirs(dir)]
+    while level:
+        if workers > 1:
+            results = parallelMap(readPackageDir, level, workers, timeout, 
+                                  (False, None, None, None))
+        else:
+            results = [readPackageDir(dir) for dir in level]
+        nextLevel = []
+        for dir, (relevant, files, subdirs, mtime) in zip(level, results):
+            if files is None or not any(init in files for init in initfiles):
+                continue
+            if dir not in cache:
+                with getDirLock(dir):
+                    if dir not in cache:
+                        updateCache(cache, dir, files, subdirs, mtime)
+            packages.append(dir)
+            nextLevel.extend(getSubdirs(dir))
+        level = nextLevel
+    return packages
+
+
+def parallelMap(func, items, workers, timeout=None, default=None):
+    """
+    Apply *func* to all *items* using up to *workers* threads.
+    
+    Reading a directory from a network file system is bound by 
+    the latency of the file server. Reading many directories 
+    concurrently reduces the total time to about the time of the
+    slowest directory. 
+    
+    *func* must not import anything, because the caller usually 
+    holds the import lock.
+    
+    :param timeout: the maximum time in seconds to wait for the 
+        results. If not given, wait until all items are processed.
+    :type timeout: float
+    :param default: the result for items, that have not been 
+        processed in time or caused an exception.
+    :returns: the list of results in the order of *items*
+    :rtype: :class:`list`
+    """
+    import threading
+    items = list(items)
+    results = [default] * len(items)
+    todo = list(range(len(items) - 1, -1, -1))
+    lock = threading.Lock()
+    
+    def worker():
+        while True:
+            with lock:
+                if not todo:
+                    return
+                i = todo.pop()
+            try:
+                results[i] = func(items[i])
+            except Exception as e:
+                dbg("quickimport: exception for %r: %s" % (items[i], e))
+    
+    threads = []
+    for i in range(min(workers, len(items))):
+        t = threading.Thread(target=worker, name="quickimport-%d" % (i,))
+        t.daemon = True
+        t.start()
+        threads.append(t)
+    
+    deadline = None if timeout is None else time.time() + timeout
+    for t in threads:
+        t.join(None if deadline is None else max(0, deadline - time.time()))
+    with lock:
+        if todo:
+            dbg("quickimport: timeout, %d items left" % (len(todo),))
+            del todo[:]
+    return results[:]
+
+
+def getFlagValue(flags, name, default=None, type=str):
+    """
+    Get the value of a keyword ``name=value`` from the *flags* 
+    argument of :func:`install`.
+    """
+    if hasattr(flags, "split"):
+        flags = flags.split()
+    prefix = name + "="
+    for flag in flags:
+        if flag.startswith(prefix):
+            return type(flag[len(prefix):])
+    return default
+
+
+def rereadDir(dir, cache):
+    """
+    Read *dir* again and update the cache entry of *dir*.
+    """
+    with getDirLock(dir):
+        relevant, files, mtime, subdirs = readAndAnalyseDirStamped(dir, False)
+        index = cache.get(INDEX_KEY)
+        if index is not None:
+            index.record(dir, mtime, relevant, files, subdirs, 
+                         sourceStats=getSourceStats(dir))
+        updateCache(cache, dir, files or (), subdirs, mtime)
+
+
+def isStaleDir(dir, files):
+    """
+    Test, if the modification time of *dir* differs from the 
+    modification time of its cache entry *files*.
+    """
+    try:
+        mtime = os.stat(dir).st_mtime
+    except OSError:
+        return True
+    return mtime != files.mtime
+
+
+def refreshCache(cache=None, workers=0):
+    """
+    Read the cached directories again, whose modification time 
+    has changed.
+    
+    Long-running applications can call this function to pick up 
+    modules and packages installed at runtime, without reading 
+    unchanged directories. Use :func:`importlib.invalidate_caches` 
+    on Python 3 to re-analyse directories without any module. 
+    
+    :param cache: the cache dictionary. Defaults to ``sys.quickimport_cache``.
+    :type cache: dict
+    :param workers: if greater than 1, check the directories concurrently.
+        See :func:`parallelMap`.
+    :type workers: int
+    :returns: the list of directories, that have been read again
+    :rtype: :class:`list`
+    """
+    if cache is None:
+        cache = sys.quickimport_cache
+    dirs = [dir for dir in list(cache) if isinstance(dir, stringTypes)]
+    
+    def isStale(dir):
+        return isStaleDir(dir, cache[dir])
+    
+    if workers > 1:
+        stale = parallelMap(isStale, dirs, workers, None, True)
+    else:
+        stale = [isStale(dir) for dir in dirs]
+    refreshed = [dir for dir, s in zip(dirs, stale) if s]
+    for dir in refreshed:
+        dbg("quickimport: refreshing %r" % (dir,))
+        rereadDir(dir, cache)
+    return refreshed
+
+
+def lookupOrReadDir(dir, cache):
+    """
+    Get the result of :func:`readAndAnalyseDir` for *dir*.
+    
+    If *cache* contains a :class:`DirectoryIndex`, this function
+    reuses a valid entry of the index or records the new
+    result in the index.
+    """
+    index = cache.get(INDEX_KEY)
+    if index is not None:
+        entry = index.lookup(dir)
+        sourceStats = SOURCE_STATS
+        # the trustBytecode mode needs the stats of the source files
+        if entry is not None and (sourceStats is None or entry[5] is not None):
+            dbg("quickimport: index hit for %r" % (dir,))
+            if sourceStats is not None:
+                sourceStats[dir] = entry[5]
+            return entry[1], entry[2], entry[3], entry[0]
+    relevant, files, mtime, subdirs = readAndAnalyseDirStamped(dir, False)
+    if index is not None:
+        index.record(dir, mtime, relevant, files, subdirs, 
+                     sourceStats=getSourceStats(dir))
+    return relevant, files, subdirs, mtime
+
+
+def getCachedDir(dir, cache):
+    """
+    Get the content of *dir* from the directory cache. 
+    
+    If *dir* is not cached and the automatic addition of directories 
+    is enabled, read the directory and add it to the cache.
+    
+    :returns: the :class:`CachedDir` or ``None``.
+    """
+    files = cache.get(dir)
+    if files is None and cache.get(AUTOCHACHE_KEY):
+        with getDirLock(dir):
+            files = cache.get(dir)
+            if files is not None:
+                # another thread has read the directory
+                return files
+            relevant, files, subdirs, mtime = lookupOrReadDir(dir, cache)
+            if files is None:
+                return None
+            updateCache(cache, dir, files, subdirs, mtime)
+            files = cache[dir]
+    return files
+
+
+def isCachedFile(filename):
+    """
+    Test, if the directory cache lists the file *filename*.
+    """
+    cache = getattr(sys, "quickimport_cache", None)
+    if cache is None:
+        return False
+    dir, name = os.path.split(filename)
+    files = getCachedDir(dir, cache)
+    return files is not None and files.isFile(os.path.normcase(name)) is not False
+
+
+def lookupCachedFile(filename):
+    """
+    Test, if the directory cache lists the file *filename*, without 
+    reading any directory.
+    
+    :returns: ``True`` or ``False`` or ``None``, if the directory of 
+        *filename* is not cached or if the type of the entry is unknown.
+    """
+    cache = getattr(sys, "quickimport_cache", None)
+    if cache is None:
+        return None
+    dir, name = os.path.split(filename)
+    files = cache.get(dir)
+    if files is None:
+        return None
+    return files.isFile(os.path.normcase(name))
+
+
+def writeMarshalFile(filename, data):
+    """
+    Marshal *data* into the file *filename*. The file gets replaced
+    atomically.
+    """
+    writeFileAtomically(filename, lambda f: marshal.dump(data, f))
+
+
+def writeFileAtomically(filename, write):
+    """
+    Call *write* with a binary file object, that replaces the file 
+    *filename*, if *write* succeeds.
+    """
+    import tempfile
+    fd, tmpname = tempfile.mkstemp(prefix=".quickimport", 
+                                   dir=os.path.dirname(os.path.abspath(filename)))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        getattr(os, "replace", os.rename)(tmpname, filename)
+    except Exception:
+        os.unlink(tmpname)
+        raise
+
+
+class DirectoryIndex(object):
+    """
+    A persistent copy of the directory cache.
+    
+    The index file contains the listing of each known directory 
+    together with the modification time of the directory at the 
+    time of reading. A listing is valid, if the modification time 
+    of the directory is unchanged. If *generation* is not ``None``, 
+    an index created for the same *generation* is trusted without 
+    any :c:func:`stat()` calls and an index created for any other 
+    generation is discarded.
+    
+    A listing read in the ``trustBytecode`` mode of :func:`install` also
+    contains the modification times and the sizes of the source files 
+    (see :func:`statSourceFiles`).
+    
+    The index also contains the member names of zip archives (see 
+    :class:`ArchiveFinder`). The names are valid, if the modification 
+    time and the size of the archive are unchanged.
+    
+    The index file is marshalled data. It is only valid for the
+    Python version, that created it. 
+    
+    :param filename: the name of the index file
+    :type filename: str or unicode
+    :param generation: an optional generation stamp
+    :type generation: str
+    """
+    def __init__(self, filename, generation=None):
+        self.filename = filename
+        self.generation = generation
+        self.entries = {}
+        self.archives = {}
+        self.trusted = False
+        self.dirty = False
+
+    def load(self):
+        """
+        Read the index file. 
+        
+        :returns: `True`, if a valid index has been read.
+        :rtype: bool
+        """
+        self.entries = {}
+        self.archives = {}
+        self.trusted = False
+        try:
+            magic, version, pyversion, generation, entries, archives = self.readData()
+        except Exception as e:
+            dbg("quickimport: can't read index %r: %s" % (self.filename, e))
+            return False
+        if (magic != INDEX_MAGIC or version != INDEX_VERSION or 
+            pyversion != tuple(sys.version_info[:2]) or 
+            not isinstance(entries, dict) or not isinstance(archives, dict)):
+            dbg("quickimport: ignoring incompatible index %r" % (self.filename,))
+            return False
+        if self.generation is not None:
+            if generation != self.generation:
+                dbg("quickimport: ignoring index %r of generation %r" % (self.filename, generation))
+                return False
+            self.trusted = True
+        self.entries = entries
+        self.archives = archives
+        return True
+    
+    def readData(self):
+        """
+        Read the content of the index file.
+        """
+        with open(self.filename, "rb") as f:
+            return marshal.load(f)
+    
+    def lookup(self, dir):
+        """
+        Get the valid index entry for *dir*.
+        
+        :returns: the tuple ``(mtime, relevant, files, subdirs, verified, 
+            sourceStats)`` or ``None``, if the index has no valid entry 
+            for *dir*. *verified* is `True`, if :func:`isDirRelevant` found 
+            modules or packages in *dir*. *sourceStats* is the result of 
+            :func:`statSourceFiles` or ``None``.
+        """
+        entry = self.entries.get(dir)
+        if entry is None or self.trusted:
+            return entry
+        mtime = entry[0]
+        if mtime is None:
+            return None
+        try:
+            st = os.stat(dir)
+        except OSError:
+            return None
+        if st.st_mtime != mtime:
+            return None
+        return entry
+
+    def record(self, dir, mtime, relevant, files, subdirs=None, verified=False, 
+               sourceStats=None):
+        """
+        Record the result of :func:`readAndAnalyseDirStamped` for *dir*.
+        """
+        if files is None:
+            if self.entries.pop(dir, None) is not None:
+                self.dirty = True
+            return
+        if mtime is not None and time.time() - mtime < RACY_INTERVAL:
+            mtime = None
+        self.entries[dir] = (mtime, bool(relevant), tuple(files), 
+                             None if subdirs is None else tuple(subdirs),
+                             bool(verified), sourceStats)
+        self.dirty = True
+
+    def lookupArchive(self, archive, st=None):
+        """
+        Get the valid member names of the zip archive *archive*.
+        
+        :param st: the result of :func:`os.stat` for *archive*, if known.
+        :returns: the tuple of the names or ``None``, if the index has 
+            no valid entry for *archive*.
+        """
+        entry = self.archives.get(archive)
+        if entry is None:
+            return None
+        mtime, size, names = entry
+        if self.trusted:
+            return names
+        if mtime is None:
+            return None
+        if st is None:
+            try:
+                st = os.stat(archive)
+            except OSError:
+                return None
+        if st.st_mtime != mtime or st.st_size != size:
+            return None
+        return names
+
+    def recordArchive(self, archive, mtime, size, names):
+        """
+        Record the member names of the zip archive *archive*.
+        """
+        if mtime is not None and time.time() - mtime < RACY_INTERVAL:
+            mtime = None
+        self.archives[archive] = (mtime, size, tuple(names))
+        self.dirty = True
+
+    def save(self, quiet=False):
+        """
+        Write the index file, if the index has been modified.
+        
+        The index file gets replaced atomically. Therefore concurrent 
+        processes never read a partially written index.
+        
+        :param quiet: if `True`, ignore errors.
+        :type quiet: bool
+        :returns: `True`, if the index file has been written.
+        :rtype: bool
+        """
+        if not self.dirty:
+            return False
+        try:
+            self.writeData()
+        except (IOError, OSError) as e:
+            if not quiet:
+                raise
+            dbg("quickimport: can't write index %r: %s" % (self.filename, e))
+            return False
+        self.dirty = False
+        return True
+    
+    def writeData(self):
+        """
+        Replace the index file.
+        """
+        data = (INDEX_MAGIC, INDEX_VERSION, tuple(sys.version_info[:2]), 
+                self.generation, self.entries, self.archives)
+        writeMarshalFile(self.filename, data)
+
+
+class SharedIndex(DirectoryIndex):
+    """
+    A :class:`DirectoryIndex`, that concurrent processes share through 
+    a memory mapped file. Used by the ``shared`` mode of :func:`install`. 
+    
+    The file starts with a header, followed by the marshalled index 
+    entries of the directories and a marshalled table, that maps each
+    directory to the position of its entry. Loading the index reads
+    the table only. The entry of a directory is read on its first 
+    lookup.
+    
+    Writers replace the file atomically. A process, that mapped 
+    the previous file, keeps a consistent view of it. This also holds
+    for the child processes created by :func:`os.fork`, because the 
+    mapping is read-only.
+    
+    :param filename: the name of the index file. See :func:`getSharedIndexFilename`.
+    :type filename: str or unicode
+    :param generation: an optional generation stamp
+    :type generation: str
+    """
+    HEADER = struct.Struct("<8sQ")
+    
+    def __init__(self, filename, generation=None):
+        DirectoryIndex.__init__(self, filename, generation)
+        self.table = {}
+        self.data = None
+    
+    def load(self):
+        self.close()
+        if not DirectoryIndex.load(self):
+            self.close()
+            return False
+        self.table = self.entries
+        self.entries = {}
+        return True
+    
+    def readData(self):
+        import mmap
+        with open(self.filename, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, tableOffset = self.HEADER.unpack(data[:self.HEADER.size])
+            if magic != SHARED_INDEX_MAGIC:
+                raise ValueError("bad magic")
+            result = marshal.loads(data[tableOffset:])
+        except Exception:
+            data.close()
+            raise
+        self.data = data
+        return result
+    
+    def close(self):
+        """
+        Unmap the index file.
+        """
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+        self.table = {}
+    
+    def lookup(self, dir):
+        if dir not in self.entries:
+            position = self.table.get(dir)
+            if position is not None:
+                offset, length = position
+                self.entries[dir] = marshal.loads(self.data[offset:offset + length])
+        return DirectoryIndex.lookup(self, dir)
+    
+    def record(self, dir, mtime, relevant, files, subdirs=None, verified=False, 
+               sourceStats=None):
+        if self.table.pop(dir, None) is not None and files is None:
+            self.dirty = True
+        DirectoryIndex.record(self, dir, mtime, relevant, files, subdirs, verified, 
+                              sourceStats)
+    
+    def writeData(self):
+        blobs = []
+        table = {}
+        offset = self.HEADER.size
+        # the entries, that have not been read, are copied unchanged
+        data = self.data
+        for dir, (start, length) in list(self.table.items()):
+            if dir not in self.entries:
+                blobs.append(data[start:start + length])
+                table[dir] = (offset, length)
+                offset += length
+        for dir, entry in list(self.entries.items()):
+            blob = marshal.dumps(entry)
+            blobs.append(blob)
+            table[dir] = (offset, len(blob))
+            offset += len(blob)
+        trailer = marshal.dumps((INDEX_MAGIC, INDEX_VERSION, tuple(sys.version_info[:2]), 
+                                 self.generation, table, self.archives))
+        def write(f):
+            f.write(self.HEADER.pack(SHARED_INDEX_MAGIC, offset))
+            for blob in blobs:
+                f.write(blob)
+            f.write(trailer)
+        writeFileAtomically(self.filename, write)
+
+
+def getSharedIndexFilename(directory, path=None):
+    """
+    Get the name of the :class:`SharedIndex` file in *directory* 
+    for the search path *path*. 
+    
+    Processes of the same user and Python version with the same 
+    search path use the same file. 
+    
+    :param directory: a directory on a local file system, 
+        e.g. ``/dev/shm``
+    :type directory: str or unicode
+    :param path: the search path. Defaults to ``sys.path``.
+    :type path: :class:`list`
+    :rtype: str
+    """
+    import hashlib
+    if path is None:
+        path = sys.path
+    key = repr((tuple(sys.version_info[:2]), getattr(os, "getuid", lambda: None)(), 
+                [os.path.abspath(dir) for dir in path]))
+    return os.path.join(directory, "quickimport-%s.idx" % 
+                        (hashlib.sha1(key.encode("utf-8")).hexdigest()[:20],))
+
+
+def rebuildIndex(filename, path=None, generation=None):
+    """
+    Create or rebuild an index file for :func:`install`.
+    
+    This function reads all directories from *path* and all 
+    directories already contained in the index file and writes
+    a new index file.
+    
+    :param filename: the name of the index file
+    :type filename: str or unicode
+    :param path: a list of directories. If not given, ``sys.path`` is used.
+    :type path: :class:`list`
+    :param generation: the generation stamp of the new index.
+    :type generation: str
+    :returns: the new index
+    :rtype: :class:`DirectoryIndex`
+    """
+    if path is None:
+        path = sys.path
+    old = DirectoryIndex(filename)
+    old.load()
+    dirs = list(path)
+    dirs.extend(sorted(dir for dir in old.entries if dir not in dirs))
+    
+    index = DirectoryIndex(filename, generation)
+    archives = set(old.archives)
+    for dir in dirs:
+        relevant, files, mtime, subdirs = readAndAnalyseDirStamped(dir, False)
+        # usable in the trustBytecode mode
+        index.record(dir, mtime, relevant, files, subdirs, 
+                     sourceStats=None if files is None else statSourceFiles(dir, files))
+        if files is None and os.path.isfile(dir):
+            archives.add(dir)
+    for archive in sorted(archives):
+        try:
+            st = os.stat(archive)
+            names = readArchive(archive)
+        except Exception:
+            continue
+        index.recordArchive(archive, st.st_mtime, st.st_size, names)
+    index.dirty = True
+    index.save()
+    return index
+
+
+def verifyIndex(filename, generation=None):
+    """
+    Compare an index file with the current content of the file system.
+    
+    :param filename: the name of the index file
+    :type filename: str or unicode
+    :param generation: the generation stamp to verify the index for.
+    :type generation: str
+    :returns: the list of directories and archives, whose index entries 
+        would be used although they do not match the file system.
+    :rtype: :class:`list`
+    """
+    index = DirectoryIndex(filename, generation)
+    index.load()
+    normcase = os.path.normcase
+    stale = []
+    for dir in sorted(index.entries):
+        entry = index.lookup(dir)
+        if entry is None:
+            # this entry gets refreshed anyway
+            continue
+        relevant, files = readAndAnalyseDir(dir, False)
+        if (files is None or relevant != entry[1] or
+            frozenset(map(normcase, files)) != frozenset(map(normcase, entry[2]))):
+            stale.append(dir)
+    for archive in sorted(index.archives):
+        names = index.lookupArchive(archive)
+        if names is None:
+            continue
+        try:
+            if frozenset(readArchive(archive)) == frozenset(names):
+                continue
+        except Exception:
+            pass
+        stale.append(archive)
+    return stale
+
+def watchCache(cache=None):
+    """
+    Start an :class:`InotifyWatcher` for the directory cache.
+    
+    :param cache: the cache dictionary. Defaults to ``sys.quickimport_cache``.
+    :type cache: dict
+    :returns: the running watcher
+    :rtype: :class:`InotifyWatcher`
+    :raises OSError: if inotify is not available
+    """
+    if cache is None:
+        cache = sys.quickimport_cache
+    watcher = cache.get(WATCHER_KEY)
+    if watcher is None:
+        watcher = InotifyWatcher(cache)
+        watcher.start()
+        cache[WATCHER_KEY] = watcher
+    return watcher
+
+
+class InotifyWatcher(object):
+    """
+    Keep the directory cache up to date using the Linux inotify API.
+    
+    A daemon thread receives the inotify events for the cached 
+    directories and applies each created, deleted or renamed entry 
+    to the cache entry of its directory. Therefore the watcher never 
+    reads a directory again. Directories, that get cached later on,
+    are watched too. 
+    
+    inotify does not report modifications made by other hosts
+    to a network file system. Use :func:`refreshCache` for those 
+    directories.
+    
+    :param cache: the cache dictionary
+    :type cache: dict
+    :raises OSError: if inotify is not available
+    """
+    # constants from <sys/inotify.h>
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+    IN_CLOEXEC = 0o2000000
+    MASK = (IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | 
+            IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+    
+    def __init__(self, cache):
+        import ctypes
+        import select
+        import threading
+        self.cache = cache
+        self.select = select.select
+        self.unpackFrom = struct.unpack_from
+        self.thread = None
+        self.lock = threading.Lock()
+        self.wds = {}
+        self.watched = {}
+        libc = ctypes.CDLL(None, use_errno=True)
+        try:
+            self.addWatch = libc.inotify_add_watch
+            fd = libc.inotify_init1(self.IN_CLOEXEC)
+        except AttributeError:
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        if fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        self.fd = fd
+        self.stopPipe = os.pipe()
+
+    def watch(self, dir):
+        """
+        Watch the directory *dir*.
+        
+        :returns: `True`, if the directory is watched. 
+        """
+        with self.lock:
+            if dir in self.watched:
+                return True
+            if PY3:
+                path = os.fsencode(dir)
+            elif isinstance(dir, unicode):
+                path = dir.encode(sys.getfilesystemencoding())
+            else:
+                path = dir
+            wd = self.addWatch(self.fd, path, self.MASK)
+            if wd < 0:
+                dbg("quickimport: can't watch %r" % (dir,))
+                return False
+            self.wds.setdefault(wd, []).append(dir)
+            self.watched[dir] = wd
+            return True
+
+    def dirUpdated(self, dir):
+        """
+        The cache listener, see :func:`addCacheListener`.
+        """
+        if dir not in self.watched:
+            self.watch(dir)
+    
+    def start(self):
+        """
+        Watch all cached directories and start the thread.
+        """
+        import threading
+        for dir in list(self.cache):
+            if isinstance(dir, stringTypes):
+                self.watch(dir)
+        addCacheListener(self.cache, self.dirUpdated)
+        self.thread = threading.Thread(target=self.run, name="quickimport-inotify")
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def stop(self):
+        """
+        Stop the thread and release the inotify instance.
+        """
+        removeCacheListener(self.cache, self.dirUpdated)
+        if self.thread is not None:
+            os.write(self.stopPipe[1], b"x")
+            self.thread.join()
+            self.thread = None
+        for fd in (self.fd,) + self.stopPipe:
+            os.close(fd)
+    
+    def run(self):
+        stopFd = self.stopPipe[0]
+        while True:
+            ready = self.select([self.fd, stopFd], [], [])[0]
+            if stopFd in ready:
+                return
+            try:
+                self.handleEvents(os.read(self.fd, 65536))
+            except Exception as e:
+                dbg("quickimport: inotify watcher: %s" % (e,))
+    
+    def handleEvents(self, data):
+        """
+        Apply a buffer of inotify events to the cache.
+        """
+        events = []
+        pos = 0
+        while pos + 16 <= len(data):
+            wd, mask, cookie, length = self.unpackFrom("iIII", data, pos)
+            name = data[pos + 16:pos + 16 + length].rstrip(b"\0")
+            pos += 16 + length
+            events.append((wd, mask, name))
+        for wd, mask, name in events:
+            self.handleEvent(wd, mask, name)
+    
+    def handleEvent(self, wd, mask, name):
+        cache = self.cache
+        if mask & self.IN_Q_OVERFLOW:
+            dbg("quickimport: inotify queue overflow")
+            for dir in list(self.watched):
+                if dir in cache:
+                    rereadDir(dir, cache)
+            return
+        if mask & self.IN_IGNORED:
+            with self.lock:
+                for dir in self.wds.pop(wd, ()):
+                    self.watched.pop(dir, None)
+            return
+        with self.lock:
+            dirs = list(self.wds.get(wd, ()))
+        for dir in dirs:
+            with getDirLock(dir):
+                self.applyEvent(dir, mask, name)
+    
+    def applyEvent(self, dir, mask, name):
+        """
+        Apply an event to the cache entry of *dir*. The caller holds 
+        the lock of *dir*.
+        """
+        cache = self.cache
+        entry = cache.get(dir)
+        if entry is None:
+            return
+        if mask & (self.IN_DELETE_SELF | self.IN_MOVE_SELF):
+            updateCache(cache, dir, ())
+            return
+        if PY3:
+            dirName = os.fsdecode(name)
+        elif isinstance(dir, unicode):
+            dirName = name.decode(sys.getfilesystemencoding())
+        else:
+            dirName = name
+        nf = os.path.normcase(dirName)
+        sourceStats = SOURCE_STATS
+        stats = None if sourceStats is None else sourceStats.get(dir)
+        if stats is not None and nf in stats:
+            # the captured stat of the file is outdated
+            stats = dict(stats)
+            del stats[nf]
+            sourceStats[dir] = stats
+        files = list(entry)
+        subdirs = entry.subdirs
+        if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+            files.append(nf)
+            if subdirs is not None and (mask & self.IN_ISDIR or 
+                                        os.path.isdir(os.path.join(dir, dirName))):
+                subdirs = subdirs + (nf,)
+        else:
+            files = [f for f in files if f != nf]
+            if subdirs is not None:
+                subdirs = [d for d in subdirs if d != nf]
+        try:
+            mtime = os.stat(dir).st_mtime
+        except OSError:
+            mtime = None
+        dbg("quickimport: inotify update of %r: %r" % (dir, dirName))
+        updateCache(cache, dir, files, subdirs, mtime)
+
+
+class NullFinder(object):
+    """
+    A PEP-302 finder class for the ``sys.path_hooks`` hook.
+    
+    This class never finds anything.
+    """
+    __slots__ = ()
+    def find_module(self, fullname, path=None):
+        return None
+    def find_spec(self, fullname, target=None):
+        return None
+nullFinder = NullFinder()
+    
+# QuickimportFinder should not have to derive from
+# pkgutil.ImpImporter.  But pkg_resources in setuptools assumes
+# (without justification!) that any path-like importer will be
+# derived from pkgutil.ImpImporter.  If QuickimportFinder derives from
+# object, any attempt to use pkg_resources will fail, e.g.,
+#   python -c "__requires__='setuptools'; import pkg_resources"
+# For the same reason QuickimportFinder derives from 
+# importlib.machinery.FileFinder on Python 3.
+class QuickimportFinder(FinderBase):
+    """
+    A PEP-302 finder class for the ``sys.path_hooks`` hook.
+    
+    This class uses the directory cache ``sys.quickimport_cache``
+    to store the content of directories from ``sys.path`` or 
+    from package specific search path lists.
+    
+    On Python 3 this class is a :class:`importlib.machinery.FileFinder`,
+    that locates modules using the directory cache. 
+    """
+    __slots__ = ("dir", "stale")
+
+    def __init__(self, dir):
+        if PY3:
+            if TRUST_BYTECODE:
+                FinderBase.__init__(self, dir, *trustedLoaderDetails)
+            elif TRACE is None and PREFETCHER is None:
+                FinderBase.__init__(self, dir, *quickimportLoaderDetails)
+            else:
+                FinderBase.__init__(self, dir, *prefetchLoaderDetails)
+        else:
+            FinderBase.__init__(self, dir)
+        self.dir = dir
+        self.stale = False
+    
+    def refreshIfStale(self):
+        """
+        Read the directory again, if :meth:`invalidate_caches` has been 
+        called and the modification time of the directory has changed.
+        """
+        self.stale = False
+        cache = getattr(sys, "quickimport_cache", None)
+        files = None if cache is None else cache.get(self.dir)
+        if files is not None and isStaleDir(self.dir, files):
+            rereadDir(self.dir, cache)
+    
+    def getCachedFiles(self, basename):
+        """
+        Get the cached directory content, if the directory contains a 
+        candidate for the module or package *basename*.
+        
+        :returns: the cached directory content or ``None``, if the 
+            directory contains no candidate.
+        :raises KeyError: if the directory is not cached. 
+        """
+        files = sys.quickimport_cache[self.dir]
+        if files.hasCandidate(os.path.normcase(basename)):
+            return files
+        return None
+    
+    def iter_modules(self, prefix=''):
+        """
+        Yield the tuples ``(name, ispkg)`` of the modules and packages in 
+        the directory like :func:`pkgutil.iter_modules` does, but take 
+        the content of the directory and of its cached sub-directories 
+        from the directory cache. Sub-directories, that are not cached, 
+        are read, but not added to the cache.
+        """
+        if self.stale:
+            self.refreshIfStale()
+        cache = getattr(sys, "quickimport_cache", None)
+        files = None if cache is None else getCachedDir(self.dir, cache)
+        if files is None:
+            if PY3:
+                modules = pkgutil._iter_file_finder_modules(self, prefix)
+            else:
+                modules = FinderBase.iter_modules(self, prefix)
+            for item in modules:
+                yield item
+            return
+        join = os.path.join
+        yielded = set()
+        # the names are sorted: packages precede modules of the same name
+        for fn in files:
+            modname = None
+            for s in suffixesByLength:
+                if fn.endswith(s):
+                    modname = fn[:-len(s)]
+                    break
+            if modname == '__init__' or modname in yielded:
+                continue
+            ispkg = False
+            if not modname:
+                if '.' in fn or files.isDir(fn) is False:
+                    continue
+                pkgPath = join(self.dir, fn)
+                pkgFiles = cache.get(pkgPath)
+                if pkgFiles is None:
+                    # like pkgutil, but don't add data directories to the cache
+                    try:
+                        pkgFiles = [os.path.normcase(f) for f in os.listdir(pkgPath)]
+                    except OSError:
+                        continue
+                if not any(init in pkgFiles for init in initfiles):
+                    # not a package
+                    continue
+                modname = fn
+                ispkg = True
+            if '.' not in modname:
+                yielded.add(modname)
+                yield prefix + modname, ispkg
+    
+    if PY3:
+        def find_spec(self, fullname, target=None):
+            dbg("find_spec (%s): %r" % (self.dir, fullname), end='')
+            profiler = PROFILER
+            if profiler is not None:
+                start = timer()
+            basename = fullname.rpartition('.')[2]
+            if self.stale:
+                self.refreshIfStale()
+            try:
+                files = self.getCachedFiles(basename)
+            except Exception as e:
+                dbg(" no quickimport dir cache: %s" % (e,))
+                spec = FinderBase.find_spec(self, fullname, target)
+                if profiler is not None:
+                    profiler.addFindTime(fullname, 0.0, timer() - start)
+                return spec
+            if profiler is not None:
+                probed = timer()
+            dirStats = None if STATS is None else getDirStats(self.dir)
+            if dirStats is not None:
+                dirStats.calls += 1
+                # the directory stat of FileFinder.find_spec
+                dirStats.avoided += STOCK_PROBES_PER_MISS
+            if files is None:
+                dbg("")
+                if dirStats is not None:
+                    dirStats.misses += 1
+                if profiler is not None:
+                    profiler.addFindTime(fullname, probed - start, 0.0)
+                return None
+            # this path is a candidate
+            dbg(" testing.. ", end='')
+            if dirStats is not None:
+                dirStats.hits += 1
+            spec = self.findSpecInFiles(fullname, basename, files, dirStats)
+            dbg("found" if spec is not None else "not found")
+            if profiler is not None:
+                profiler.addFindTime(fullname, probed - start, timer() - probed)
+            if LAZY is not None:
+                spec = makeLazySpec(spec)
+            return spec
+        
+        def findSpecInFiles(self, fullname, basename, files, dirStats=None):
+            """
+            Locate a module like :meth:`FileFinder.find_spec` does, but
+            only probe the candidates contained in *files*. If the types
+            of the entries are known (see :class:`CachedDir`), this 
+            method does not probe the file system at all. 
+            
+            :param dirStats: if given, count the probes and the avoided 
+                probes in this :class:`DirStats` object.
+            """
+            normcase = os.path.normcase
+            join = os.path.join
+            isfile = os.path.isfile
+            isdir = os.path.isdir
+            if dirStats is not None:
+                isfile = dirStats.countProbes(isfile)
+                isdir = dirStats.countProbes(isdir)
+            basenameNormcase = normcase(basename)
+            isNamespace = False
+            isDir = files.isDir(basenameNormcase)
+            if isDir is not False:
+                basePath = join(self.path, basename)
+                pkgFiles = getCachedDir(basePath, sys.quickimport_cache) if isDir else None
+                if pkgFiles is not None:
+                    for suffix, loaderClass in self._loaders:
+                        init = '__init__' + suffix
+                        isInit = pkgFiles.isFile(normcase(init))
+                        if dirStats is not None and isInit is not None:
+                            dirStats.avoided += 1
+                        if isInit or (isInit is None and isfile(join(basePath, init))):
+                            fullPath = join(basePath, init)
+                            return spec_from_file_location(fullname, fullPath,
+                                                           loader=loaderClass(fullname, fullPath),
+                                                           submodule_search_locations=[basePath])
+                    isNamespace = True
+                else:
+                    for suffix, loaderClass in self._loaders:
+                        fullPath = join(basePath, '__init__' + suffix)
+                        if isfile(fullPath):
+                            return spec_from_file_location(fullname, fullPath,
+                                                           loader=loaderClass(fullname, fullPath),
+                                                           submodule_search_locations=[basePath])
+                    isNamespace = isdir(basePath)
+            for suffix, loaderClass in self._loaders:
+                isFile = files.isFile(basenameNormcase + normcase(suffix))
+                if isFile is False:
+                    continue
+                if isFile and dirStats is not None:
+                    dirStats.avoided += 1
+                fullPath = join(self.path, basename + suffix)
+                if isFile or isfile(fullPath):
+                    return spec_from_file_location(fullname, fullPath,
+                                                   loader=loaderClass(fullname, fullPath))
+            if isNamespace:
+                spec = machinery.ModuleSpec(fullname, None)
+                spec.submodule_search_locations = [basePath]
+                return spec
+            return None
+        
+        def invalidate_caches(self):
+            """
+            Mark the cache entry of the directory as stale. Called by 
+            :func:`importlib.invalidate_caches`. Like :class:`FileFinder`,
+            the next lookup compares the modification time of the 
+            directory and reads it again, if it has changed.
+            """
+            FinderBase.invalidate_caches(self)
+            self.stale = True
+    else:
+        def find_module(self, fullname, path=None):
+            # No import lock: the cache entries are immutable and get 
+            # replaced atomically. See getDirLock().
+            dbg("find_module (%s): %r" % (self.dir, fullname), end='')
+            profiler = PROFILER
+            if profiler is not None:
+                start = timer()
+            dir = self.dir
             basename = fullname.rsplit('.', 1)[-1]
-            basenameNormcase = os.path.normcase(basename)
-            if not basenameNormcase in files:
+            try:
+                files = self.getCachedFiles(basename)
+            except Exception as e:
+                raise ImportError("Can't import %r: No quickimport dir cache for dir %r: %s" % (fullname, dir, e) )
+            if profiler is not None:
+                probed = timer()
+            dirStats = None if STATS is None else getDirStats(dir)
+            if dirStats is not None:
+                dirStats.calls += 1
+            if files is None:
+                dbg("")
+                if dirStats is not None:
+                    dirStats.misses += 1
+                    dirStats.avoided += STOCK_PROBES_PER_MISS
+                if profiler is not None:
+                    profiler.addFindTime(fullname, probed - start, 0.0)
+                return None
+            # this path is a candidate
+            if dirStats is not None:
+                dirStats.hits += 1
+            importer = sys.path_importer_cache.get(dir)
+            assert importer is self
+            try:
+                dbg("testing.. ", end='')
+                loader = self.findLoaderInFiles(fullname, basename, files, dirStats)
+                dbg("found" if loader is not None else "not found")
+                if LAZY is not None:
+                    loader = makeLazyLoader(fullname, loader)
+                return loader
+            except (ImportError, IOError) as e:
+                dbg(e)
+                return None
+            finally:
+                if profiler is not None:
+                    profiler.addFindTime(fullname, probed - start, timer() - probed)
+        
+        def findLoaderInFiles(self, fullname, basename, files, dirStats=None):
+            """
+            Locate a module like :func:`imp.find_module` does. If the 
+            types of the entries are known (see :class:`CachedDir`), 
+            this method does not probe the file system, but opens 
+            the module file directly. 
+            
+            :param dirStats: if given, count the probes and the avoided 
+                probes in this :class:`DirStats` object.
+            """
+            dir = self.dir
+            findModule = find_module
+            isfile = os.path.isfile
+            if dirStats is not None:
+                findModule = dirStats.countProbes(find_module)
+                isfile = dirStats.countProbes(isfile)
+            normcase = os.path.normcase
+            join = os.path.join
+            basenameNormcase = normcase(basename)
+            if files.subdirs is None and not (TRUST_BYTECODE and basenameNormcase not in files):
+                # In the trustBytecode mode the entries of a module, 
+                # that is not a package, are taken for files. 
+                return newImpLoader(fullname, *findModule(basename, [dir]))
+            if files.isDir(basenameNormcase):
+                pkgPath = join(dir, basename)
+                pkgFiles = getCachedDir(pkgPath, sys.quickimport_cache)
+                if pkgFiles is None:
+                    return newImpLoader(fullname, *findModule(basename, [dir]))
+                for suffix, mode, type in packageInitSuffixes:
+                    init = '__init__' + suffix
+                    isInit = pkgFiles.isFile(normcase(init))
+                    if isInit or (isInit is None and isfile(join(pkgPath, init))):
+                        if dirStats is not None:
+                            dirStats.avoided += STOCK_PROBES_PER_MISS
+                        if TRACE is not None:
+                            TRACE.record(fullname, join(pkgPath, init))
+                        return QuickimportImpLoader(fullname, None, pkgPath, ('', '', PKG_DIRECTORY))
+            for suffix, mode, type in get_suffixes():
+                if files.isFile(basenameNormcase + normcase(suffix)) is not False:
+                    filename = join(dir, basename + suffix)
+                    if dirStats is not None:
+                        dirStats.avoided += STOCK_PROBES_PER_MISS
+                    if (type == PY_SOURCE and TRUST_BYTECODE and 
+                        files.isFile(normcase(basename + suffix + ("c" if __debug__ else "o"))) is not False):
+                        return TrustedImpLoader(fullname, None, filename, (suffix, mode, type))
+                    if type in (PY_SOURCE, PY_COMPILED) and (TRACE is not None or 
+                                                             PREFETCHER is not None or
+                                                             LAZY is not None or 
+                                                             PROFILER is not None):
+                        # opens the file on demand
+                        return PrefetchImpLoader(fullname, None, filename, (suffix, mode, type))
+                    return QuickimportImpLoader(fullname, open(filename, mode), filename, (suffix, mode, type))
+            return None
+
+
+if PY3:
+    # pkgutil dispatches on the type of the finder and would 
+    # handle QuickimportFinder like any other FileFinder
+    pkgutil.iter_importer_modules.register(QuickimportFinder, QuickimportFinder.iter_modules)
+
+
+def findCachedDistributions(importer, path_item, only=False):
+    """
+    A :mod:`pkg_resources` distribution finder for :class:`QuickimportFinder`.
+    Directories, whose cached content contains no distribution metadata
+    and no eggs, yield nothing without reading the directory. Otherwise 
+    this function delegates to :func:`pkg_resources.find_on_path`.
+    """
+    import pkg_resources
+    cache = getattr(sys, "quickimport_cache", None)
+    files = None
+    if cache is not None and not path_item.lower().endswith(".egg"):
+        files = getCachedDir(importer.dir, cache)
+    if files is not None:
+        distSuffixes = (".egg-info", ".dist-info")
+        if not only:
+            distSuffixes += (".egg", ".egg-link")
+        if not any(fn.lower().endswith(distSuffixes) for fn in files):
+            return iter(())
+    return pkg_resources.find_on_path(importer, path_item, only)
+
+
+def registerPkgResourcesFinder():
+    """
+    Register :func:`findCachedDistributions` for :class:`QuickimportFinder`
+    with :mod:`pkg_resources`. The working set, that :mod:`pkg_resources` 
+    builds on import, is not affected.
+    
+    :returns: ``False``, if :mod:`pkg_resources` is not available.
+    """
+    try:
+        import pkg_resources
+    except ImportError:
+        return False
+    pkg_resources.register_finder(QuickimportFinder, findCachedDistributions)
+    return True
+
+
+class InvalidationHook(object):
+    """
+    A :data:`sys.meta_path` entry, that never finds anything. 
+    
+    Its only purpose is to hook :func:`importlib.invalidate_caches`:
+    directories, that contained no modules or packages, get analysed 
+    again on their next use. The :class:`QuickimportFinder` objects check
+    the modification times of their directories on their next lookup.  
+    """
+    __slots__ = ()
+    def find_spec(self, fullname, path=None, target=None):
+        return None
+    def invalidate_caches(self):
+        for dir, finder in list(sys.path_importer_cache.items()):
+            if finderIsNullFinder(finder):
+                del sys.path_importer_cache[dir]
+invalidationHook = InvalidationHook()
+
+
+def getPathEntryFinder(entry):
+    """
+    Get the finder for the ``sys.path`` item *entry* the same way the
+    import machinery does and store it in ``sys.path_importer_cache``.
+    
+    :returns: the finder or ``None``. On Python 2 ``None`` means, that 
+        the builtin import mechanism handles *entry*. On Python 3 ``None`` 
+        means, that no finder exists for *entry*.
+    """
+    try:
+        return sys.path_importer_cache[entry]
+    except KeyError:
+        pass
+    for hook in sys.path_hooks:
+        try:
+            finder = hook(entry)
+            break
+        except ImportError:
+            continue
+    else:
+        finder = None
+        if not PY3:
+            try:
+                finder = NullImporter(entry)
+            except ImportError:
+                pass
+    sys.path_importer_cache[entry] = finder
+    return finder
+
+
+def readArchive(archive):
+    """
+    Read the central directory of the zip archive *archive*.
+    
+    :returns: the tuple of the names of all members
+    :raises Exception: if *archive* is not a readable zip archive
+    """
+    import zipfile
+    zf = zipfile.ZipFile(archive)
+    try:
+        return tuple(zf.namelist())
+    finally:
+        zf.close()
+
+
+def makeArchiveListing(names):
+    """
+    Convert the member names of a zip archive into directory listings.
+    
+    :returns: a dict, that maps the ``/`` separated path of each 
+        directory within the archive (``""`` for the top-level directory)
+        to a :class:`CachedDir`.
+    """
+    dirs = {}
+    for name in names:
+        parts = name.split("/")
+        for i in range(len(parts) - 1):
+            files, subdirs = dirs.setdefault("/".join(parts[:i]), (set(), set()))
+            files.add(parts[i])
+            subdirs.add(parts[i])
+        files, subdirs = dirs.setdefault("/".join(parts[:-1]), (set(), set()))
+        if parts[-1]:
+            files.add(parts[-1])
+    listing = {}
+    for prefix, (files, subdirs) in dirs.items():
+        listing[prefix] = CachedDir(files, subdirs)
+    return listing
+
+
+def getArchiveListing(archive, cache, st=None):
+    """
+    Get the directory listings of the zip archive *archive* (see 
+    :func:`makeArchiveListing`). 
+    
+    The listings are cached in *cache*. If *cache* contains a 
+    :class:`DirectoryIndex`, this function reuses the member names 
+    from the index, if the modification time and the size of the 
+    archive are unchanged, or records the names in the index.
+    
+    :param st: the result of :func:`os.stat` for *archive*, if known.
+    :returns: the listings or ``None``, if *archive* is not a 
+        readable zip archive.
+    """
+    archives = cache[ARCHIVE_KEY]
+    listing = archives.get(archive)
+    if listing is not None:
+        return listing
+    index = cache.get(INDEX_KEY)
+    names = None if index is None else index.lookupArchive(archive, st)
+    if names is None:
+        t0 = timer()
+        try:
+            if st is None:
+                st = os.stat(archive)
+            names = readArchive(archive)
+        except Exception as e:
+            dbg("quickimport: can't read archive %r: %s" % (archive, e))
+            return None
+        finally:
+            if STATS is not None:
+                dirStats = getDirStats(archive)
+                dirStats.reads += 1
+                dirStats.readTime += timer() - t0
+        if index is not None:
+            index.recordArchive(archive, st.st_mtime, st.st_size, names)
+    listing = archives[archive] = makeArchiveListing(names)
+    return listing
+
+
+def findKnownArchive(path, cache):
+    """
+    Find the zip archive of the path entry *path* among the archives, 
+    that are known to the archive cache or the :class:`DirectoryIndex` 
+    of *cache*. This function does not access the file system.
+    
+    :returns: the tuple ``(archive, prefix)`` (see :func:`splitArchivePath`)
+        or ``None``.
+    """
+    archives = cache[ARCHIVE_KEY]
+    index = cache.get(INDEX_KEY)
+    split = os.path.split
+    archive = path
+    prefix = []
+    while True:
+        if archive in archives or (index is not None and archive in index.archives):
+            return archive, "/".join(reversed(prefix))
+        head, tail = split(archive)
+        if not tail or head == archive:
+            return None
+        prefix.append(tail)
+        archive = head
+
+
+def splitArchivePath(path):
+    """
+    Split the path entry *path* into the name of a zip archive and the
+    ``/`` separated path within the archive the same way 
+    :class:`zipimport.zipimporter` does. 
+    
+    :returns: the tuple ``(archive, prefix, st)`` or ``None``, if *path*
+        does not denote a file. *st* is the result of :func:`os.stat` 
+        for the archive.
+    """
+    split = os.path.split
+    archive = path
+    prefix = []
+    while True:
+        try:
+            st = os.stat(archive)
+        except OSError:
+            head, tail = split(archive)
+            if not tail or head == archive:
+                return None
+            prefix.append(tail)
+            archive = head
+            continue
+        if not S_ISREG(st.st_mode):
+            return None
+        return archive, "/".join(reversed(prefix)), st
+
+
+class ArchiveFinder(object):
+    """
+    A finder for a zip archive or a directory within a zip archive, 
+    that is an item of ``sys.path`` or of the ``__path__`` of a package. 
+    Used by the ``archives`` mode of :func:`install`.
+    
+    This finder rejects modules, that are not members of the archive, 
+    using the cached listing of the archive (see :func:`getArchiveListing`).
+    It delegates the import of candidates to a :class:`zipimport.zipimporter`, 
+    that it creates on the first candidate. Therefore only archives, 
+    that contain imported modules, get opened.
+    
+    :param path: the path entry
+    :param archive: the file name of the archive
+    :param prefix: the ``/`` separated path of the directory within the archive
+    :param files: the :class:`CachedDir` of the directory
+    """
+    def __init__(self, path, archive, prefix, files):
+        self.path = path
+        self.archive = archive
+        self.prefix = prefix
+        self.files = files
+        self.importer = None
+    
+    def __repr__(self):
+        return "%s(%r)" % (type(self).__name__, self.path)
+
+    def getImporter(self):
+        """
+        Get the zipimporter for the path entry.
+        """
+        importer = self.importer
+        if importer is None:
+            import zipimport
+            importer = self.importer = zipimport.zipimporter(self.path)
+        return importer
+    
+    def isCandidate(self, fullname):
+        """
+        Test, if the archive contains a candidate for the module *fullname*.
+        """
+        found = self.files.hasCandidate(fullname.rpartition('.')[2])
+        if STATS is not None:
+            dirStats = getDirStats(self.path)
+            dirStats.calls += 1
+            if found:
+                dirStats.hits += 1
+            else:
+                dirStats.misses += 1
+        return found
+
+    def iter_modules(self, prefix=''):
+        """
+        Used by :func:`pkgutil.iter_modules`.
+        """
+        return pkgutil.iter_importer_modules(self.getImporter(), prefix)
+    
+    if PY3:
+        def find_spec(self, fullname, target=None):
+            if not self.isCandidate(fullname):
+                return None
+            importer = self.getImporter()
+            findSpec = getattr(importer, "find_spec", None)
+            if findSpec is not None:
+                return findSpec(fullname, target)
+            # zipimport of Python < 3.10
+            loader, portions = importer.find_loader(fullname)
+            if loader is not None:
+                return spec_from_loader(fullname, loader)
+            if portions:
+                spec = machinery.ModuleSpec(fullname, None)
+                spec.submodule_search_locations = portions
+                return spec
+            return None
+        
+        def invalidate_caches(self):
+            """
+            Read the archive again, if it has been modified. Called by 
+            :func:`importlib.invalidate_caches`.
+            """
+            cache = getattr(sys, "quickimport_cache", None)
+            if cache is not None and ARCHIVE_KEY in cache:
+                cache[ARCHIVE_KEY].pop(self.archive, None)
+                listing = getArchiveListing(self.archive, cache) or {}
+                self.files = listing.get(self.prefix, CachedDir())
+            self.importer = None
+    else:
+        def find_module(self, fullname, path=None):
+            if not self.isCandidate(fullname):
+                return None
+            return self.getImporter().find_module(fullname)
+
+
+def newArchiveFinder(path, cache):
+    """
+    Create an :class:`ArchiveFinder` for the path entry *path*.
+    
+    :returns: the finder or ``None``, if *path* does not denote 
+        a zip archive.
+    """
+    known = findKnownArchive(path, cache)
+    if known is not None:
+        archive, prefix = known
+        st = None
+    else:
+        split = splitArchivePath(path)
+        if split is None:
+            return None
+        archive, prefix, st = split
+    listing = getArchiveListing(archive, cache, st)
+    if listing is None:
+        return None
+    return ArchiveFinder(path, archive, prefix, listing.get(prefix, CachedDir()))
+
+
+class ModuleIndexFinder(object):
+    """
+    A :data:`sys.meta_path` finder for top-level modules and packages.
+    
+    This finder maps the name of each top-level module or package to 
+    the ``sys.path`` items, whose cached directory content contains a 
+    candidate for the name. Therefore a top-level import costs a dict 
+    lookup instead of a call of :meth:`QuickimportFinder.find_module` 
+    for each preceding item of ``sys.path``. Items of ``sys.path``, that 
+    are not handled by :class:`QuickimportFinder` or :class:`NullFinder` 
+    (i.e. zip archives), are asked in ``sys.path`` order as usual.
+    
+    The finder rebuilds its index, if ``sys.path`` or the content of 
+    a cached ``sys.path`` item changes. If it does not find a module, 
+    the regular import machinery takes over.
+    
+    A lookup compares ``sys.path`` with the copy of the index only, if 
+    ``sys.path`` is a different list object or if its length or its 
+    first or last item changed. Replace any other item in place and 
+    call :func:`importlib.invalidate_caches` (or :meth:`invalidate_caches`).
+    """
+    def __init__(self, cache):
+        self.cache = cache
+        self.state = None
+        # the sys.path list, the index was built or checked for
+        self.path = None
+    
+    def dirUpdated(self, dir):
+        """
+        Called by :func:`updateCache`, if the cached content of *dir* changes.
+        """
+        state = self.state
+        if state is not None and dir in state[1]:
+            self.state = None
+
+    def invalidate_caches(self):
+        self.state = None
+
+    def getState(self):
+        """
+        Get the index for the current ``sys.path``.
+        
+        :returns: a tuple of the ``sys.path`` copy the index was built 
+            for, a dict, that maps each item of ``sys.path`` to its finder, 
+            a dict, that maps each normcased name to the sorted list of  
+            candidate positions and the sorted list of positions of items, 
+            that are not covered by the index. 
+        """
+        state = self.state
+        path = sys.path
+        if state is not None:
+            pathCopy = state[0]
+            if (path is self.path and len(path) == len(pathCopy) and 
+                (not path or (path[0] is pathCopy[0] and path[-1] is pathCopy[-1]))):
+                # the same list and most likely the same items
+                return state
+            if pathCopy == path:
+                self.path = path
+                return state
+        if state is not None and path[:len(state[0])] == state[0]:
+            # Items have been appended to sys.path
+            dbg("quickimport: extending module index")
+            pathCopy, finders, names, uncovered = state
+            finders = dict(finders)
+            names = dict((name, list(positions)) for name, positions in names.items())
+            uncovered = list(uncovered)
+            start = len(pathCopy)
+        else:
+            dbg("quickimport: building module index")
+            finders = {}
+            names = {}
+            uncovered = []
+            start = 0
+        pathCopy = list(path)
+        normcase = os.path.normcase
+        for pos in range(start, len(pathCopy)):
+            dir = pathCopy[pos]
+            if dir in finders or (PY3 and not isinstance(dir, str)):
+                continue
+            finder = getPathEntryFinder(os.getcwd() if PY3 and dir == '' else dir)
+            finders[dir] = finder
+            if finderIsQuickimportFinder(finder):
+                if getattr(finder, "stale", False):
+                    # invalidated by importlib.invalidate_caches()
+                    finder.refreshIfStale()
+                files = self.cache.get(finder.dir)
+            elif isinstance(finder, ArchiveFinder):
+                files = finder.files
+            elif (finderIsNullFinder(finder) or (PY3 and finder is None) or 
+                  (NullImporter is not None and isinstance(finder, NullImporter))):
+                # provides nothing
+                continue
+            else:
+                files = None
+            if files is None:
+                uncovered.append(pos)
+                continue
+            for f in files:
+                names.setdefault(f, []).append(pos)
                 for s in suffixes:
-                    if (basenameNormcase + s) in files:
+                    if f.endswith(s):
+                        positions = names.setdefault(f[:-len(s)], [])
+                        if not positions or positions[-1] != pos:
+                            positions.append(pos)
+        state = self.state = (pathCopy, finders, names, uncovered)
+        self.path = path
+        return state
+
+    def findCandidates(self, fullname):
+        """
+        Get the ``sys.path`` items, that could provide the top-level 
+        module *fullname*, and their finders in ``sys.path`` order.
+        """
+        pathCopy, finders, names, uncovered = self.getState()
+        positions = names.get(os.path.normcase(fullname), ())
+        if uncovered:
+            positions = sorted(uncovered + list(positions))
+        for pos in positions:
+            dir = pathCopy[pos]
+            finder = sys.path_importer_cache.get(os.getcwd() if PY3 and dir == '' else dir)
+            if finder is not finders[dir]:
+                # someone modified sys.path_importer_cache
+                self.state = None
+                return
+            yield dir, finder
+    
+    if PY3:
+        def find_spec(self, fullname, path=None, target=None):
+            if path is not None:
+                return None
+            for dir, finder in self.findCandidates(fullname):
+                findSpec = getattr(finder, "find_spec", None)
+                if findSpec is None:
+                    # a legacy finder, let the PathFinder handle it
+                    return None
+                spec = findSpec(fullname, target)
+                if spec is not None:
+                    if spec.loader is None:
+                        # a namespace package portion, let the 
+                        # PathFinder collect all portions
+                        return None
+                    return spec
+            return None
+    else:
+        def find_module(self, fullname, path=None):
+            if path is not None:
+                return None
+            for dir, finder in self.findCandidates(fullname):
+                if finder is None:
+                    # the builtin import mechanism
+                    finder = pkgutil.ImpImporter(dir)
+                loader = finder.find_module(fullname)
+                if loader is not None:
+                    return loader
+            return None
+    
+    
+class NegativeCacheFinder(object):
+    """
+    A :data:`sys.meta_path` finder, that remembers failed imports.
+    
+    Code like ``try: import X except ImportError: ...`` repeats the 
+    search for ``X`` on every execution. This finder remembers each 
+    miss keyed on the module name and the search path. A repeated miss 
+    costs a single dict lookup. The cache holds at most *maxsize* misses. 
+    If the cached content of a directory changes (see 
+    :func:`addCacheListener`), the finder forgets the misses, whose search 
+    path contains the directory. :func:`importlib.invalidate_caches` 
+    clears the cache. 
+    
+    A miss is only remembered, if each item of the search path is 
+    handled by :class:`QuickimportFinder`, :class:`NullFinder`, 
+    :class:`ArchiveFinder`, a zipimporter or no finder at all. 
+    
+    On Python 3 this finder replaces :class:`importlib.machinery.PathFinder`
+    in ``sys.meta_path`` and delegates to it. On Python 2 it searches 
+    the path like the builtin import does and raises :exc:`ImportError` 
+    for a known miss. 
+    
+    :param cache: the cache dictionary
+    :type cache: dict
+    :param maxsize: the maximum number of misses to remember
+    :type maxsize: int
+    """
+    def __init__(self, cache, maxsize=1024):
+        import collections
+        import zipimport
+        self.cache = cache
+        self.maxsize = maxsize
+        self.misses = collections.OrderedDict()
+        # dir -> (the cached content at the time of the first miss, 
+        #         the set of the misses, whose path contains dir) 
+        self.dirs = {}
+        self.zipimporter = zipimport.zipimporter
+    
+    def dirUpdated(self, dir):
+        """
+        The cache listener, see :func:`addCacheListener`.
+        """
+        entry = self.dirs.get(dir)
+        if entry is None:
+            return
+        old, keys = entry
+        new = self.cache.get(dir)
+        if (old is not None and new is not None and 
+            old.names == new.names and old.subdirs == new.subdirs):
+            # re-read, but unchanged
+            return
+        self.dirs.pop(dir, None)
+        for key in list(keys):
+            if self.misses.pop(key, None) is not None:
+                self.forgetMiss(key)
+    
+    def invalidate_caches(self):
+        self.misses.clear()
+        self.dirs.clear()
+        if PY3:
+            machinery.PathFinder.invalidate_caches()
+    
+    def isCacheable(self, path):
+        """
+        Test, if a miss for the search path *path* may be remembered. 
+        """
+        missing = self
+        for entry in (sys.path if path is None else path):
+            if PY3 and entry == '':
+                entry = os.getcwd()
+            finder = sys.path_importer_cache.get(entry, missing)
+            if finder is missing:
+                return False
+            if (finder is None or finderIsNullFinder(finder) or 
+                finderIsQuickimportFinder(finder) or
+                isinstance(finder, (self.zipimporter, ArchiveFinder)) or
+                (NullImporter is not None and isinstance(finder, NullImporter))):
+                continue
+            return False
+        return True
+    
+    def getPathDirs(self, key):
+        return set(os.getcwd() if PY3 and entry == '' else entry for entry in key[1])
+    
+    def addMiss(self, key):
+        misses = self.misses
+        misses[key] = True
+        for dir in self.getPathDirs(key):
+            entry = self.dirs.get(dir)
+            if entry is None:
+                entry = self.dirs[dir] = (self.cache.get(dir), set())
+            entry[1].add(key)
+        if len(misses) > self.maxsize:
+            self.forgetMiss(misses.popitem(last=False)[0])
+    
+    def forgetMiss(self, key):
+        """
+        Remove the removed miss *key* from the index of the directories.
+        """
+        for dir in self.getPathDirs(key):
+            entry = self.dirs.get(dir)
+            if entry is not None:
+                entry[1].discard(key)
+                if not entry[1]:
+                    del self.dirs[dir]
+
+    if PY3:
+        def find_spec(self, fullname, path=None, target=None):
+            key = (fullname, tuple(sys.path if path is None else path))
+            if key in self.misses:
+                dbg("quickimport: known miss %r" % (fullname,))
+                return None
+            spec = machinery.PathFinder.find_spec(fullname, path, target)
+            if spec is None and self.isCacheable(path):
+                self.addMiss(key)
+            return spec
+        
+        def find_distributions(self, *args, **kwargs):
+            return machinery.PathFinder.find_distributions(*args, **kwargs)
+    else:
+        def find_module(self, fullname, path=None):
+            key = (fullname, tuple(sys.path if path is None else path))
+            if key in self.misses:
+                dbg("quickimport: known miss %r" % (fullname,))
+                raise ImportError("No module named %s" % (fullname.rpartition('.')[2],))
+            if path is None:
+                if is_builtin(fullname) or is_frozen(fullname):
+                    return None
+                path = sys.path
+            for entry in path:
+                finder = getPathEntryFinder(entry)
+                if finder is None:
+                    # the builtin import mechanism
+                    finder = pkgutil.ImpImporter(entry)
+                loader = finder.find_module(fullname)
+                if loader is not None:
+                    return loader
+            if self.isCacheable(path):
+                self.addMiss(key)
+            return None
+
+
+def removeNegativeCacheFinder():
+    """
+    Remove all :class:`NegativeCacheFinder` objects from ``sys.meta_path``.
+    """
+    for i, finder in reversed(list(enumerate(sys.meta_path))):
+        if isinstance(finder, NegativeCacheFinder):
+            if PY3:
+                sys.meta_path[i] = machinery.PathFinder
+            else:
+                del sys.meta_path[i]
+
+
+class TraceRecorder(object):
+    """
+    Record the files read by the loaders of the :class:`QuickimportFinder`
+    in the order of their first use. 
+    
+    The trace file is marshalled data. It is only valid for the 
+    Python version, that created it. See :func:`loadTrace`.
+    
+    :param filename: the name of the trace file
+    :type filename: str or unicode
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = []
+        self.seen = set()
+        
+    def record(self, fullname, path):
+        """
+        Record, that the module *fullname* has read the file *path*.
+        """
+        if path not in self.seen:
+            self.seen.add(path)
+            self.entries.append((fullname, path))
+    
+    def save(self, quiet=False):
+        """
+        Write the trace file. The file gets replaced atomically.
+        
+        :param quiet: if `True`, ignore errors.
+        :type quiet: bool
+        :returns: `True`, if the trace file has been written.
+        :rtype: bool
+        """
+        data = (TRACE_MAGIC, TRACE_VERSION, tuple(sys.version_info[:2]), 
+                tuple(self.entries))
+        try:
+            writeMarshalFile(self.filename, data)
+        except (IOError, OSError) as e:
+            if not quiet:
+                raise
+            dbg("quickimport: can't write trace %r: %s" % (self.filename, e))
+            return False
+        return True
+
+
+def loadTrace(filename):
+    """
+    Read a trace file written by :class:`TraceRecorder`.
+    
+    :returns: the list of ``(fullname, path)`` tuples in the order of
+        the recording or an empty list, if the file is invalid. 
+    """
+    try:
+        with open(filename, "rb") as f:
+            magic, version, pyversion, entries = marshal.load(f)
+    except Exception as e:
+        dbg("quickimport: can't read trace %r: %s" % (filename, e))
+        return []
+    if (magic != TRACE_MAGIC or version != TRACE_VERSION or 
+        pyversion != tuple(sys.version_info[:2])):
+        dbg("quickimport: ignoring incompatible trace %r" % (filename,))
+        return []
+    return list(entries)
+
+
+class Prefetcher(object):
+    """
+    Read files in background threads ahead of their use.
+    
+    The threads read the files in the given order. The loaders take 
+    the content using :meth:`take`. 
+    
+    :param paths: the names of the files to read
+    :param workers: the number of threads
+    """
+    def __init__(self, paths, workers=DEFAULT_PREFETCH_WORKERS):
+        import threading
+        from collections import deque
+        self.pending = deque(paths)
+        self.pendingSet = set(paths)
+        self.reading = set()
+        self.data = {}
+        self.hits = 0
+        self.condition = threading.Condition()
+        self.threads = [threading.Thread(target=self.run, name="quickimport-prefetch")
+                        for _ in range(min(workers, len(self.pending)))]
+        
+    def start(self):
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+    
+    def stop(self):
+        """
+        Stop reading and discard the content read so far.
+        """
+        with self.condition:
+            self.pending.clear()
+            self.pendingSet.clear()
+            self.data.clear()
+    
+    def run(self):
+        condition = self.condition
+        while True:
+            with condition:
+                path = None
+                while self.pending:
+                    path = self.pending.popleft()
+                    if path in self.pendingSet:
                         break
+                    path = None
+                if path is None:
+                    return
+                self.pendingSet.discard(path)
+                self.reading.add(path)
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except (IOError, OSError):
+                data = None
+            with condition:
+                self.reading.discard(path)
+                if data is not None:
+                    self.data[path] = data
+                condition.notify_all()
+                
+    def take(self, path):
+        """
+        Get the content of the file *path*. If a thread is reading 
+        the file, wait for it.
+        
+        :returns: the content or ``None``, if the file has not been 
+            read. The file won't be read later on.
+        """
+        with self.condition:
+            if path in self.pendingSet:
+                self.pendingSet.discard(path)
+                return None
+            while path in self.reading:
+                self.condition.wait()
+            data = self.data.pop(path, None)
+            if data is not None:
+                self.hits += 1
+            return data
+
+
+class ResourceCache(object):
+    """
+    A size bounded cache for the content of the data files read by the 
+    loaders of the :class:`QuickimportFinder` (for instance using 
+    :func:`pkgutil.get_data`). A cached content is used as long as 
+    the modification time and the size of the file are unchanged. 
+    
+    :param maxSize: the maximum total size of the cached files in bytes
+    :type maxSize: int
+    :param maxFileSize: files larger than *maxFileSize* bytes are not cached
+    :type maxFileSize: int
+    """
+    def __init__(self, maxSize=DEFAULT_RESOURCE_CACHE_SIZE, 
+                 maxFileSize=MAX_CACHED_RESOURCE_SIZE):
+        import collections
+        # path -> (mtime, size, data) in the order of their use
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.maxSize = maxSize
+        self.maxFileSize = min(maxFileSize, maxSize)
+        self.lock = allocate_lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def read(self, path):
+        """
+        Get the content of the file *path*. 
+        
+        :raises IOError: if the file can't be read
+        """
+        entry = self.entries.get(path)
+        if entry is not None:
+            st = os.stat(path)
+            if st.st_mtime == entry[0] and st.st_size == entry[1]:
+                with self.lock:
+                    if self.entries.pop(path, None) is not None:
+                        # the most recently used entry 
+                        self.entries[path] = entry
+                    self.hits += 1
+                return entry[2]
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            data = f.read()
+        with self.lock:
+            self.misses += 1
+            old = self.entries.pop(path, None)
+            if old is not None:
+                self.size -= old[1]
+            if len(data) == st.st_size and st.st_size <= self.maxFileSize:
+                self.entries[path] = (st.st_mtime, st.st_size, data)
+                self.size += st.st_size
+                while self.size > self.maxSize:
+                    self.size -= self.entries.popitem(False)[1][1]
+        return data
+
+
+class ResourceLoaderMixin(object):
+    """
+    The resource access of the loaders of the :class:`QuickimportFinder`. 
+    Data files, that are missing from a cached directory, don't cause
+    any file system access. Data files are read through the 
+    :class:`ResourceCache`, if the flag ``resourceCache`` of 
+    :func:`install` is given.
+    """
+    def get_data(self, path):
+        if path.endswith(suffixesTuple):
+            # a module file is read only once
+            return self.getModuleData(path)
+        if lookupCachedFile(path) is False:
+            raise IOError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+        resources = RESOURCES
+        if resources is not None:
+            return resources.read(path)
+        with open(path, "rb") as f:
+            return f.read()
+    
+    def is_resource(self, name):
+        """
+        Test, if the directory of the module contains the data file *name*.
+        """
+        if "/" in name or os.sep in name:
+            return False
+        path = os.path.join(self.getResourceDir(), name)
+        isFile = lookupCachedFile(path)
+        if isFile is None:
+            return os.path.isfile(path)
+        return isFile
+
+
+if PY3:
+    class ResourceFileLoaderMixin(ResourceLoaderMixin):
+        def getModuleData(self, path):
+            return super(ResourceLoaderMixin, self).get_data(path)
+        
+        def getResourceDir(self):
+            return os.path.dirname(self.path)
+        
+        def exec_module(self, module):
+            profiler = PROFILER
+            if profiler is None:
+                return super(ResourceFileLoaderMixin, self).exec_module(module)
+            # the steps of importlib's exec_module() with timing
+            node = profiler.enter(module.__name__)
+            try:
+                code = self.get_code(module.__name__)
+                if code is None:
+                    raise ImportError("cannot load module %r when get_code() returns None" % 
+                                      (module.__name__,))
+                profiler.loaded()
+                exec(code, module.__dict__)
+            finally:
+                profiler.exit(node)
+    
+    class QuickimportSourceFileLoader(ResourceFileLoaderMixin, machinery.SourceFileLoader):
+        pass
+    
+    class QuickimportSourcelessFileLoader(ResourceFileLoaderMixin, machinery.SourcelessFileLoader):
+        pass
+    
+    quickimportLoaderDetails = [(machinery.ExtensionFileLoader, machinery.EXTENSION_SUFFIXES),
+                                (QuickimportSourceFileLoader, machinery.SOURCE_SUFFIXES),
+                                (QuickimportSourcelessFileLoader, machinery.BYTECODE_SUFFIXES)]
+    
+    moduleFileSuffixes = tuple(machinery.SOURCE_SUFFIXES + machinery.BYTECODE_SUFFIXES)
+    
+    class PrefetchLoaderMixin(object):
+        """
+        Serve the module files from the :class:`Prefetcher` and record
+        them with the :class:`TraceRecorder`.
+        """
+        def get_data(self, path):
+            data = None if PREFETCHER is None else PREFETCHER.take(path)
+            if data is None:
+                data = super(PrefetchLoaderMixin, self).get_data(path)
+            if TRACE is not None and path.endswith(moduleFileSuffixes):
+                # not the data files of the package
+                TRACE.record(self.name, path)
+            return data
+    
+    class PrefetchSourceFileLoader(PrefetchLoaderMixin, QuickimportSourceFileLoader):
+        pass
+    
+    class PrefetchSourcelessFileLoader(PrefetchLoaderMixin, QuickimportSourcelessFileLoader):
+        pass
+    
+    prefetchLoaderDetails = [(machinery.ExtensionFileLoader, machinery.EXTENSION_SUFFIXES),
+                             (PrefetchSourceFileLoader, machinery.SOURCE_SUFFIXES),
+                             (PrefetchSourcelessFileLoader, machinery.BYTECODE_SUFFIXES)]
+    
+    class TrustedSourceFileLoader(PrefetchSourceFileLoader):
+        """
+        A source file loader for the ``trustBytecode`` mode of :func:`install`. 
+        If the directory cache lists the compiled file of the module, the 
+        loader compares its header with the modification time and the size 
+        of the source file captured, when the directory has been read (see 
+        :func:`getListedStat`), instead of calling :c:func:`stat()`. 
+        Otherwise it loads the module like :class:`SourceFileLoader`.
+        """
+        def get_code(self, fullname):
+            stat = getListedStat(self.path)
+            try:
+                compiled = cache_from_source(self.path)
+            except NotImplementedError:
+                compiled = None
+            if stat is not None and compiled is not None and isCachedFile(compiled):
+                try:
+                    data = self.get_data(compiled)
+                except OSError:
+                    data = None
+                if (data is not None and parsePycHeader(data) == 
+                    (int(stat[0]) & 0xFFFFFFFF, stat[1] & 0xFFFFFFFF)):
+                    try:
+                        code = marshal.loads(data[len(pycHeader(0, 0)):])
+                    except (EOFError, ValueError, TypeError):
+                        pass
+                    else:
+                        _fix_co_filename(code, self.path)
+                        return code
+            return super(TrustedSourceFileLoader, self).get_code(fullname)
+    
+    trustedLoaderDetails = [(machinery.ExtensionFileLoader, machinery.EXTENSION_SUFFIXES),
+                            (TrustedSourceFileLoader, machinery.SOURCE_SUFFIXES),
+                            (PrefetchSourcelessFileLoader, machinery.BYTECODE_SUFFIXES)]
+else:
+    class QuickimportImpLoader(ResourceLoaderMixin, ImpLoader):
+        """
+        The :class:`pkgutil.ImpLoader` of the :class:`QuickimportFinder`. 
+        """
+        def __init__(self, fullname, file, filename, etc):
+            # ImpLoader is a classic class: object.__init__ precedes it
+            ImpLoader.__init__(self, fullname, file, filename, etc)
+        
+        def getModuleData(self, path):
+            return ImpLoader.get_data(self, path)
+        
+        def getResourceDir(self):
+            if self.etc[2] == PKG_DIRECTORY:
+                return self.filename
+            return os.path.dirname(self.filename)
+        
+        def load_module(self, fullname):
+            profiler = PROFILER
+            if profiler is None:
+                return self.loadModule(fullname)
+            node = profiler.enter(self._fix_name(fullname))
+            try:
+                return self.loadModule(fullname)
+            finally:
+                profiler.exit(node)
+        
+        def loadModule(self, fullname):
+            return ImpLoader.load_module(self, fullname)
+    
+    class PrefetchImpLoader(QuickimportImpLoader):
+        """
+        An :class:`pkgutil.ImpLoader` for source and compiled modules, 
+        that executes the byte code served by the :class:`Prefetcher` and
+        records the module files with the :class:`TraceRecorder`. 
+        
+        Modules without valid byte code are loaded by :func:`imp.load_module`.
+        """
+        def _reopen(self):
+            if self.file is None:
+                self.file = open(self.filename, self.etc[1])
+            else:
+                ImpLoader._reopen(self)
+        
+        # take the mtime of the source from getListedStat()
+        trustBytecode = False
+        
+        def getCompiledCode(self, fullname):
+            """
+            Get the byte code of the module and the name of the compiled 
+            file, if the compiled file is valid. Otherwise return ``None``.
+            """
+            if self.etc[2] == PY_COMPILED:
+                compiled = self.filename
+                mtime = None
+            else:
+                compiled = self.filename + ("c" if __debug__ else "o")
+                stat = getListedStat(self.filename) if self.trustBytecode else None
+                if stat is not None:
+                    mtime = stat[0]
                 else:
-                    dbg("")
+                    mtime = os.stat(self.filename).st_mtime
+                mtime = int(mtime) & 0xFFFFFFFF
+            data = None if PREFETCHER is None else PREFETCHER.take(compiled)
+            if data is None:
+                try:
+                    with open(compiled, "rb") as f:
+                        data = f.read()
+                except IOError:
                     return None
-            # this path is a candidate
-            importer = sys.path_importer_cache.get(dir)
-            assert importer is self
+            if data[:4] != get_magic():
+                return None
+            if mtime is not None and struct.unpack("<I", data[4:8])[0] != mtime:
+                return None
             try:
-                dbg("testing.. ", end='')
-                loader = ImpLoader(fullname, *find_module(basename, [dir]))
-                dbg("found")
-                return loader
-            except ImportError, e:
-                dbg(e)
+                code = marshal.loads(data[8:])
+            except (EOFError, ValueError, TypeError):
                 return None
-        finally:
-            release_lock()
-            
+            if TRACE is not None:
+                TRACE.record(fullname, compiled)
+            return code, compiled
+        
+        def get_code(self, fullname=None):
+            if TRACE is not None:
+                TRACE.record(self._fix_name(fullname), self.filename)
+            return ImpLoader.get_code(self, fullname)
+        
+        def loadModule(self, fullname):
+            fullname = self._fix_name(fullname)
+            result = self.getCompiledCode(fullname)
+            if result is None:
+                if TRACE is not None:
+                    TRACE.record(fullname, self.filename)
+                return ImpLoader.load_module(self, fullname)
+            code, filename = result
+            if PROFILER is not None:
+                PROFILER.loaded()
+            module = sys.modules.get(fullname)
+            isNew = module is None
+            if isNew:
+                module = sys.modules[fullname] = new_module(fullname)
+            module.__file__ = filename
+            try:
+                exec(code, module.__dict__)
+            except:
+                if isNew:
+                    sys.modules.pop(fullname, None)
+                raise
+            return sys.modules[fullname]
+    
+    
+    class TrustedImpLoader(PrefetchImpLoader):
+        """
+        A loader for the ``trustBytecode`` mode of :func:`install`, that 
+        compares the header of the compiled file with the modification time 
+        of the source file captured, when the directory has been read, 
+        instead of calling :c:func:`stat()`. See :func:`getListedStat`.
+        """
+        trustBytecode = True
+
+
+    def newImpLoader(fullname, file, filename, etc):
+        """
+        Create the loader for the result of :func:`imp.find_module`. 
+        """
+        if etc[2] in (PY_SOURCE, PY_COMPILED) and (TRACE is not None or 
+                                                   PREFETCHER is not None or
+                                                   LAZY is not None or
+                                                   PROFILER is not None):
+            file.close()
+            return PrefetchImpLoader(fullname, None, filename, etc)
+        if etc[2] == PKG_DIRECTORY and TRACE is not None:
+            for suffix, mode, type in packageInitSuffixes:
+                init = os.path.join(filename, '__init__' + suffix)
+                if os.path.isfile(init):
+                    TRACE.record(fullname, init)
+                    break
+        return QuickimportImpLoader(fullname, file, filename, etc)
+
+
+def startPrefetch(filename, workers=DEFAULT_PREFETCH_WORKERS):
+    """
+    Read the files of the trace *filename* in background threads. 
+    The loaders of the :class:`QuickimportFinder` use the content 
+    instead of reading the files. 
+    
+    :returns: the :class:`Prefetcher` or ``None``, if the trace is 
+        empty or invalid.
+    """
+    global PREFETCHER
+    stopPrefetch()
+    paths = [path for fullname, path in loadTrace(filename)]
+    if not paths:
+        return None
+    PREFETCHER = Prefetcher(paths, workers)
+    PREFETCHER.start()
+    return PREFETCHER
+
+
+def stopPrefetch():
+    global PREFETCHER
+    if PREFETCHER is not None:
+        PREFETCHER.stop()
+        PREFETCHER = None
+
+
+def startTrace(filename):
+    """
+    Record the files read by the loaders of the :class:`QuickimportFinder`.
+    The trace gets written to *filename* at exit or by :func:`stopTrace`.
+    
+    :returns: the :class:`TraceRecorder`
+    """
+    global TRACE
+    stopTrace()
+    TRACE = TraceRecorder(filename)
+    registerAtExit(stopTrace)
+    return TRACE
+
+
+def stopTrace():
+    """
+    Stop the recording and write the trace file.
+    """
+    global TRACE
+    if TRACE is not None:
+        trace = TRACE
+        TRACE = None
+        trace.save(True)
+
+
+def enableLazy(allow=None, deny=()):
+    """
+    Enable the lazy mode of the :class:`QuickimportFinder`: a source or 
+    byte code module gets an empty placeholder module on import. The 
+    module file is read and executed on the first access of an 
+    attribute of the placeholder, that is not set yet. 
+    
+    Modules, that are imported for their side effects (for instance 
+    modules, that register plugins or patch other modules), must be 
+    loaded immediately. Put them on the *deny* list. 
+    
+    On Python 3 this mode uses :class:`importlib.util.LazyLoader`. 
+    On Python 2 packages are always loaded immediately.
+    
+    :param allow: the :mod:`fnmatch` patterns of the names of the modules, 
+        that may be loaded lazily. ``None`` allows all modules. 
+    :type allow: sequence of str
+    :param deny: the patterns of the names of the modules, that are 
+        always loaded immediately. 
+    :type deny: sequence of str
+    """
+    global LAZY
+    # compile the patterns now: the finder must not import fnmatch
+    from fnmatch import translate
+    if PY3:
+        # the LazyLoader of newer versions uses threading
+        import threading
+    def compilePatterns(patterns):
+        return tuple(re.compile(translate(pattern)).match for pattern in patterns)
+    LAZY = (None if allow is None else compilePatterns(allow), compilePatterns(deny))
+
+
+def disableLazy():
+    """
+    Disable the lazy mode. Placeholder modules, that have not been 
+    used yet, stay lazy. 
+    """
+    global LAZY
+    LAZY = None
+
+
+def isLazyModule(fullname):
+    """
+    Test, if the module *fullname* gets loaded lazily. 
+    """
+    lazy = LAZY
+    if lazy is None:
+        return False
+    allow, deny = lazy
+    for match in deny:
+        if match(fullname):
+            return False
+    if allow is None:
+        return True
+    for match in allow:
+        if match(fullname):
+            return True
+    return False
+
+
+if PY3:
+    def makeLazySpec(spec):
+        """
+        Use a :class:`importlib.util.LazyLoader` for *spec*, if the 
+        module gets loaded lazily.
+        """
+        if (spec is not None and 
+            isinstance(spec.loader, (machinery.SourceFileLoader, 
+                                     machinery.SourcelessFileLoader)) and
+            isLazyModule(spec.name)):
+            from importlib.util import LazyLoader
+            spec.loader = LazyLoader(spec.loader)
+        return spec
+else:
+    from types import ModuleType
+
+    class LazyModule(ModuleType):
+        """
+        The placeholder of a module in the lazy mode. See :func:`enableLazy`.
+        """
+        def __getattr__(self, name):
+            # called for missing attributes only: after loading there 
+            # is no overhead
+            acquire_lock()
+            try:
+                loader = self.__dict__.pop("__lazyloader__", None)
+                if loader is not None:
+                    fullname = self.__name__
+                    dbg("quickimport: loading lazy module %r" % (fullname,))
+                    try:
+                        loader.load_module(fullname)
+                    except:
+                        if sys.modules.get(fullname) is self:
+                            del sys.modules[fullname]
+                        raise
+            finally:
+                release_lock()
+            if loader is None:
+                raise AttributeError("'module' object has no attribute %r" % (name,))
+            return getattr(self, name)
+    
+    class LazyImpLoader(object):
+        """
+        A loader, that creates a :class:`LazyModule` and defers the 
+        loading of the module to the wrapped :class:`pkgutil.ImpLoader`. 
+        """
+        def __init__(self, loader):
+            self.loader = loader
+        
+        def load_module(self, fullname):
+            if fullname in sys.modules:
+                # reload()
+                return self.loader.load_module(fullname)
+            module = LazyModule(fullname)
+            module.__loader__ = self.loader
+            module.__lazyloader__ = self.loader
+            module.__package__ = fullname.rpartition('.')[0] or None
+            sys.modules[fullname] = module
+            return module
+        
+        def __getattr__(self, name):
+            # the other methods of the PEP 302 loader protocol
+            return getattr(self.loader, name)
+    
+    def makeLazyLoader(fullname, loader):
+        """
+        Wrap the *loader* found for the module *fullname* in a 
+        :class:`LazyImpLoader`, if the module gets loaded lazily.
+        """
+        # Packages are loaded immediately: the import of a sub-module 
+        # must execute the __init__ module of the package first.
+        if (isinstance(loader, ImpLoader) and 
+            loader.etc[2] in (PY_SOURCE, PY_COMPILED) and
+            isLazyModule(fullname)):
+            return LazyImpLoader(loader)
+        return loader
+
+
+def getPycMagic():
+    if PY3:
+        from importlib.util import MAGIC_NUMBER
+        return MAGIC_NUMBER
+    return get_magic()
+
+
+class Snapshot(object):
+    """
+    A file containing the marshalled code objects of modules.
+    
+    The file starts with a header, followed by the marshalled code 
+    objects and a marshalled index. The index maps the name of each 
+    module to the position of its code object, a flag for packages, 
+    the name of its source file and the modification time and size of 
+    the source at the time of compilation. See :func:`buildSnapshot`. 
+    
+    The file is memory mapped. It is only valid for the Python version,
+    that created it.
+    
+    :param filename: the name of the snapshot file
+    :type filename: str or unicode
+    """
+    HEADER = struct.Struct("<8sQ")
+    
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = {}
+        self.data = None
+
+    def load(self):
+        """
+        Map the snapshot file into memory and read its index.
+        
+        :returns: `True`, if a valid snapshot has been read.
+        :rtype: bool
+        """
+        import mmap
+        self.close()
+        try:
+            with open(self.filename, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError) as e:
+            dbg("quickimport: can't read snapshot %r: %s" % (self.filename, e))
+            return False
+        try:
+            magic, indexOffset = self.HEADER.unpack(data[:self.HEADER.size])
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError("bad magic")
+            version, pyversion, pycMagic, entries = marshal.loads(data[indexOffset:])
+        except Exception as e:
+            dbg("quickimport: can't read snapshot %r: %s" % (self.filename, e))
+            data.close()
+            return False
+        if (version != SNAPSHOT_VERSION or pyversion != tuple(sys.version_info[:2]) or 
+            pycMagic != getPycMagic()):
+            dbg("quickimport: ignoring incompatible snapshot %r" % (self.filename,))
+            data.close()
+            return False
+        self.data = data
+        self.entries = entries
+        return True
+    
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+        self.entries = {}
+    
+    def lookup(self, fullname):
+        """
+        Get the index entry of the module *fullname*.
+        
+        :returns: the tuple ``(offset, length, isPackage, source, mtime, size)``
+            or ``None``.
+        """
+        return self.entries.get(fullname)
+    
+    def isValid(self, entry):
+        """
+        Test, if the source of the index *entry* is unchanged.
+        """
+        try:
+            st = os.stat(entry[3])
+        except OSError:
+            return False
+        return st.st_mtime == entry[4] and st.st_size == entry[5]
+    
+    def getCode(self, fullname):
+        """
+        Get the code object of the module *fullname*.
+        """
+        offset, length = self.entries[fullname][:2]
+        return marshal.loads(self.data[offset:offset + length])
+
+
+def buildSnapshot(filename, trace):
+    """
+    Write a :class:`Snapshot` file containing the modules of the *trace*. 
+    Modules without source are omitted. 
+    
+    :param filename: the name of the snapshot file
+    :type filename: str or unicode
+    :param trace: the ``(fullname, filename)`` entries recorded by a 
+        :class:`TraceRecorder`. See :func:`traceApp` and :func:`loadTrace`.
+    :type trace: sequence of tuples
+    :returns: the names of the modules in the snapshot
+    :rtype: list
+    """
+    entries = {}
+    blobs = []
+    names = []
+    offset = Snapshot.HEADER.size
+    for fullname, moduleFile in trace:
+        if fullname in entries:
+            continue
+        source = getSourceFilename(moduleFile)
+        if source is None:
+            continue
+        source = os.path.abspath(source)
+        with open(source, "rb") as f:
+            st = os.fstat(f.fileno())
+            code = compile(f.read(), source, "exec", 0, True)
+        data = marshal.dumps(code)
+        isPackage = os.path.splitext(os.path.basename(source))[0] == "__init__"
+        entries[fullname] = (offset, len(data), isPackage, source, st.st_mtime, st.st_size)
+        blobs.append(data)
+        names.append(fullname)
+        offset += len(data)
+    index = marshal.dumps((SNAPSHOT_VERSION, tuple(sys.version_info[:2]), getPycMagic(), entries))
+    def write(f):
+        f.write(Snapshot.HEADER.pack(SNAPSHOT_MAGIC, offset))
+        for data in blobs:
+            f.write(data)
+        f.write(index)
+    writeFileAtomically(filename, write)
+    return names
+
+
+class SnapshotFinder(object):
+    """
+    A :data:`sys.meta_path` finder, that loads modules from a 
+    :class:`Snapshot`.
+    
+    The finder only serves a module, if its source file is unchanged and
+    if the directory of the module is on the search path. The cached 
+    directories preceding this directory on the search path must not 
+    contain a candidate for the module. In the ``trustBytecode`` mode 
+    of :func:`install` it skips the check of the source file.
+    """
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.hits = 0
+        self.stale = 0
+    
+    def findEntry(self, fullname, path):
+        snapshot = self.snapshot
+        entry = snapshot.lookup(fullname)
+        if entry is None:
+            return None
+        dir = os.path.dirname(entry[3])
+        if entry[2]:
+            dir = os.path.dirname(dir)
+        if path is None:
+            path = sys.path
+        cache = getattr(sys, "quickimport_cache", {})
+        basename = os.path.normcase(fullname.rpartition(".")[2])
+        for item in path:
+            if PY3 and not isinstance(item, str):
+                continue
+            if item == dir or os.path.abspath(item) == dir:
+                break
+            files = cache.get(os.getcwd() if PY3 and item == '' else item)
+            if files is not None and files.hasCandidate(basename):
+                # a preceding item of the path shadows the snapshot
+                return None
+        else:
+            return None
+        if not TRUST_BYTECODE and not snapshot.isValid(entry):
+            self.stale += 1
+            return None
+        self.hits += 1
+        return entry
     
+    if PY3:
+        def find_spec(self, fullname, path=None, target=None):
+            entry = self.findEntry(fullname, path)
+            if entry is None:
+                return None
+            source = entry[3]
+            return spec_from_file_location(fullname, source, 
+                loader=SnapshotLoader(fullname, source, self.snapshot), 
+                submodule_search_locations=[os.path.dirname(source)] if entry[2] else None)
+        
+        def invalidate_caches(self):
+            pass
+    else:
+        def find_module(self, fullname, path=None):
+            entry = self.findEntry(fullname, path)
+            if entry is None:
+                return None
+            return SnapshotLoader(fullname, entry[3], self.snapshot)
+
+
+if PY3:
+    class SnapshotLoader(machinery.SourceFileLoader):
+        """
+        A loader, that executes the code object from a :class:`Snapshot`.
+        """
+        def __init__(self, fullname, path, snapshot):
+            machinery.SourceFileLoader.__init__(self, fullname, path)
+            self.snapshot = snapshot
+        
+        def get_code(self, fullname):
+            return self.snapshot.getCode(fullname)
+else:
+    class SnapshotLoader(object):
+        """
+        A loader, that executes the code object from a :class:`Snapshot`.
+        """
+        def __init__(self, fullname, path, snapshot):
+            self.fullname = fullname
+            self.path = path
+            self.snapshot = snapshot
+        
+        def get_code(self, fullname=None):
+            return self.snapshot.getCode(fullname or self.fullname)
+        
+        def get_source(self, fullname=None):
+            with open(self.path, "rU") as f:
+                return f.read()
+        
+        def get_filename(self, fullname=None):
+            return self.path
+        
+        def is_package(self, fullname=None):
+            return self.snapshot.lookup(fullname or self.fullname)[2]
+        
+        def load_module(self, fullname):
+            code = self.get_code(fullname)
+            module = sys.modules.get(fullname)
+            isNew = module is None
+            if isNew:
+                module = sys.modules[fullname] = new_module(fullname)
+            module.__file__ = self.path
+            module.__loader__ = self
+            if self.is_package(fullname):
+                module.__path__ = [os.path.dirname(self.path)]
+                module.__package__ = fullname
+            else:
+                module.__package__ = fullname.rpartition(".")[0]
+            try:
+                exec(code, module.__dict__)
+            except:
+                if isNew:
+                    sys.modules.pop(fullname, None)
+                raise
+            return sys.modules[fullname]
+
+
+def removeSnapshotFinder():
+    """
+    Remove all :class:`SnapshotFinder` objects from ``sys.meta_path``
+    and close their snapshots.
+    """
+    for finder in sys.meta_path[:]:
+        if isinstance(finder, SnapshotFinder):
+            sys.meta_path.remove(finder)
+            finder.snapshot.close()
     
+
 def newQuickimportFinder(dir):
     """
     A PEP-302 finder factory function for the  import hook ``sys.path_hooks``. 
@@ -398,9 +4399,10 @@ def newQuickimportFinder(dir):
     :class:`QuickimportFinder` or :class:`NullFinder`, if 
     *dir* denotes a regular directory. Class :class:`NullFinder` is used,
     if the directory does not contain any Python module or package. 
+    In the ``archives`` mode of :func:`install` this function returns 
+    an :class:`ArchiveFinder`, if *dir* denotes a zip archive.
     
-    If *dir* does not denote a regular directory, this function raises 
-    :exc:`ImportError`.
+    Otherwise this function raises :exc:`ImportError`.
     """
     dbg("newQuickimportFinder, dir: %r" % (dir,))
     try:
@@ -410,17 +4412,58 @@ def newQuickimportFinder(dir):
     else:
         if dir in cache:
             return QuickimportFinder(dir)
-        isRelevant, files = readAndAnalyseDir(dir, False)
-        if files is not None:
-            if not isRelevant:
-                return nullFinder
-            if cache.get(AUTOCHACHE_KEY):
-                updateCache(cache, dir, files)
+        with getDirLock(dir):
+            if dir in cache:
+                # another thread has read the directory
                 return QuickimportFinder(dir)
+            archives = cache.get(ARCHIVE_KEY) is not None
+            if archives and findKnownArchive(dir, cache) is not None:
+                finder = newArchiveFinder(dir, cache)
+                if finder is not None:
+                    return finder
+            isRelevant, files, subdirs, mtime = lookupOrReadDir(dir, cache)
+            if files is not None:
+                if not isRelevant:
+                    return nullFinder
+                if cache.get(AUTOCHACHE_KEY):
+                    updateCache(cache, dir, files, subdirs, mtime)
+                    return QuickimportFinder(dir)
+            elif archives:
+                finder = newArchiveFinder(dir, cache)
+                if finder is not None:
+                    return finder
     raise ImportError("no cache for %r" % (dir,))
     
 
-def install(flags=None, dirs=None):
+def registerAtExit(func):
+    """
+    Register *func* with :mod:`atexit`, unless it has been registered 
+    before. :func:`install` may get called several times.
+    """
+    if func not in atExitFunctions:
+        import atexit
+        atexit.register(func)
+        atExitFunctions.add(func)
+
+
+def saveExitIndex():
+    """
+    Save the index of the directory cache installed by :func:`install`.
+    """
+    index = EXIT_INDEX
+    if index is not None:
+        index.save(True)
+
+
+def dumpExitStats():
+    """
+    Dump the statistics requested by the flags of :func:`install`.
+    """
+    if EXIT_STATS is not None:
+        dumpStats(*EXIT_STATS)
+
+
+def install(flags=None, dirs=None, indexFile=None, generation=None):
     """
     Install the Quickimport importer.
     
@@ -429,7 +4472,10 @@ def install(flags=None, dirs=None):
     * removes directories without any modules or packages from
       ``sys.path``.
     * appends the PEP-302 importer :class:`QuickimportFinder` 
-      to the end of the ``sys.path_hooks`` list.
+      to the end of the ``sys.path_hooks`` list. On Python 3 the 
+      importer precedes the default :class:`importlib.machinery.FileFinder`
+      hook and the :class:`InvalidationHook` gets appended to 
+      :data:`sys.meta_path`.
     
     :param flags: A string that contains keywords to control 
        the Quickimport behavior.
@@ -437,6 +4483,13 @@ def install(flags=None, dirs=None):
     :param dirs: A list of directories to cache. If this parameter 
         is not given, ``sys.path`` is used instead.
     :type dirs: sequence of strings
+    :param indexFile: the name of an index file. If given, Quickimport 
+        reuses the valid directory listings from this file and 
+        updates the file, if it reads any directories. See 
+        :class:`DirectoryIndex`.
+    :type indexFile: str or unicode
+    :param generation: the generation stamp of the index file. 
+    :type generation: str
     
     Known keywords in `flags` are 
     are:
@@ -459,6 +4512,128 @@ def install(flags=None, dirs=None):
         Remove non relevant items from *dirs*. An item is 
         not relevant, if it is a directory, that does not contain 
         any Python modules or packages.
+        If *indexFile* is given, the verdicts are recorded in the 
+        index and subsequent runs don't need to read the directories.
+    
+    ``parallel``
+        Read the directories concurrently using a pool of threads.
+        Useful, if the directories reside on a file server with a 
+        high latency.
+    
+    ``workers=N``
+        Use up to N threads to read the directories. Implies
+        ``parallel``. The default is 16.
+    
+    ``timeout=SECONDS``
+        Wait at most SECONDS for the threads of the ``parallel`` mode. 
+        Directories, that have not been read in time, are not 
+        cached and are never removed by ``filterDirs``.
+    
+    ``archives``
+        Handle zip archives (``.zip`` or ``.egg`` files) in ``sys.path`` 
+        with :class:`ArchiveFinder` instead of the zipimport hook. 
+        Quickimport caches the member names of the archives and opens
+        only archives, that contain a requested module. With an 
+        *indexFile*, the names are stored in the index.
+    
+    ``shared=DIRECTORY``
+        Share the directory cache with other processes through a 
+        :class:`SharedIndex` file in DIRECTORY (for instance ``/dev/shm``) 
+        instead of *indexFile*. The first process publishes its 
+        directory cache, processes with the same ``sys.path`` reuse it. 
+    
+    ``moduleIndex``
+        Add a :class:`ModuleIndexFinder` to ``sys.meta_path``. It locates
+        top-level modules and packages with a single dict lookup.
+    
+    ``negativeCache``
+        Remember failed imports using a :class:`NegativeCacheFinder`.
+    
+    ``negativeCacheSize=N``
+        Remember at most N failed imports. The default is 1024.
+    
+    ``watch``
+        Keep the directory cache up to date using an :class:`InotifyWatcher`.
+        Ignored, if inotify is not available. 
+    
+    ``packageTree``
+        Add the directories of all packages and sub-packages to the 
+        directory cache. See :func:`indexPackageTrees`.
+    
+    ``stats``
+        Collect the cache statistics, see :func:`stats`.
+    
+    ``statsAtExit``
+        Collect the cache statistics and print them to ``sys.stderr``
+        at exit. Implies ``stats``.
+    
+    ``statsFile=PATH``
+        Collect the cache statistics and write them to the file PATH 
+        at exit. Implies ``stats``.
+    
+    ``trace=PATH``
+        Record the module files read during this run and write the 
+        trace to PATH at exit. See :func:`startTrace`.
+    
+    ``prefetch=PATH``
+        Read the module files recorded in the trace PATH in background 
+        threads. See :func:`startPrefetch`. The flags ``trace`` and 
+        ``prefetch`` may name the same file.
+    
+    ``prefetchWorkers=N``
+        Use N threads to prefetch the module files. The default is 4.
+    
+    ``snapshot=PATH``
+        Load the modules contained in the :class:`Snapshot` file PATH 
+        using a :class:`SnapshotFinder`. See :func:`buildSnapshot`.
+    
+    ``lazy``
+        Execute the modules found by :class:`QuickimportFinder` on their 
+        first use. See :func:`enableLazy`.
+    
+    ``lazyAllow=PATTERN[,PATTERN...]``
+        Load only the modules matching one of the patterns lazily. 
+        Implies ``lazy``.
+    
+    ``lazyDeny=PATTERN[,PATTERN...]``
+        Always load the modules matching one of the patterns immediately.
+    
+    ``trustBytecode``
+        Execute the compiled file of a source module, whenever the 
+        directory cache lists the compiled file and its header matches 
+        the modification time and the size of the source file captured, 
+        when the directory has been read. This saves the :c:func:`stat()` 
+        calls of the source and the compiled file at import time. With 
+        an *indexFile*, the captured values are stored in the index. 
+        Use it for read-only installations only. The :class:`SnapshotFinder` 
+        skips the check of the source, too.
+    
+    ``resourceCache``
+        Keep the content of small data files read by the loaders of the 
+        :class:`QuickimportFinder` (for instance using :func:`pkgutil.get_data`)
+        in a :class:`ResourceCache`. 
+    
+    ``resourceCacheSize=N``
+        Keep at most N bytes in the :class:`ResourceCache`. Implies 
+        ``resourceCache``. The default is 1 MiB.
+    
+    ``profile=PATH``
+        Profile the imports and write the times as JSON to PATH at exit. 
+        See :class:`ImportProfiler`.
+    
+    ``profileFolded=PATH``
+        Profile the imports and write the times in the folded stack 
+        format of flame graph tools to PATH at exit. 
+    
+    ``pkgResources``
+        Import :mod:`pkg_resources` and let it scan the directories for 
+        distributions using the directory cache. See 
+        :func:`registerPkgResourcesFinder`.
+    
+    ``optimizePath=PATH``
+        Reorder *dirs* for the imports recorded in the trace PATH. The 
+        most used directories move to the front, but each import still 
+        resolves to the same file. See :func:`optimizePath`.
     """
     if flags is None:
         flags = ""
@@ -467,36 +4642,198 @@ def install(flags=None, dirs=None):
     if "debug" in flags:
         global DEBUG
         DEBUG = True
+    workers = getFlagValue(flags, "workers", 0, int)
+    if not workers and "parallel" in flags:
+        workers = DEFAULT_WORKERS
+    timeout = getFlagValue(flags, "timeout", None, float)
+    statsFile = getFlagValue(flags, "statsFile")
+    if "stats" in flags or "statsAtExit" in flags or statsFile is not None:
+        enableStats()
+        if statsFile is not None or "statsAtExit" in flags:
+            global EXIT_STATS
+            EXIT_STATS = (statsFile,)
+            registerAtExit(dumpExitStats)
+    if workers > 1:
+        # import threading without holding the import lock
+        import threading
+    prefetchFile = getFlagValue(flags, "prefetch")
+    if prefetchFile is not None:
+        # start reading as early as possible
+        startPrefetch(prefetchFile, getFlagValue(flags, "prefetchWorkers", 
+                                                 DEFAULT_PREFETCH_WORKERS, int))
+    if "lazy" in flags:
+        allow = getFlagValue(flags, "lazyAllow")
+        deny = getFlagValue(flags, "lazyDeny")
+        enableLazy(None if allow is None else allow.split(","), 
+                   () if deny is None else deny.split(","))
+    traceFile = getFlagValue(flags, "trace")
+    if traceFile is not None:
+        startTrace(traceFile)
+    profileFile = getFlagValue(flags, "profile")
+    profileFoldedFile = getFlagValue(flags, "profileFolded")
+    if profileFile is not None or profileFoldedFile is not None:
+        startProfile(profileFile, profileFoldedFile)
+    global TRUST_BYTECODE, RESOURCES, SOURCE_STATS
+    TRUST_BYTECODE = "trustBytecode" in flags
+    SOURCE_STATS = {} if TRUST_BYTECODE else None
+    if "resourceCache" in flags:
+        RESOURCES = ResourceCache(getFlagValue(flags, "resourceCacheSize", 
+                                               DEFAULT_RESOURCE_CACHE_SIZE, int))
+    else:
+        RESOURCES = None
     
     acquire_lock()
     try:
+        index = None
         if "noCache" not in flags:
             dbg("quickimport: installing cache")
-            sys.quickimport_cache = cache = prepareCache(dirs, getattr(sys, "quickimport_cache", None))
+            cache = getattr(sys, "quickimport_cache", None)
+            if cache is None:
+                cache = {}
+            sharedDir = getFlagValue(flags, "shared")
+            if sharedDir is not None:
+                index = SharedIndex(getSharedIndexFilename(sharedDir, dirs), generation)
+            elif indexFile is not None:
+                index = DirectoryIndex(indexFile, generation)
+            if index is not None:
+                index.load()
+                cache[INDEX_KEY] = index
+            sys.quickimport_cache = cache = prepareCache(dirs, cache, workers, timeout)
             cache[AUTOCHACHE_KEY] = "noAutocache" not in flags
+            if "packageTree" in flags:
+                indexPackageTrees(dirs, cache, workers, timeout)
+            if index is not None:
+                index.save(True)
+                # save the directories, that get cached later on
+                global EXIT_INDEX
+                EXIT_INDEX = index
+                registerAtExit(saveExitIndex)
+            
+            if "archives" in flags:
+                # readArchive() must not import zipfile, while 
+                # newQuickimportFinder() holds the lock of an archive
+                import zipfile
+                cache.setdefault(ARCHIVE_KEY, {})
+            else:
+                cache.pop(ARCHIVE_KEY, None)
             
             try:
                 sys.path_hooks.remove(newQuickimportFinder)
             except ValueError:
                 pass        
-            sys.path_hooks.append(newQuickimportFinder)
+            i = len(sys.path_hooks)
+            if PY3:
+                # The FileFinder hook accepts any directory. Therefore
+                # our hook must precede it.
+                for i, hook in enumerate(sys.path_hooks):
+                    if getattr(hook, "__name__", None) == "path_hook_for_FileFinder":
+                        break
+                else:
+                    i = len(sys.path_hooks)
+                if invalidationHook not in sys.meta_path:
+                    sys.meta_path.append(invalidationHook)
+            if "archives" in flags:
+                # take archives from the zipimport hook
+                import zipimport
+                if zipimport.zipimporter in sys.path_hooks[:i]:
+                    i = sys.path_hooks.index(zipimport.zipimporter)
+            sys.path_hooks.insert(i, newQuickimportFinder)
+            
+            removeNegativeCacheFinder()
+            removeModuleIndexFinder()
+            for key in (MODULE_INDEX_KEY, NEGATIVE_CACHE_KEY):
+                finder = cache.pop(key, None)
+                if finder is not None:
+                    removeCacheListener(cache, finder.dirUpdated)
+            if "moduleIndex" in flags:
+                moduleIndex = cache[MODULE_INDEX_KEY] = ModuleIndexFinder(cache)
+                addCacheListener(cache, moduleIndex.dirUpdated)
+                if PY3:
+                    sys.meta_path.insert(sys.meta_path.index(machinery.PathFinder), moduleIndex)
+                else:
+                    sys.meta_path.append(moduleIndex)
+            if "negativeCache" in flags:
+                negativeCache = NegativeCacheFinder(cache, 
+                    getFlagValue(flags, "negativeCacheSize", 1024, int))
+                cache[NEGATIVE_CACHE_KEY] = negativeCache
+                addCacheListener(cache, negativeCache.dirUpdated)
+                if PY3:
+                    sys.meta_path[sys.meta_path.index(machinery.PathFinder)] = negativeCache
+                else:
+                    sys.meta_path.append(negativeCache)
+
+            if "watch" in flags:
+                try:
+                    watchCache(cache)
+                except OSError as e:
+                    dbg("quickimport: no inotify watcher: %s" % (e,))
 
             # in case we are running this file as a script
-            for dir, finder in sys.path_importer_cache.items():
+            for dir, finder in list(sys.path_importer_cache.items()):
                 if (finder is None or 
                     finderIsNullFinder(finder) or
-                    finderIsQuickimportFinder(finder)):
+                    finderIsQuickimportFinder(finder) or
+                    isinstance(finder, ArchiveFinder) or
+                    (PY3 and type(finder) is machinery.FileFinder) or
+                    ("archives" in flags and isinstance(finder, zipimport.zipimporter))):
                     del sys.path_importer_cache[dir]
                 else:
                     cache.pop(dir, None)
 
+        removeSnapshotFinder()
+        snapshotFile = getFlagValue(flags, "snapshot")
+        if snapshotFile is not None:
+            snapshot = Snapshot(snapshotFile)
+            if snapshot.load():
+                snapshotFinder = SnapshotFinder(snapshot)
+                if PY3:
+                    # precede the path based finders
+                    for i, finder in enumerate(sys.meta_path):
+                        if (finder is machinery.PathFinder or 
+                            isinstance(finder, (ModuleIndexFinder, NegativeCacheFinder))):
+                            break
+                    else:
+                        i = len(sys.meta_path)
+                    sys.meta_path.insert(i, snapshotFinder)
+                else:
+                    sys.meta_path.insert(0, snapshotFinder)
+
         if "filterDirs" in flags:
             dbg("quickimport: filtering dirs")
             if dirs is None:
                 dirs = sys.path
-            dirs[:] = filter(isDirRelevant, dirs)       
+            if index is None and indexFile is not None:
+                # the index holds the verdicts of earlier runs
+                index = DirectoryIndex(indexFile, generation)
+                index.load()
+            isRelevant = lambda dir: isDirRelevant(dir, index)
+            if workers > 1:
+                relevant = parallelMap(isRelevant, dirs, workers, timeout, True)
+                dirs[:] = [dir for dir, r in zip(dirs, relevant) if r]
+            else:
+                dirs[:] = filter(isRelevant, dirs)       
+            if index is not None:
+                index.save(True)
+
+        optimizeFile = getFlagValue(flags, "optimizePath")
+        if optimizeFile is not None:
+            if dirs is None:
+                dirs = sys.path
+            newPath, probesBefore, probesAfter = optimizePath(loadTrace(optimizeFile), dirs)
+            dbg("quickimport: reordered dirs, probes %d -> %d" % (probesBefore, probesAfter))
+            dirs[:] = newPath
     finally:
         release_lock()
+    
+    if "pkgResources" in flags and "noCache" not in flags:
+        registerPkgResourcesFinder()
+
+def removeModuleIndexFinder():
+    """
+    Remove all :class:`ModuleIndexFinder` objects from ``sys.meta_path``.
+    """
+    sys.meta_path[:] = [finder for finder in sys.meta_path 
+                        if not isinstance(finder, ModuleIndexFinder)]
 
 def uninstall():
     """
@@ -508,12 +4845,123 @@ def uninstall():
         pass
     else:
         sys.path_importer_cache.clear()
+    if PY3:
+        try:
+            sys.meta_path.remove(invalidationHook)
+        except ValueError:
+            pass
+    removeModuleIndexFinder()
+    removeNegativeCacheFinder()
+    removeSnapshotFinder()
+    watcher = getattr(sys, "quickimport_cache", {}).pop(WATCHER_KEY, None)
+    if watcher is not None:
+        watcher.stop()
+    stopTrace()
+    stopProfile()
+    stopPrefetch()
+    disableLazy()
+    global TRUST_BYTECODE, RESOURCES, EXIT_INDEX, EXIT_STATS, SOURCE_STATS
+    TRUST_BYTECODE = False
+    SOURCE_STATS = None
+    RESOURCES = None
+    saveExitIndex()
+    EXIT_INDEX = None
+    EXIT_STATS = None
     try:
         del sys.quickimport_cache
     except AttributeError:
         pass
 
-if __name__ == '__main__':
+def main(argv=None):
+    """
+    The command line interface of Quickimport.
+    
+    Usage::
+    
+        python -m quickimport [--workers N] [--rebuild] [zipname]
+        python -m quickimport --trace-app MODULE [--workers N] [zipname] [-- ARG ...]
+        python -m quickimport (--trace-app MODULE | --trace FILE) --snapshot FILE [-- ARG ...]
+        python -m quickimport (--trace-app MODULE | --trace FILE) --optimize-path [-- ARG ...]
+        python -m quickimport --rebuild-index FILE [--generation STAMP]
+        python -m quickimport --verify-index FILE [--generation STAMP]
+    
+    Without any of the index options, this function invokes :func:`buildZip`. 
+    The option ``--rebuild`` compiles all modules again. The option 
+    ``--trace-app`` runs the module MODULE with the arguments following 
+    ``--`` and builds the archive from the modules, it imported (see 
+    :func:`traceApp`). The option ``--trace`` uses the modules of a trace
+    file instead. The option ``--snapshot`` writes a snapshot file 
+    (see :func:`buildSnapshot`) instead of a zip archive. The option 
+    ``--optimize-path`` prints the ``sys.path`` order proposed by 
+    :func:`optimizePath` for the traced imports and the saved probes.
+    The option ``--rebuild-index`` invokes :func:`rebuildIndex` for 
+    ``sys.path`` and ``--verify-index`` invokes :func:`verifyIndex`. 
+    The exit code of ``--verify-index`` is 1, if the index is stale.
+    """
+    import argparse
     import logging
+    parser = argparse.ArgumentParser(prog="python -m quickimport")
+    parser.add_argument("--rebuild-index", metavar="FILE", 
+                        help="rebuild the index file FILE for sys.path")
+    parser.add_argument("--verify-index", metavar="FILE",
+                        help="verify the index file FILE")
+    parser.add_argument("--generation", metavar="STAMP", 
+                        help="the generation stamp of the index file")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="the number of processes to compile the modules for the zip archive")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="compile all modules of the zip archive again")
+    parser.add_argument("--trace-app", metavar="MODULE",
+                        help="build the zip archive from the modules imported by MODULE")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="build the zip archive from the modules of the trace FILE")
+    parser.add_argument("--snapshot", metavar="FILE",
+                        help="write a code snapshot of the traced modules to FILE")
+    parser.add_argument("--optimize-path", action="store_true",
+                        help="print the sys.path order optimized for the traced modules")
+    parser.add_argument("zipname", nargs="?", 
+                        help="the name of the zip archive to build")
+    if argv is None:
+        argv = sys.argv[1:]
+    appArgv = []
+    if "--" in argv:
+        i = argv.index("--")
+        argv, appArgv = argv[:i], argv[i + 1:]
+    args = parser.parse_args(argv)
     logging.basicConfig(level=logging.DEBUG)
-    buildZip(*sys.argv[1:])
+    
+    if args.rebuild_index:
+        index = rebuildIndex(args.rebuild_index, generation=args.generation)
+        print("Indexed %d directories into %r" % (len(index.entries), args.rebuild_index))
+        return 0
+    if args.verify_index:
+        stale = verifyIndex(args.verify_index, args.generation)
+        for dir in stale:
+            print("stale: %r" % (dir,))
+        return 1 if stale else 0
+    trace = None
+    if args.trace_app:
+        trace = traceApp(args.trace_app, appArgv)
+    elif args.trace:
+        trace = loadTrace(args.trace)
+    if args.snapshot:
+        if trace is None:
+            parser.error("--snapshot requires --trace-app or --trace")
+        names = buildSnapshot(args.snapshot, trace)
+        print("Wrote %d modules into %r" % (len(names), args.snapshot))
+        return 0
+    if args.optimize_path:
+        if trace is None:
+            parser.error("--optimize-path requires --trace-app or --trace")
+        install()
+        newPath, probesBefore, probesAfter = optimizePath(trace)
+        for dir in newPath:
+            print(dir)
+        print("sys.path items probed for the traced imports: %d -> %d (%d saved)" % 
+              (probesBefore, probesAfter, probesBefore - probesAfter))
+        return 0
+    buildZip(args.zipname, args.workers, not args.rebuild, trace=trace)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
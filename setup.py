@@ -46,7 +46,7 @@ a CIFS server) you know the problem of long startup times. The quickimport
 importer uses the pep 302 import hooks to reduce the number of 
 failing stat system calls for each loaded module.
 
-For Python 2.7. May work with earlier versions too.
+For Python 2.7 and Python 3. May work with earlier versions of Python 2 too.
 
 Git repository: git://github.com/akruis/quickimport.git
 """,
@@ -54,6 +54,7 @@ Git repository: git://github.com/akruis/quickimport.git
           "License :: OSI Approved :: GNU Library or Lesser General Public License (LGPL)",
           "Programming Language :: Python",
           "Programming Language :: Python :: 2.7",
+          "Programming Language :: Python :: 3",
           "Environment :: Other Environment",
           "Operating System :: OS Independent",
           "Development Status :: 3 - Alpha", # hasn't been tested outside of flowGuide2
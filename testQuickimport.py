@@ -23,11 +23,36 @@ from __future__ import absolute_import
 from unittest import TestCase, skipIf
 import os.path
 import tempfile
+import shutil
+import time
 import sys
 
 import quickimport as q
 DIR1 = os.path.dirname(os.path.abspath(__file__))
 
+class CountingListdir(object):
+    """Count the calls of quickimport.listDir"""
+    def __init__(self):
+        self.dirs = []
+    def __enter__(self):
+        self.orig = q.listDir
+        def listDir(path):
+            self.dirs.append(path)
+            return self.orig(path)
+        q.listDir = listDir
+        return self
+    def __exit__(self, *args):
+        q.listDir = self.orig
+
+def writeFile(*path):
+    """Create an empty file"""
+    open(os.path.join(*path), "w").close()
+
+def makeOld(path):
+    """Set the mtime of path into the past"""
+    t = time.time() - 100
+    os.utime(path, (t, t))
+
 class QuickimportTest(TestCase):
     def setUp(self):
         self.origSysPath = sys.path[:]
@@ -91,6 +116,33 @@ class QuickimportTest(TestCase):
             os.rmdir(emptyDir)
         self.assertListEqual(dirs, ["", "/somewhere/python27.zip", DIR1])
         
+    def testInstall_filterDirsPackages(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            withPackage, withData, withText = dirs = [
+                os.path.join(tmp, d) for d in ("a", "b", "c")]
+            os.makedirs(os.path.join(withPackage, "qiPkg"))
+            writeFile(withPackage, "qiPkg", "__init__.py")
+            os.makedirs(os.path.join(withData, "data"))
+            writeFile(withData, "data", "x.txt")
+            os.mkdir(withText)
+            writeFile(withText, "readme.txt")
+            for d in dirs:
+                makeOld(d)
+            indexFile = os.path.join(tmp, "index")
+            
+            q.install("noCache filterDirs", dirs, indexFile=indexFile)
+            self.assertListEqual([withPackage], dirs)
+            
+            # only the directory without a positive verdict is read again
+            dirs = [withPackage, withData, withText]
+            with CountingListdir() as counter:
+                q.install("noCache filterDirs", dirs, indexFile=indexFile)
+            self.assertListEqual([withPackage], dirs)
+            self.assertListEqual([withData], counter.dirs)
+        finally:
+            shutil.rmtree(tmp)
+        
     def testImports(self):
         q.install()
         import tabnanny
@@ -99,5 +151,1011 @@ class QuickimportTest(TestCase):
         sys.modules.pop("email.message", None)
         import email.message
         self.assertRaises(ImportError, __import__, "NoSuchModule")
+
+    def testIndex(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            pkgdir = os.path.join(tmp, "lib")
+            os.mkdir(pkgdir)
+            open(os.path.join(pkgdir, "qiIndexMod.py"), "w").close()
+            makeOld(pkgdir)
+            indexFile = os.path.join(tmp, "index")
+            
+            index = q.rebuildIndex(indexFile, [pkgdir])
+            self.assertIn(pkgdir, index.entries)
+            self.assertEqual([], q.verifyIndex(indexFile))
+            
+            with CountingListdir() as counter:
+                q.install(dirs=[pkgdir], indexFile=indexFile)
+            self.assertEqual([], counter.dirs)
+            self.assertIn(os.path.normcase("qiIndexMod.py"), sys.quickimport_cache[pkgdir])
+            q.uninstall()
+            
+            # a modified directory gets read again
+            open(os.path.join(pkgdir, "qiIndexMod2.py"), "w").close()
+            t = time.time() - 50
+            os.utime(pkgdir, (t, t))
+            with CountingListdir() as counter:
+                q.install(dirs=[pkgdir], indexFile=indexFile)
+            self.assertEqual([pkgdir], counter.dirs)
+            self.assertIn(os.path.normcase("qiIndexMod2.py"), sys.quickimport_cache[pkgdir])
+            q.uninstall()
+            
+            # the index has been updated
+            with CountingListdir() as counter:
+                q.install(dirs=[pkgdir], indexFile=indexFile)
+            self.assertEqual([], counter.dirs)
+        finally:
+            shutil.rmtree(tmp)
+
+    def testIndexGeneration(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            indexFile = os.path.join(tmp, "index")
+            q.rebuildIndex(indexFile, [tmp], generation="r1")
+            open(os.path.join(tmp, "qiIndexMod.py"), "w").close()
+            
+            # same generation: the index is trusted
+            self.assertEqual([tmp], q.verifyIndex(indexFile, "r1"))
+            with CountingListdir() as counter:
+                q.install(dirs=[tmp], indexFile=indexFile, generation="r1")
+            self.assertEqual([], counter.dirs)
+            q.uninstall()
+            
+            # other generation: the index is discarded
+            with CountingListdir() as counter:
+                q.install(dirs=[tmp], indexFile=indexFile, generation="r2")
+            self.assertEqual([tmp], counter.dirs)
+            self.assertEqual([], q.verifyIndex(indexFile, "r2"))
+        finally:
+            shutil.rmtree(tmp)
+
+    def testIndexInvalidFile(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            indexFile = os.path.join(tmp, "index")
+            with open(indexFile, "wb") as f:
+                f.write(b"garbage")
+            index = q.DirectoryIndex(indexFile)
+            self.assertFalse(index.load())
+            self.assertEqual({}, index.entries)
+        finally:
+            shutil.rmtree(tmp)
+
+    def testFinder(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            writeFile(tmp, "qiFinderMod.py")
+            os.mkdir(os.path.join(tmp, "qiFinderPkg"))
+            writeFile(tmp, "qiFinderPkg", "__init__.py")
+            writeFile(tmp, "qiFinderPkg", "sub.py")
+            sys.path.insert(0, tmp)
+            q.install()
+            import qiFinderMod
+            import qiFinderPkg.sub
+            self.assertTrue(isinstance(sys.path_importer_cache[tmp], q.QuickimportFinder))
+            self.assertEqual(os.path.join(tmp, "qiFinderPkg", "sub.py"), 
+                             qiFinderPkg.sub.__file__)
+            self.assertRaises(ImportError, __import__, "qiFinderNoSuchModule")
+        finally:
+            for name in ("qiFinderMod", "qiFinderPkg", "qiFinderPkg.sub"):
+                sys.modules.pop(name, None)
+            shutil.rmtree(tmp)
+
+    @skipIf(not q.PY3, "Python 3 only")
+    def testFinderNamespacePackage(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(tmp, "qiNamespace"))
+            writeFile(tmp, "qiNamespace", "mod.py")
+            sys.path.insert(0, tmp)
+            q.install()
+            import qiNamespace.mod
+            self.assertEqual([os.path.join(tmp, "qiNamespace")], list(qiNamespace.__path__))
+        finally:
+            for name in ("qiNamespace", "qiNamespace.mod"):
+                sys.modules.pop(name, None)
+            shutil.rmtree(tmp)
+
+    @skipIf(not q.PY3, "Python 3 only")
+    def testInvalidateCaches(self):
+        import importlib
+        tmp = tempfile.mkdtemp()
+        emptyDir = tempfile.mkdtemp()
+        try:
+            writeFile(tmp, "qiInvalidateMod.py")
+            sys.path[0:0] = [tmp, emptyDir]
+            q.install()
+            import qiInvalidateMod
+            self.assertRaises(ImportError, __import__, "qiInvalidateMod2")
+            self.assertRaises(ImportError, __import__, "qiInvalidateMod3")
+            self.assertTrue(q.finderIsNullFinder(sys.path_importer_cache[emptyDir]))
+            
+            writeFile(tmp, "qiInvalidateMod2.py")
+            writeFile(emptyDir, "qiInvalidateMod3.py")
+            # the directories are read again on their next use
+            with CountingListdir() as counter:
+                importlib.invalidate_caches()
+            self.assertNotIn(tmp, counter.dirs)
+            import qiInvalidateMod2
+            import qiInvalidateMod3
+            
+            # unchanged directories are not read again
+            importlib.invalidate_caches()
+            with CountingListdir() as counter:
+                self.assertRaises(ImportError, __import__, "qiInvalidateMod4")
+            self.assertNotIn(tmp, counter.dirs)
+        finally:
+            for name in ("qiInvalidateMod", "qiInvalidateMod2", "qiInvalidateMod3"):
+                sys.modules.pop(name, None)
+            shutil.rmtree(tmp)
+            shutil.rmtree(emptyDir)
+
+    def testParallelMap(self):
+        items = list(range(50))
+        self.assertEqual([i * 2 for i in items], 
+                         q.parallelMap(lambda i: i * 2, items, 8))
         
-    
\ No newline at end of file
+        def slow(i):
+            if i == 1:
+                time.sleep(2)
+            return i
+        result = q.parallelMap(slow, [0, 1, 2], 3, 0.2, -1)
+        self.assertEqual([0, -1, 2], result)
+
+    def testInstall_parallel(self):
+        emptyDir = tempfile.mkdtemp()
+        try:
+            dirs = ["", "/somewhere/python27.zip", DIR1, emptyDir]
+            q.install("workers=4 timeout=30 filterDirs", dirs)
+            self.assertIn(DIR1, sys.quickimport_cache)
+        finally:
+            os.rmdir(emptyDir)
+        self.assertListEqual(dirs, ["", "/somewhere/python27.zip", DIR1])
+
+    def testGetFlagValue(self):
+        self.assertEqual(4, q.getFlagValue("parallel workers=4", "workers", 0, int))
+        self.assertEqual(2.5, q.getFlagValue(["timeout=2.5"], "timeout", None, float))
+        self.assertIsNone(q.getFlagValue("filterDirs", "timeout"))
+
+    def testModuleIndex(self):
+        dirA = tempfile.mkdtemp()
+        dirB = tempfile.mkdtemp()
+        dirC = tempfile.mkdtemp()
+        try:
+            for d in (dirA, dirB):
+                writeFile(d, "qiIdxMod.py")
+            writeFile(dirC, "qiIdxModC.py")
+            sys.path[0:0] = [dirA, dirB]
+            q.install("moduleIndex")
+            moduleIndex = sys.quickimport_cache[q.MODULE_INDEX_KEY]
+            self.assertIn(moduleIndex, sys.meta_path)
+            
+            import qiIdxMod
+            self.assertEqual(os.path.join(dirA, "qiIdxMod.py"), qiIdxMod.__file__)
+            self.assertIn(os.path.normcase("qiIdxMod"), moduleIndex.getState()[2])
+            del sys.modules["qiIdxMod"]
+            
+            # sys.path changes
+            sys.path.remove(dirA)
+            import qiIdxMod
+            self.assertEqual(os.path.join(dirB, "qiIdxMod.py"), qiIdxMod.__file__)
+            sys.path.append(dirC)
+            import qiIdxModC
+            self.assertEqual(os.path.join(dirC, "qiIdxModC.py"), qiIdxModC.__file__)
+            self.assertRaises(ImportError, __import__, "qiIdxNoSuchModule")
+            self.assertIs(moduleIndex.getState(), moduleIndex.getState())
+            # the first item is replaced in place
+            del sys.modules["qiIdxMod"]
+            sys.path[0] = dirA
+            import qiIdxMod
+            self.assertEqual(os.path.join(dirA, "qiIdxMod.py"), qiIdxMod.__file__)
+            
+            q.uninstall()
+            self.assertNotIn(moduleIndex, sys.meta_path)
+        finally:
+            for name in ("qiIdxMod", "qiIdxModC"):
+                sys.modules.pop(name, None)
+            for d in (dirA, dirB, dirC):
+                shutil.rmtree(d)
+
+    def testCachedDir(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            writeFile(tmp, "qiMod.py")
+            os.mkdir(os.path.join(tmp, "qiPkg"))
+            files, subdirs = q.listDir(tmp)
+            self.assertEqual(sorted(["qiMod.py", "qiPkg"]), sorted(files))
+            q.updateCache(sys.__dict__.setdefault("quickimport_cache", {}), tmp, files, subdirs)
+            entry = sys.quickimport_cache[tmp]
+            if q.scandir is None:
+                self.assertIsNone(entry.isDir(os.path.normcase("qiPkg")))
+            else:
+                self.assertTrue(entry.isDir(os.path.normcase("qiPkg")))
+                self.assertFalse(entry.isFile(os.path.normcase("qiPkg")))
+                self.assertTrue(entry.isFile(os.path.normcase("qiMod.py")))
+            self.assertFalse(entry.isFile(os.path.normcase("qiNoSuchMod.py")))
+        finally:
+            shutil.rmtree(tmp)
+        
+        entry = q.CachedDir(["qi-x", "qi.txt", "qiMod.py", "qiModule.py", "qiPkg"], ["qiPkg"])
+        self.assertEqual(("qi-x", "qi.txt", "qiMod.py", "qiModule.py", "qiPkg"), entry.names)
+        self.assertTrue(entry.hasCandidate("qiMod"))
+        self.assertTrue(entry.hasCandidate("qiPkg"))
+        self.assertFalse(entry.hasCandidate("qi"))
+        self.assertFalse(entry.hasCandidate("qiModul"))
+        many = q.CachedDir(["qiMod%d.py" % i for i in range(1000)] + ["qiMod.txt", "qiMod_.py"])
+        self.assertFalse(many.hasCandidate("qiMod"))
+        self.assertTrue(q.CachedDir(["qiMod.txt", "qiMod.py"]).hasCandidate("qiMod"))
+        self.assertIs(q.CachedDir(["".join(["qi", "Pkg"])]).names[0], entry.subdirs[0])
+
+    def testStatFreeLoader(self):
+        tmp = tempfile.mkdtemp()
+        origListDir = q.listDir
+        origFindModule = getattr(q, "find_module", None)
+        origIsfile, origIsdir = os.path.isfile, os.path.isdir
+        def listDir(dir):
+            # emulate os.scandir
+            files = os.listdir(dir)
+            return files, [f for f in files if origIsdir(os.path.join(dir, f))]
+        probes = []
+        def probe(func):
+            def wrapper(*args):
+                probes.append((func.__name__, args))
+                return func(*args)
+            return wrapper
+        try:
+            writeFile(tmp, "qiStatFreeMod.py")
+            os.mkdir(os.path.join(tmp, "qiStatFreePkg"))
+            writeFile(tmp, "qiStatFreePkg", "__init__.py")
+            writeFile(tmp, "qiStatFreePkg", "sub.py")
+            sys.path.insert(0, tmp)
+            q.listDir = listDir
+            q.install()
+            os.path.isfile = probe(os.path.isfile)
+            os.path.isdir = probe(os.path.isdir)
+            if not q.PY3:
+                q.find_module = probe(q.find_module)
+            import qiStatFreeMod
+            import qiStatFreePkg.sub
+            os.path.isfile, os.path.isdir = origIsfile, origIsdir
+            self.assertEqual([], probes)
+            self.assertEqual(os.path.join(tmp, "qiStatFreePkg", "sub.py"), 
+                             qiStatFreePkg.sub.__file__)
+        finally:
+            os.path.isfile, os.path.isdir = origIsfile, origIsdir
+            q.listDir = origListDir
+            if not q.PY3:
+                q.find_module = origFindModule
+            for name in ("qiStatFreeMod", "qiStatFreePkg", "qiStatFreePkg.sub"):
+                sys.modules.pop(name, None)
+            shutil.rmtree(tmp)
+
+    def testRefreshCache(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            writeFile(tmp, "qiRefreshMod.py")
+            makeOld(tmp)
+            sys.path.insert(0, tmp)
+            q.install()
+            self.assertEqual([], q.refreshCache())
+            self.assertRaises(ImportError, __import__, "qiRefreshMod2")
+            
+            writeFile(tmp, "qiRefreshMod2.py")
+            self.assertEqual([tmp], q.refreshCache())
+            self.assertEqual([], q.refreshCache(workers=4))
+            import qiRefreshMod2
+        finally:
+            sys.modules.pop("qiRefreshMod2", None)
+            shutil.rmtree(tmp)
+
+    def testWatcher(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            writeFile(tmp, "qiWatchMod.py")
+            sys.path.insert(0, tmp)
+            q.install()
+            try:
+                watcher = q.watchCache()
+            except OSError:
+                self.skipTest("inotify is not available")
+            self.assertIs(watcher, sys.quickimport_cache[q.WATCHER_KEY])
+            normcase = os.path.normcase
+            
+            writeFile(tmp, "qiWatchMod2.py")
+            os.mkdir(os.path.join(tmp, "qiWatchPkg"))
+            os.unlink(os.path.join(tmp, "qiWatchMod.py"))
+            for i in range(100):
+                entry = sys.quickimport_cache[tmp]
+                if normcase("qiWatchPkg") in entry and normcase("qiWatchMod.py") not in entry:
+                    break
+                time.sleep(0.02)
+            self.assertIn(normcase("qiWatchMod2.py"), entry)
+            self.assertNotIn(normcase("qiWatchMod.py"), entry)
+            if entry.subdirs is not None:
+                self.assertIn(normcase("qiWatchPkg"), entry.subdirs)
+            
+            q.uninstall()
+            self.assertIsNone(watcher.thread)
+        finally:
+            shutil.rmtree(tmp)
+
+    def testNegativeCache(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            writeFile(tmp, "qiNegOther.py")
+            makeOld(tmp)
+            sys.path.insert(0, tmp)
+            q.install("negativeCache negativeCacheSize=2")
+            negativeCache = sys.quickimport_cache[q.NEGATIVE_CACHE_KEY]
+            self.assertIn(negativeCache, sys.meta_path)
+            
+            self.assertRaises(ImportError, __import__, "qiNegMod")
+            self.assertIn(("qiNegMod", tuple(sys.path)), negativeCache.misses)
+            self.assertRaises(ImportError, __import__, "qiNegMod")
+            if q.PY3:
+                import importlib.util
+                self.assertIsNone(importlib.util.find_spec("qiNegMod"))
+            
+            # bounded
+            self.assertRaises(ImportError, __import__, "qiNegMod2")
+            self.assertRaises(ImportError, __import__, "qiNegMod3")
+            self.assertEqual(2, len(negativeCache.misses))
+            
+            # adding an unrelated directory keeps the misses
+            otherDir = os.path.join(tmp, "other")
+            os.mkdir(otherDir)
+            makeOld(otherDir)
+            q.getCachedDir(otherDir, sys.quickimport_cache)
+            self.assertEqual(2, len(negativeCache.misses))
+            
+            # a directory update clears the misses of its search paths
+            writeFile(tmp, "qiNegMod.py")
+            self.assertEqual([tmp], q.refreshCache())
+            self.assertEqual(0, len(negativeCache.misses))
+            import qiNegMod
+            
+            q.uninstall()
+            self.assertNotIn(negativeCache, sys.meta_path)
+            if q.PY3:
+                from importlib.machinery import PathFinder
+                self.assertIn(PathFinder, sys.meta_path)
+        finally:
+            sys.modules.pop("qiNegMod", None)
+            shutil.rmtree(tmp)
+
+    def testStats(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            writeFile(tmp, "qiStatMod.py")
+            makeOld(tmp)
+            sys.path.insert(0, tmp)
+            q.install("stats")
+            import qiStatMod
+            self.assertRaises(ImportError, __import__, "qiStatMissing")
+            
+            dirStats = q.stats()[tmp]
+            self.assertEqual(1, dirStats["reads"])
+            self.assertEqual(1, dirStats["hits"])
+            self.assertEqual(1, dirStats["misses"])
+            self.assertEqual(2, dirStats["calls"])
+            # without scandir the entry types are unknown
+            self.assertEqual(0 if q.scandir else 1, dirStats["probes"])
+            self.assertGreater(dirStats["avoided"], 0)
+            
+            statsFile = os.path.join(tmp, "stats.txt")
+            q.dumpStats(statsFile)
+            with open(statsFile) as f:
+                lines = f.read().splitlines()
+            self.assertTrue(lines[0].startswith("   calls"))
+            self.assertTrue(lines[-1].endswith("TOTAL"))
+        finally:
+            q.STATS = None
+            sys.modules.pop("qiStatMod", None)
+            shutil.rmtree(tmp)
+
+    @skipIf(not q.PY3, "the C import machinery of Python 2 can't be shimmed")
+    def testBenchmark(self):
+        import benchQuickimport
+        tmp = tempfile.mkdtemp()
+        try:
+            results = benchQuickimport.runBenchmark(tmp, dirs=5, modules=3, emptyDirs=2, missing=2)
+            self.assertEqual([name for name, flags in benchQuickimport.SCENARIOS],
+                             [name for name, result in results])
+            self.assertGreater(results[0][1]["calls"], 0)
+            self.assertEqual([], benchQuickimport.checkResults(results))
+            
+            dirs = [d for d, subdirs, files in os.walk(tmp)]
+            (old, oldSize), (new, newSize) = benchQuickimport.measureCacheMemory(dirs)
+            self.assertLess(newSize, oldSize)
+        finally:
+            shutil.rmtree(tmp)
+
+    def testTraceAndPrefetch(self):
+        import py_compile
+        import pkgutil
+        tmp = tempfile.mkdtemp()
+        try:
+            traceFile = os.path.join(tmp, "trace")
+            modDir = os.path.join(tmp, "mods")
+            os.mkdir(modDir)
+            for name in ("qiTraceA", "qiTraceB"):
+                path = os.path.join(modDir, name + ".py")
+                with open(path, "w") as f:
+                    f.write("VALUE = %r\n" % (name,))
+                py_compile.compile(path)
+            writeFile(modDir, "qiTrace.dat")
+            makeOld(modDir)
+            sys.path.insert(0, modDir)
+            
+            q.install("trace=" + traceFile)
+            import qiTraceA, qiTraceB
+            # data files are not recorded
+            self.assertEqual(b"", pkgutil.get_data("qiTraceA", "qiTrace.dat"))
+            q.uninstall()
+            self.assertIsNone(q.TRACE)
+            self.assertEqual(["qiTraceA", "qiTraceB"], [name for name, path in q.loadTrace(traceFile)])
+            
+            del sys.modules["qiTraceA"], sys.modules["qiTraceB"]
+            q.install("prefetch=" + traceFile)
+            prefetcher = q.PREFETCHER
+            for thread in prefetcher.threads:
+                thread.join()
+            import qiTraceA, qiTraceB
+            self.assertEqual("qiTraceB", qiTraceB.VALUE)
+            self.assertEqual(2, prefetcher.hits)
+            q.uninstall()
+            self.assertIsNone(q.PREFETCHER)
+        finally:
+            sys.modules.pop("qiTraceA", None)
+            sys.modules.pop("qiTraceB", None)
+            shutil.rmtree(tmp)
+
+    def testBuildZip(self):
+        import zipfile
+        tmp = tempfile.mkdtemp()
+        origCompileModuleFiles = q.compileModuleFiles
+        try:
+            src = os.path.join(tmp, "src")
+            os.makedirs(os.path.join(src, "qiZipPkg", "sub"))
+            os.makedirs(os.path.join(src, "qiZipBadPkg"))
+            with open(os.path.join(src, "qiZipMod.py"), "w") as f:
+                f.write("VALUE = 1\n")
+            with open(os.path.join(src, "qiZipFileMod.py"), "w") as f:
+                f.write("VALUE = __file__\n")
+            writeFile(src, "qiZipPkg", "__init__.py")
+            writeFile(src, "qiZipPkg", "sub", "__init__.py")
+            with open(os.path.join(src, "qiZipPkg", "sub", "m.py"), "w") as f:
+                f.write("VALUE = 2\n")
+            writeFile(src, "qiZipBadPkg", "__init__.py")
+            with open(os.path.join(src, "qiZipBadPkg", "m.py"), "w") as f:
+                f.write("VALUE = __path__\n")
+            zipname = os.path.join(tmp, "modules.zip")
+            
+            names = q.buildZip(zipname, 2, path=[src])
+            self.assertEqual(["qiZipMod", "qiZipPkg"], sorted(names))
+            self.assertEqual(["qiZipMod.pyc", "qiZipPkg/__init__.pyc", 
+                              "qiZipPkg/sub/__init__.pyc", "qiZipPkg/sub/m.pyc"],
+                             sorted(zipfile.ZipFile(zipname).namelist()))
+            
+            # only the modified module gets compiled again
+            compiled = []
+            def compileModuleFiles(filenames):
+                compiled.extend(filenames)
+                return origCompileModuleFiles(filenames)
+            q.compileModuleFiles = compileModuleFiles
+            with open(os.path.join(src, "qiZipMod.py"), "w") as f:
+                f.write("VALUE = 3\n")
+            t = time.time() + 10
+            os.utime(os.path.join(src, "qiZipMod.py"), (t, t))
+            self.assertEqual(names, q.buildZip(zipname, 0, path=[src]))
+            self.assertIn(os.path.join(src, "qiZipMod.py"), compiled)
+            self.assertNotIn(os.path.join(src, "qiZipPkg", "sub", "m.py"), compiled)
+            
+            sys.path.insert(0, zipname)
+            import qiZipMod, qiZipPkg.sub.m
+            self.assertEqual(3, qiZipMod.VALUE)
+            self.assertEqual(2, qiZipPkg.sub.m.VALUE)
+            self.assertTrue(qiZipPkg.sub.m.__file__.startswith(zipname))
+        finally:
+            q.compileModuleFiles = origCompileModuleFiles
+            for name in ("qiZipMod", "qiZipPkg", "qiZipPkg.sub", "qiZipPkg.sub.m"):
+                sys.modules.pop(name, None)
+            shutil.rmtree(tmp)
+
+    def testBuildZip_egg(self):
+        import zipfile
+        tmp = tempfile.mkdtemp()
+        try:
+            src = os.path.join(tmp, "src")
+            os.makedirs(src)
+            with open(os.path.join(src, "qiZipMod.py"), "w") as f:
+                f.write("VALUE = 1\n")
+            egg = os.path.join(tmp, "qiZipEgg-1.0.egg")
+            with zipfile.ZipFile(egg, "w") as zf:
+                zf.writestr("qiZipEggMod.py", "VALUE = 2\n")
+                zf.writestr("qiZipEggPkg/__init__.py", "")
+            zipname = os.path.join(tmp, "modules.zip")
+            
+            # the members of the egg are not files
+            self.assertEqual(["qiZipMod"], q.buildZip(zipname, 0, path=[src, egg]))
+            self.assertEqual(["qiZipMod.pyc"], zipfile.ZipFile(zipname).namelist())
+        finally:
+            shutil.rmtree(tmp)
+
+    def testTraceApp(self):
+        import zipfile
+        tmp = tempfile.mkdtemp()
+        try:
+            src = os.path.join(tmp, "src")
+            os.makedirs(os.path.join(src, "qiApp"))
+            writeFile(src, "qiApp", "__init__.py")
+            with open(os.path.join(src, "qiApp", "main.py"), "w") as f:
+                f.write("import qiAppLib\nimport qiApp.util\n")
+            writeFile(src, "qiApp", "util.py")
+            writeFile(src, "qiApp", "unused.py")
+            writeFile(src, "qiAppLib.py")
+            writeFile(src, "qiAppOther.py")
+            makeOld(src)
+            sys.path.insert(0, src)
+            
+            trace = q.traceApp("qiApp.main")
+            zipname = os.path.join(tmp, "app.zip")
+            self.assertEqual(["qiApp", "qiAppLib"], q.buildZip(zipname, 0, trace=trace))
+            self.assertEqual(["qiApp/__init__.pyc", "qiApp/main.pyc", "qiAppLib.pyc", 
+                              "qiApp/util.pyc", "qiApp/unused.pyc"],
+                             zipfile.ZipFile(zipname).namelist())
+        finally:
+            for name in ("qiApp", "qiApp.util", "qiAppLib"):
+                sys.modules.pop(name, None)
+            shutil.rmtree(tmp)
+
+    def testSnapshot(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            src = os.path.join(tmp, "src")
+            os.makedirs(os.path.join(src, "qiSnapPkg"))
+            writeFile(src, "qiSnapPkg", "__init__.py")
+            trace = [("qiSnapPkg", os.path.join(src, "qiSnapPkg", "__init__.py"))]
+            for path in (("qiSnapPkg", "m.py"), ("qiSnapMod.py",)):
+                filename = os.path.join(src, *path)
+                with open(filename, "w") as f:
+                    f.write("VALUE = 1\n")
+                # whole seconds survive os.utime() on any Python version
+                t = int(time.time()) - 100
+                os.utime(filename, (t, t))
+                trace.append((path[-1][:-3] if len(path) == 1 else "qiSnapPkg.m", filename))
+            snapshotFile = os.path.join(tmp, "snapshot")
+            self.assertEqual(["qiSnapPkg", "qiSnapPkg.m", "qiSnapMod"], 
+                             q.buildSnapshot(snapshotFile, trace))
+            
+            # same size and mtime: the snapshot wins
+            filename = os.path.join(src, "qiSnapPkg", "m.py")
+            st = os.stat(filename)
+            with open(filename, "w") as f:
+                f.write("VALUE = 2\n")
+            os.utime(filename, (st.st_atime, st.st_mtime))
+            # a modified source invalidates the snapshot entry
+            with open(os.path.join(src, "qiSnapMod.py"), "w") as f:
+                f.write("VALUE = 3\n")
+            
+            sys.path.insert(0, src)
+            q.install("snapshot=" + snapshotFile)
+            finder = [f for f in sys.meta_path if isinstance(f, q.SnapshotFinder)][0]
+            import qiSnapPkg.m, qiSnapMod
+            self.assertEqual(1, qiSnapPkg.m.VALUE)
+            self.assertEqual(3, qiSnapMod.VALUE)
+            self.assertEqual(os.path.join(src, "qiSnapPkg"), qiSnapPkg.__path__[0])
+            self.assertEqual(filename, qiSnapPkg.m.__file__)
+            self.assertEqual((2, 1), (finder.hits, finder.stale))
+            q.uninstall()
+            self.assertNotIn(finder, sys.meta_path)
+            
+            # a module in a preceding directory shadows the snapshot
+            for name in ("qiSnapPkg", "qiSnapPkg.m"):
+                del sys.modules[name]
+            over = os.path.join(tmp, "over")
+            os.mkdir(over)
+            with open(os.path.join(over, "qiSnapPkg.py"), "w") as f:
+                f.write("VALUE = 4\n")
+            sys.path.insert(0, over)
+            q.install("snapshot=" + snapshotFile)
+            import qiSnapPkg
+            self.assertEqual(4, qiSnapPkg.VALUE)
+        finally:
+            for name in ("qiSnapPkg", "qiSnapPkg.m", "qiSnapMod"):
+                sys.modules.pop(name, None)
+            shutil.rmtree(tmp)
+
+    def testConcurrentFinderCreation(self):
+        import threading
+        tmp = tempfile.mkdtemp()
+        try:
+            writeFile(tmp, "qiLockMod.py")
+            makeOld(tmp)
+            q.install()
+            with CountingListdir() as counter:
+                orig = q.listDir
+                def slowListDir(path):
+                    time.sleep(0.05)
+                    return orig(path)
+                q.listDir = slowListDir
+                finders = []
+                threads = [threading.Thread(target=lambda: finders.append(q.newQuickimportFinder(tmp)))
+                           for _ in range(4)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            self.assertEqual([tmp], counter.dirs)
+            self.assertEqual(4, len(finders))
+            self.assertTrue(all(isinstance(f, q.QuickimportFinder) for f in finders))
+        finally:
+            shutil.rmtree(tmp)
+
+    def testPackageTree(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            pkgDir = tmp
+            for name in ("qiTreePkg", "a", "b", "c"):
+                pkgDir = os.path.join(pkgDir, name)
+                os.mkdir(pkgDir)
+                writeFile(pkgDir, "__init__.py")
+            writeFile(pkgDir, "m.py")
+            os.mkdir(os.path.join(tmp, "qiTreePkg", "data"))
+            writeFile(tmp, "qiTreePkg", "data", "x.py")
+            sys.path.insert(0, tmp)
+            
+            q.install("packageTree")
+            cache = sys.quickimport_cache
+            self.assertIn(pkgDir, cache)
+            self.assertNotIn(os.path.join(tmp, "qiTreePkg", "data"), cache)
+            with CountingListdir() as counter:
+                import qiTreePkg.a.b.c.m
+            self.assertEqual([], counter.dirs)
+        finally:
+            for name in ("qiTreePkg", "qiTreePkg.a", "qiTreePkg.a.b", 
+                         "qiTreePkg.a.b.c", "qiTreePkg.a.b.c.m"):
+                sys.modules.pop(name, None)
+            shutil.rmtree(tmp)
+
+    def testArchives(self):
+        import zipfile
+        tmp = tempfile.mkdtemp()
+        try:
+            archive = os.path.join(tmp, "qi.zip")
+            with zipfile.ZipFile(archive, "w") as zf:
+                zf.writestr("qiZipMod.py", "x = 1\n")
+                zf.writestr("qiZipPkg/__init__.py", "")
+                zf.writestr("qiZipPkg/sub.py", "y = 2\n")
+            makeOld(archive)
+            indexFile = os.path.join(tmp, "index")
+            sys.path.insert(0, archive)
+            
+            q.install("archives", indexFile=indexFile)
+            finder = q.getPathEntryFinder(archive)
+            self.assertIsInstance(finder, q.ArchiveFinder)
+            self.assertRaises(ImportError, __import__, "qiNoSuchZipMod")
+            # a miss does not open the archive
+            self.assertIsNone(finder.importer)
+            import qiZipMod
+            import qiZipPkg.sub
+            self.assertEqual(2, qiZipPkg.sub.y)
+            self.assertIsInstance(q.getPathEntryFinder(qiZipPkg.__path__[0]), 
+                                  q.ArchiveFinder)
+            # done at exit
+            self.assertTrue(sys.quickimport_cache[q.INDEX_KEY].save())
+            q.uninstall()
+            
+            # the member names are reused from the index
+            readArchive = q.readArchive
+            def failingReadArchive(archive):
+                self.fail("archive read again")
+            q.readArchive = failingReadArchive
+            try:
+                q.install("archives", indexFile=indexFile)
+                self.assertIn("qiZipMod.py", q.getPathEntryFinder(archive).files)
+            finally:
+                q.readArchive = readArchive
+            self.assertEqual([], q.verifyIndex(indexFile))
+        finally:
+            for name in ("qiZipMod", "qiZipPkg", "qiZipPkg.sub"):
+                sys.modules.pop(name, None)
+            shutil.rmtree(tmp)
+
+    def testSharedIndex(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            libDir = os.path.join(tmp, "lib")
+            os.mkdir(libDir)
+            writeFile(libDir, "qiSharedMod.py")
+            makeOld(libDir)
+            dirs = [libDir]
+            filename = q.getSharedIndexFilename(tmp, dirs)
+            self.assertEqual(filename, q.getSharedIndexFilename(tmp, list(dirs)))
+            self.assertNotEqual(filename, q.getSharedIndexFilename(tmp, [tmp]))
+            
+            # the first process publishes its directory cache
+            q.install("shared=" + tmp, dirs)
+            self.assertIsInstance(sys.quickimport_cache[q.INDEX_KEY], q.SharedIndex)
+            self.assertTrue(os.path.isfile(filename))
+            q.uninstall()
+            
+            # other processes attach to it
+            with CountingListdir() as counter:
+                q.install("shared=" + tmp, dirs)
+            self.assertEqual([], counter.dirs)
+            self.assertIn(os.path.normcase("qiSharedMod.py"), sys.quickimport_cache[libDir])
+            index = sys.quickimport_cache[q.INDEX_KEY]
+            q.uninstall()
+            
+            # a writer keeps unread entries and replaces the file atomically
+            otherDir = os.path.join(tmp, "other")
+            os.mkdir(otherDir)
+            makeOld(otherDir)
+            index.load()
+            index.record(otherDir, os.stat(otherDir).st_mtime, False, [])
+            self.assertTrue(index.save())
+            index.close()
+            index = q.SharedIndex(filename)
+            self.assertTrue(index.load())
+            self.assertIsNotNone(index.lookup(libDir))
+            self.assertIsNotNone(index.lookup(otherDir))
+            index.close()
+        finally:
+            shutil.rmtree(tmp)
+
+    def testLazy(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            for name in ("qiLazyMod", "qiEagerMod"):
+                with open(os.path.join(tmp, name + ".py"), "w") as f:
+                    f.write("import sys\nsys.qiLoaded.append(__name__)\nX = 1\n")
+            os.mkdir(os.path.join(tmp, "qiLazyPkg"))
+            with open(os.path.join(tmp, "qiLazyPkg", "__init__.py"), "w") as f:
+                f.write("import sys\nsys.qiLoaded.append(__name__)\nSTATE = 3\n")
+            with open(os.path.join(tmp, "qiLazyPkg", "sub.py"), "w") as f:
+                # depends on the package
+                f.write("import sys\nsys.qiLoaded.append(__name__)\n"
+                        "Y = sys.modules['qiLazyPkg'].STATE - 1\n")
+            sys.path.insert(0, tmp)
+            sys.qiLoaded = []
+            
+            q.install("lazy lazyDeny=qiEager*")
+            import qiLazyMod
+            import qiEagerMod
+            import qiLazyPkg.sub
+            # the import of the sub-module executes the package
+            self.assertEqual(["qiEagerMod", "qiLazyPkg"], sys.qiLoaded)
+            self.assertEqual(1, qiLazyMod.X)
+            self.assertEqual(2, qiLazyPkg.sub.Y)
+            self.assertEqual(["qiEagerMod", "qiLazyPkg", "qiLazyMod", "qiLazyPkg.sub"], 
+                             sys.qiLoaded)
+            self.assertRaises(AttributeError, getattr, qiLazyMod, "noSuchAttribute")
+            q.uninstall()
+            self.assertFalse(q.isLazyModule("qiLazyMod"))
+        finally:
+            del sys.qiLoaded
+            for name in ("qiLazyMod", "qiEagerMod", "qiLazyPkg", "qiLazyPkg.sub"):
+                sys.modules.pop(name, None)
+            shutil.rmtree(tmp)
+
+    def testOptimizePath(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            dirs = []
+            for name in ("a", "b", "c"):
+                dirs.append(os.path.join(tmp, name))
+                os.mkdir(dirs[-1])
+            a, b, c = dirs
+            writeFile(a, "qiOptShared.py")
+            writeFile(b, "qiOptShared.py")
+            writeFile(b, "qiOptB.py")
+            writeFile(c, "qiOptC.py")
+            os.mkdir(os.path.join(c, "qiOptPkg"))
+            writeFile(c, "qiOptPkg", "__init__.py")
+            for dir in dirs:
+                makeOld(dir)
+            trace = [("qiOptShared", os.path.join(a, "qiOptShared.py")),
+                     ("qiOptB", os.path.join(b, "qiOptB.py")),
+                     ("qiOptC", os.path.join(c, "qiOptC.py")),
+                     ("qiOptPkg", os.path.join(c, "qiOptPkg", "__init__.py")),
+                     ("qiOptPkg.sub", os.path.join(c, "qiOptPkg", "sub.py"))]
+            
+            q.install()
+            # a keeps preceding b, because both provide qiOptShared
+            self.assertEqual(([c, a, b], 1 + 2 + 3 + 3, 2 + 3 + 1 + 1), 
+                             q.optimizePath(trace, dirs))
+            # relative items keep their position
+            self.assertEqual(['', c, a, b], q.optimizePath(trace, [''] + dirs)[0])
+            q.uninstall()
+            
+            traceFile = os.path.join(tmp, "trace")
+            recorder = q.TraceRecorder(traceFile)
+            for fullname, filename in trace:
+                recorder.record(fullname, filename)
+            recorder.save()
+            q.install("optimizePath=" + traceFile, dirs)
+            self.assertEqual([c, a, b], dirs)
+        finally:
+            shutil.rmtree(tmp)
+
+    def testTrustBytecode(self):
+        import py_compile
+        tmp = tempfile.mkdtemp()
+        indexDir = tempfile.mkdtemp()
+        statted = []
+        def stat(path):
+            statted.append(path)
+            return origStat(path)
+        origStat = os.stat
+        try:
+            source = os.path.join(tmp, "qiTrustMod.py")
+            with open(source, "w") as f:
+                f.write("X = 1\n")
+            makeOld(source)
+            py_compile.compile(source, doraise=True)
+            # same size and mtime: the compiled file is up to date
+            st = os.stat(source)
+            with open(source, "w") as f:
+                f.write("X = 3\n")
+            os.utime(source, (st.st_atime, st.st_mtime))
+            for name in os.listdir(tmp):
+                makeOld(os.path.join(tmp, name))
+            makeOld(tmp)
+            sys.path.insert(0, tmp)
+            indexFile = os.path.join(indexDir, "index")
+            
+            # the first run reads the directory, the second one 
+            # takes the stats of the source files from the index
+            for i in range(2):
+                with CountingListdir() as counter:
+                    q.install("trustBytecode", indexFile=indexFile)
+                self.assertEqual(i == 0, tmp in counter.dirs)
+                if q.PY3:
+                    q.TrustedSourceFileLoader.path_stats = lambda self, path: stat(path)
+                else:
+                    os.stat = stat
+                try:
+                    import qiTrustMod
+                finally:
+                    os.stat = origStat
+                    if q.PY3:
+                        del q.TrustedSourceFileLoader.path_stats
+                self.assertEqual(1, qiTrustMod.X)
+                self.assertNotIn(source, statted)
+                if q.PY3:
+                    self.assertEqual(source, qiTrustMod.__file__)
+                q.uninstall()
+                del sys.modules["qiTrustMod"]
+            
+            # the compiled file is stale now
+            with open(source, "w") as f:
+                f.write("X = 22\n")
+            q.install("trustBytecode")
+            import qiTrustMod
+            self.assertEqual(22, qiTrustMod.X)
+        finally:
+            sys.modules.pop("qiTrustMod", None)
+            shutil.rmtree(tmp)
+            shutil.rmtree(indexDir)
+
+    def testIterModules(self):
+        import pkgutil
+        tmp = tempfile.mkdtemp()
+        try:
+            writeFile(tmp, "qiIterMod.py")
+            writeFile(tmp, "qiIterData.txt")
+            for name in ("qiIterPkg", "qiIterNoPkg"):
+                os.mkdir(os.path.join(tmp, name))
+            writeFile(tmp, "qiIterPkg", "__init__.py")
+            writeFile(tmp, "qiIterPkg", "sub.py")
+            writeFile(tmp, "qiIterNoPkg", "sub.py")
+            for name in os.listdir(tmp):
+                makeOld(os.path.join(tmp, name))
+            makeOld(tmp)
+            expected = [("qiIterMod", False), ("qiIterPkg", True)]
+            
+            pkgDir = os.path.join(tmp, "qiIterPkg")
+            q.install(None, [tmp, pkgDir])
+            finder = q.getPathEntryFinder(tmp)
+            self.assertIsInstance(finder, q.QuickimportFinder)
+            self.assertEqual(expected, sorted(finder.iter_modules()))
+            # other directories don't get cached
+            self.assertNotIn(os.path.join(tmp, "qiIterNoPkg"), sys.quickimport_cache)
+            with CountingListdir() as counter:
+                modules = sorted(pkgutil.iter_modules([tmp], "x."))
+                subModules = list(pkgutil.iter_modules([pkgDir]))
+            self.assertEqual([], counter.dirs)
+            self.assertEqual([("x." + name, ispkg) for name, ispkg in expected], 
+                             [(name, ispkg) for finder, name, ispkg in modules])
+            self.assertEqual(["sub"], [name for finder, name, ispkg in subModules])
+            
+            try:
+                import pkg_resources
+            except ImportError:
+                return
+            self.assertTrue(q.registerPkgResourcesFinder())
+            with CountingListdir() as counter:
+                self.assertEqual([], list(pkg_resources.find_distributions(tmp)))
+            self.assertEqual([], counter.dirs)
+            os.mkdir(os.path.join(tmp, "qiIterDist-1.0.dist-info"))
+            writeFile(tmp, "qiIterDist-1.0.dist-info", "METADATA")
+            q.refreshCache()
+            self.assertEqual(["qiIterDist"], [dist.project_name for dist in 
+                                              pkg_resources.find_distributions(tmp)])
+        finally:
+            shutil.rmtree(tmp)
+
+    def testResources(self):
+        import pkgutil
+        tmp = tempfile.mkdtemp()
+        try:
+            pkgDir = os.path.join(tmp, "qiResPkg")
+            os.mkdir(pkgDir)
+            writeFile(pkgDir, "__init__.py")
+            data = os.path.join(pkgDir, "data.txt")
+            with open(data, "wb") as f:
+                f.write(b"abc")
+            for dir in (data, pkgDir, tmp):
+                makeOld(dir)
+            sys.path.insert(0, tmp)
+            
+            q.install("resourceCache")
+            import qiResPkg
+            loader = getattr(qiResPkg, "__loader__", None) or pkgutil.get_loader("qiResPkg")
+            self.assertTrue(loader.is_resource("data.txt"))
+            self.assertFalse(loader.is_resource("missing.txt"))
+            self.assertEqual(b"abc", pkgutil.get_data("qiResPkg", "data.txt"))
+            self.assertEqual(b"abc", pkgutil.get_data("qiResPkg", "data.txt"))
+            self.assertEqual(1, q.RESOURCES.hits)
+            self.assertRaises(IOError, pkgutil.get_data, "qiResPkg", "missing.txt")
+            
+            # a modified file is read again
+            with open(data, "wb") as f:
+                f.write(b"abcd")
+            self.assertEqual(b"abcd", pkgutil.get_data("qiResPkg", "data.txt"))
+            self.assertEqual(1, q.RESOURCES.hits)
+            self.assertEqual(4, q.RESOURCES.size)
+        finally:
+            sys.modules.pop("qiResPkg", None)
+            shutil.rmtree(tmp)
+
+    def testProfile(self):
+        import json
+        tmp = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(tmp, "qiProfA.py"), "w") as f:
+                f.write("import qiProfB\n")
+            writeFile(tmp, "qiProfB.py")
+            for name in os.listdir(tmp):
+                makeOld(os.path.join(tmp, name))
+            makeOld(tmp)
+            sys.path.insert(0, tmp)
+            jsonFile = os.path.join(tmp, "profile.json")
+            foldedFile = os.path.join(tmp, "profile.folded")
+            
+            q.install("profile=%s profileFolded=%s" % (jsonFile, foldedFile))
+            import qiProfA
+            self.assertIs(q.PROFILER, q.stopProfile())
+            self.assertIsNone(q.PROFILER)
+            
+            with open(jsonFile) as f:
+                root = json.load(f)
+            nodes = dict((node["name"], node) for node in root["children"])
+            a = nodes["qiProfA"]
+            self.assertEqual(["qiProfB"], [node["name"] for node in a["children"]])
+            b = a["children"][0]
+            for node in (a, b):
+                self.assertGreater(node["find"], 0)
+                self.assertAlmostEqual(node["find"], node["findCache"] + node["findFs"])
+                self.assertGreater(node["total"], 0)
+                self.assertLessEqual(node["load"] + node["exec"], node["total"] + 1e-9)
+            self.assertGreaterEqual(a["total"], b["find"] + b["total"])
+            with open(foldedFile) as f:
+                stacks = [line.rsplit(" ", 1)[0] for line in f]
+            self.assertIn("qiProfA;qiProfB;[find cache]", stacks)
+        finally:
+            for name in ("qiProfA", "qiProfB"):
+                sys.modules.pop(name, None)
+            shutil.rmtree(tmp)